@@ -87,7 +87,7 @@ import io
 from components.llm import llm, oai_embeddings
 from components.categories import MAJOR_CATEGORIES, MEDIUM_CATEGORIES
 from components.prompts import RAG_PROMPT_TEMPLATE
-from components.chat_history import ChatHistory
+from components.chat_history import ChatHistory, OLDER_PAGE_SIZE
 
 # セッション状態の初期化
 if 'documents' not in st.session_state:
@@ -165,8 +165,8 @@ def get_vector_store():
         logger.error(traceback.format_exc())
         return None
 
-def register_document(uploaded_file):
-    """アップロードされたファイルをドキュメントとして登録"""
+def register_document(uploaded_file, metadata=None):
+    """アップロードされたファイルをドキュメントとして登録（同じファイルの再登録は差分のみ反映）"""
     try:
         logger.info("ファイルアップロード処理開始: %s", datetime.datetime.now())
         logger.info("ファイル情報:")
@@ -219,12 +219,17 @@ def register_document(uploaded_file):
 
         # ドキュメントの登録
         if vector_store.available:
-            success = vector_store.upsert_documents([content])
-            if success:
+            # ファイル名をドキュメントの識別に使う
+            doc_metadata = {**(metadata or {}), "file_name": uploaded_file.name}
+            report = vector_store.upsert_documents([content], [doc_metadata])
+            logger.info("アップロード結果: %d/%d件 (%dバッチ, 変更なし: %d件, 削除: %d件)",
+                        report["upserted_count"], report["total_vectors"], len(report["batches"]),
+                        report.get("skipped_count", 0), report.get("deleted_count", 0))
+            if report["success"]:
                 logger.info("ドキュメントの登録が完了しました")
                 return True
             else:
-                logger.error("ドキュメントの登録に失敗しました")
+                logger.error("ドキュメントの登録に失敗しました: 失敗したベクトル %d件", len(report["failed_ids"]))
                 return False
         else:
             logger.error("ベクトルDBが利用できません")
@@ -354,7 +359,7 @@ def manage_db():
                 logger.info(f"メタデータ: {metadata}")
                 
                 # ドキュメント登録関数を呼び出し
-                if register_document(uploaded_file):
+                if register_document(uploaded_file, metadata):
                     logger.info("ドキュメント登録が完了しました")
                     st.success("ドキュメントの登録が完了しました！")
                 else:
@@ -381,14 +386,45 @@ def manage_db():
                 logger.info(f"データベース内のドキュメント数: {count}")
                 st.info(f"データベースには{count}件のドキュメントが登録されています")
                 
-                # 注意: Pineconeは全件取得に対応していないため、検索結果のみ表示
-                st.warning("Pineconeでは全件表示ができません。検索フォームを使ってドキュメントを検索してください。")
-                
             except Exception as e:
                 logger.error(f"ドキュメント取得中にエラー: {e}")
                 logger.error(traceback.format_exc())
                 st.error(f"ドキュメント取得中にエラーが発生しました: {e}")
                 st.exception(e)
+    
+    # 登録済みファイルの一覧（ローカルの台帳から取得するため、Pineconeには問い合わせない）
+    registered_documents = []
+    if vector_store and hasattr(vector_store, 'list_documents'):
+        try:
+            total_documents = vector_store.count_documents(municipality=filter_municipality, category=filter_category)
+            page_size = 50
+            page_count = max(1, (total_documents + page_size - 1) // page_size)
+            page = st.number_input(f"ページ（全{page_count}ページ, {total_documents}ファイル）", min_value=1, max_value=page_count, value=1)
+            registered_documents = vector_store.list_documents(
+                offset=(page - 1) * page_size,
+                limit=page_size,
+                municipality=filter_municipality,
+                category=filter_category
+            )
+            if registered_documents:
+                st.dataframe(pd.DataFrame([
+                    {
+                        "ファイル名": doc["name"],
+                        "市区町村名": doc["metadata"].get("municipality"),
+                        "大カテゴリ": doc["metadata"].get("major_category"),
+                        "中カテゴリ": doc["metadata"].get("medium_category"),
+                        "チャンク数": doc["chunk_count"],
+                        "更新日時": datetime.datetime.fromtimestamp(doc["updated_at"]).strftime('%Y-%m-%d %H:%M:%S'),
+                        "ドキュメントID": doc["doc_id"],
+                    }
+                    for doc in registered_documents
+                ]), use_container_width=True)
+            else:
+                st.info("登録済みのファイルはありません")
+        except Exception as e:
+            logger.error(f"登録済みファイルの一覧の取得中にエラー: {e}")
+            logger.error(traceback.format_exc())
+            st.error(f"登録済みファイルの一覧の取得中にエラーが発生しました: {e}")
 
     # 3.データベース操作（メンテナンス機能）
     with st.expander("データベースメンテナンス", expanded=False):
@@ -415,6 +451,26 @@ def manage_db():
                         logger.error(traceback.format_exc())
                         st.error(f"削除中にエラーが発生しました: {e}")
                         st.exception(e)
+        
+        with col2:
+            # 登録したファイル単位での削除（全チャンクを削除）
+            if registered_documents:
+                labels = {f"{doc['name'] or doc['doc_id']} ({doc['chunk_count']}チャンク)": doc["doc_id"] for doc in registered_documents}
+                selected_label = st.selectbox("削除するファイル", list(labels.keys()))
+                if st.button("ファイルを削除"):
+                    doc_id = labels[selected_label]
+                    logger.info(f"ファイル削除処理を開始: {selected_label} ({doc_id})")
+                    with st.spinner('削除中...'):
+                        try:
+                            if vector_store.delete_document(doc_id):
+                                st.success(f"{selected_label} を削除しました")
+                            else:
+                                st.error(f"{selected_label} の削除に失敗しました")
+                        except Exception as e:
+                            logger.error(f"削除中にエラー: {e}")
+                            logger.error(traceback.format_exc())
+                            st.error(f"削除中にエラーが発生しました: {e}")
+                            st.exception(e)
 
     logger.info("="*50)
     logger.info(f"ベクトルDB管理ページの処理を完了: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
@@ -428,6 +484,7 @@ def chat_interface():
     # リセットボタン
     if st.sidebar.button("会話をリセット"):
         chat_history.clear_history()
+        st.session_state.older_messages_shown = 0
         st.sidebar.success("会話履歴をリセットしました")
         st.rerun()
     
@@ -445,6 +502,15 @@ def chat_interface():
         RAG_PROMPT_TEMPLATE
     )
     
+    # メモリにない過去の会話は、表示を求められた分だけ保存先から読み込む
+    if chat_history.has_older():
+        if st.button("以前の会話を表示"):
+            st.session_state.older_messages_shown = st.session_state.get("older_messages_shown", 0) + OLDER_PAGE_SIZE
+        shown = st.session_state.get("older_messages_shown", 0)
+        for message in chat_history.load_older(limit=shown) if shown else []:
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+    
     # 会話履歴の表示
     for message in chat_history.get_history():
         role = message["role"]
@@ -602,12 +668,13 @@ def dashboard():
     col1, col2 = st.columns(2)
     
     with col1:
-        st.metric("会話数", len(chat_history.get_history()) // 2)
+        st.metric("会話数", chat_history.message_count() // 2)
         
     with col2:
         if vector_store_available:
-            doc_count = vector_store.count()
-            st.metric("登録ドキュメント数", doc_count)
+            # 統計はキャッシュから表示し、未取得の場合もPineconeの応答を待たない
+            doc_count = vector_store.count(wait=False)
+            st.metric("登録ドキュメント数", doc_count if doc_count is not None else "取得中")
         else:
             st.metric("登録ドキュメント数", "N/A")
             st.info("ベクトルデータベースが接続されていません")
@@ -687,14 +754,14 @@ page = st.sidebar.radio(
     ["ドキュメントに質問する", "ベクトルDB管理", "プロンプト管理", "ダッシュボード"]
 )
 
-# セッション終了時に会話履歴を保存
+# 会話履歴の保存を予約（バックグラウンドで保存されるため待たない。変更がなければ何もしない）
 try:
-    if chat_history.pinecone_available:
-        saved = chat_history.force_save()
-        if saved:
-            logger.info("会話履歴を保存しました")
+    if chat_history.storage_available:
+        scheduled = chat_history.force_save()
+        if scheduled:
+            logger.info("会話履歴の保存を予約しました")
 except Exception as e:
-    logger.error(f"会話履歴の保存中にエラー: {e}")
+    logger.error(f"会話履歴の保存予約中にエラー: {e}")
 
 # ページに応じた表示
 if page == "ドキュメントに質問する":
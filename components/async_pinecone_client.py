@@ -0,0 +1,225 @@
+import asyncio
+import random
+import threading
+import traceback
+from components.http_transport import HTTPX_AVAILABLE, env_int, get_transport
+from components.payload_codec import dumps_json
+
+if HTTPX_AVAILABLE:
+    import httpx
+
+# 同時実行数のデフォルト（環境変数 PINECONE_MAX_CONCURRENCY で上書き可能）
+DEFAULT_MAX_CONCURRENCY = 8
+
+# 再試行の対象とするステータスコード
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class AsyncPineconeClient:
+    """asyncioネイティブなPinecone REST APIクライアント
+
+    同時実行数はセマフォで制限し、キャンセルされたタスクは待機中のバックオフも含めて即座に中断する。
+    HTTPクライアント（接続プール）は共有HTTPトランスポートのものを使う。
+    同期コードからは run_sync() でバックグラウンドのイベントループ上に処理を投入できる。
+    """
+
+    def __init__(self, api_key, index_name, base_url="https://api.pinecone.io",
+                 max_concurrency=None, timeout=30, max_retries=3):
+        if not HTTPX_AVAILABLE:
+            raise ImportError("httpxが利用できないため、AsyncPineconeClientを初期化できません")
+
+        self.api_key = api_key
+        self.index_name = index_name
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency or env_int("PINECONE_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.headers = {
+            "Api-Key": self.api_key,
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+        }
+
+        # セマフォはイベントループごとに保持する
+        self._semaphores = {}
+        self._semaphores_lock = threading.Lock()
+
+    def _get_semaphore(self):
+        """現在のイベントループ用のセマフォを取得"""
+        loop = asyncio.get_running_loop()
+        with self._semaphores_lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def _request(self, method, path, json_data=None, params=None, max_retries=None):
+        """REST APIリクエストを実行する共通メソッド（失敗時はNoneを返す）"""
+        client = get_transport().async_client()
+        semaphore = self._get_semaphore()
+        url = f"{self.base_url}{path}"
+        max_retries = max_retries or self.max_retries
+        # 本文は再試行でも使い回す（日本語を\uエスケープしないUTF-8）
+        body = dumps_json(json_data) if json_data is not None and method.upper() != "GET" else None
+
+        for attempt in range(max_retries):
+            try:
+                async with semaphore:
+                    response = await client.request(
+                        method.upper(),
+                        url,
+                        headers=self.headers,
+                        content=body,
+                        params=params,
+                        timeout=self.timeout * (1 + attempt * 0.5)
+                    )
+
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    if response.status_code >= 400:
+                        print(f"非同期リクエストエラー: {method} {path} -> {response.status_code} {response.text[:300]}")
+                    return response
+
+                if response.status_code == 429:
+                    wait_time = float(response.headers.get("Retry-After", min(2 ** (attempt + 1) + 5, 45)))
+                else:
+                    wait_time = min(2 ** (attempt + 1), 30)
+                print(f"非同期リクエスト再試行 ({response.status_code}): {wait_time}秒後 ({attempt + 1}/{max_retries})")
+            except asyncio.CancelledError:
+                raise
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                wait_time = min(5 * (attempt + 1), 30)
+                print(f"非同期リクエストの通信エラー: {e} - {wait_time}秒後に再試行 ({attempt + 1}/{max_retries})")
+            except Exception as e:
+                print(f"非同期リクエスト中のエラー: {e}")
+                print(traceback.format_exc())
+                return None
+
+            if attempt < max_retries - 1:
+                # ジッターを加えて同時に失敗したタスクの再試行を分散させる
+                await asyncio.sleep(wait_time * (0.5 + random.random() / 2))
+
+        print(f"非同期リクエストに失敗しました: {method} {path}")
+        return None
+
+    @staticmethod
+    def _json(response):
+        """成功レスポンスのJSONを返す（失敗時はNone）"""
+        if response is None or response.status_code not in (200, 201, 202):
+            return None
+        try:
+            return response.json()
+        except Exception as e:
+            print(f"レスポンスのJSON解析エラー: {e}")
+            return None
+
+    async def query(self, vector, top_k=5, filter=None, namespace="", include_metadata=True, include_values=False,
+                    sparse_vector=None):
+        """ベクトル検索を実行してレスポンスのJSONを返す（sparse_vector指定時はスパース・デンス検索）"""
+        data = {
+            "vector": vector,
+            "topK": top_k,
+            "includeMetadata": include_metadata,
+            "includeValues": include_values,
+            "namespace": namespace
+        }
+        if filter:
+            data["filter"] = filter
+        if sparse_vector:
+            data["sparseVector"] = sparse_vector
+        return self._json(await self._request("POST", f"/query/{self.index_name}", json_data=data))
+
+    async def upsert(self, vectors, namespace=""):
+        """ベクトルをアップサートしてレスポンスのJSONを返す"""
+        data = {"vectors": vectors}
+        if namespace:
+            data["namespace"] = namespace
+        return self._json(await self._request("POST", f"/vectors/upsert/{self.index_name}", json_data=data))
+
+    async def upsert_batch(self, vectors, namespace="", max_retries=None):
+        """1バッチをアップサートし、結果の詳細を返す
+
+        戻り値: {"ok", "status_code", "upserted_count", "error"}
+        """
+        data = {"vectors": vectors}
+        if namespace:
+            data["namespace"] = namespace
+        response = await self._request("POST", f"/vectors/upsert/{self.index_name}", json_data=data, max_retries=max_retries)
+        if response is None:
+            return {"ok": False, "status_code": None, "upserted_count": 0, "error": "request_failed"}
+        if response.status_code not in (200, 201, 202):
+            return {"ok": False, "status_code": response.status_code, "upserted_count": 0, "error": response.text[:300]}
+        body = self._json(response) or {}
+        return {"ok": True, "status_code": response.status_code, "upserted_count": body.get("upsertedCount", len(vectors)), "error": None}
+
+    async def fetch(self, ids, namespace=""):
+        """IDを指定してベクトルを取得"""
+        params = {"ids": ids, "namespace": namespace}
+        return self._json(await self._request("GET", f"/vectors/fetch/{self.index_name}", params=params))
+
+    async def delete(self, ids, namespace=""):
+        """IDを指定してベクトルを削除"""
+        data = {"ids": ids, "namespace": namespace}
+        response = await self._request("POST", f"/vectors/delete/{self.index_name}", json_data=data)
+        return response is not None and response.status_code in (200, 201, 202)
+
+    async def describe_index_stats(self):
+        """インデックス統計を取得"""
+        return self._json(await self._request("GET", f"/describe_index_stats/{self.index_name}"))
+
+    async def gather_limited(self, coros, limit=None):
+        """同時実行数を制限してコルーチンを実行し、入力順に結果を返す
+
+        いずれかが例外で終了した場合は残りのタスクをキャンセルして例外を送出する。
+        """
+        semaphore = asyncio.Semaphore(limit or self.max_concurrency)
+
+        async def _run(coro):
+            async with semaphore:
+                return await coro
+
+        tasks = [asyncio.ensure_future(_run(c)) for c in coros]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def aclose(self):
+        """現在のイベントループに紐づく共有HTTPクライアントを閉じる"""
+        loop = asyncio.get_running_loop()
+        with self._semaphores_lock:
+            self._semaphores.pop(loop, None)
+        await get_transport().aclose_async_client()
+
+    def run_sync(self, coro, timeout=None):
+        """同期コードからコルーチンを実行して結果を返す
+
+        タイムアウトした場合はタスクをキャンセルしてTimeoutErrorを送出する。
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+
+# 同期APIから利用するバックグラウンドのイベントループ（プロセスで1つ）
+_background_loop = None
+_background_lock = threading.Lock()
+
+
+def get_background_loop():
+    """バックグラウンドスレッドで動作するイベントループを取得"""
+    global _background_loop
+    if _background_loop is None:
+        with _background_lock:
+            if _background_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="pinecone-async-loop", daemon=True)
+                thread.start()
+                _background_loop = loop
+    return _background_loop
+
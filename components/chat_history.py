@@ -3,78 +3,78 @@ from typing import List, Dict, Any
 import pandas as pd
 import io
 import os
-import time
 import traceback
+from collections import deque
 
-# Pineconeクライアントをインポート - try-exceptで囲む
-try:
-    from components.pinecone_client import PineconeClient
-    PINECONE_IMPORT_SUCCESS = True
-except ImportError as e:
-    print(f"Pineconeクライアントのインポートエラー: {e}")
-    PINECONE_IMPORT_SUCCESS = False
+from components.chat_history_store import create_chat_history_backend
+from components.chat_history_writer import get_chat_history_writer
+from components.chat_session import get_session_registry
+
+# メモリに保持する直近のメッセージ数（環境変数 CHAT_HISTORY_WINDOW で上書き可能）
+DEFAULT_HISTORY_WINDOW = 40
+# 過去の会話を読み込む1回あたりのメッセージ数
+OLDER_PAGE_SIZE = 20
+# force_save(wait=True) で保存の完了を待つ最大時間（秒）
+SAVE_WAIT_TIMEOUT = 10.0
 
 class ChatHistory:
+    """ブラウザのセッションごとの会話履歴
+
+    メモリ（セッション状態）には直近のwindow件だけを保持し、それより古いメッセージは保存先に任せる
+    （必要になった時点で load_older() で読み込む）。chat_history_offset は保持している先頭の
+    メッセージの会話全体での位置。保存先が利用できない場合は全件をメモリに保持する。
+    """
+
     def __init__(self):
-        # Pineconeクライアントの初期化
-        self.pinecone_available = False
-        
-        # セッション状態にPinecone初期化済みフラグがあれば再初期化しない
-        if 'pinecone_initialized' in st.session_state:
-            self.pinecone_available = st.session_state.get('pinecone_available', False)
-            if self.pinecone_available and 'pinecone_client' in st.session_state:
-                self.pinecone_client = st.session_state.pinecone_client
-                print("セッション状態からPineconeクライアントを復元しました")
-            return
-                
-        if PINECONE_IMPORT_SUCCESS:
+        self.window = int(os.environ.get("CHAT_HISTORY_WINDOW", DEFAULT_HISTORY_WINDOW))
+        # 会話履歴の保存先（環境変数 CHAT_HISTORY_BACKEND で選択。既定はローカルのSQLite）
+        # セッション状態に初期化済みの保存先があれば再初期化しない
+        if 'chat_history_backend_initialized' in st.session_state:
+            self.backend = st.session_state.get('chat_history_backend')
+        else:
             try:
-                print("Pineconeクライアントの初期化を開始します...")
-                self.pinecone_client = PineconeClient()
-                # クライアントの接続状態をチェック
-                self.pinecone_available = getattr(self.pinecone_client, 'available', False)
-                # セッション状態に保存
-                if self.pinecone_available:
-                    st.session_state.pinecone_client = self.pinecone_client
-                    st.session_state.pinecone_available = True
-                    print("Pineconeクライアントを初期化しました")
-                else:
-                    print("Pineconeクライアントは利用できませんが、ローカルモードで継続します")
+                self.backend = create_chat_history_backend(pinecone_client=st.session_state.get('pinecone_client'))
             except Exception as e:
-                print(f"Pineconeの初期化エラー: {e}")
+                print(f"会話履歴の保存先の初期化エラー: {e}")
                 print(f"詳細なエラー情報: {traceback.format_exc()}")
-                self.pinecone_available = False
-                st.session_state.pinecone_available = False
-                
-        # 初期化したフラグを設定
-        st.session_state.pinecone_initialized = True
+                self.backend = None
+            st.session_state.chat_history_backend = self.backend
+            st.session_state.chat_history_backend_initialized = True
+            if self.backend is not None:
+                print(f"会話履歴の保存先: {self.backend.name}")
+                # Pineconeの保存先を使う場合はクライアントをベクトルストアと共有する
+                client = getattr(self.backend, 'client', None)
+                if client is not None and 'pinecone_client' not in st.session_state:
+                    st.session_state.pinecone_client = client
+        self.storage_available = self.backend is not None and self.backend.available
+        
+        self.session_id = get_session_registry().resolve()
         
-        # セッション状態に会話履歴が存在しない場合は初期化
+        # セッション状態に会話履歴が存在しない場合は保存先から直近のメッセージだけを復元
         if 'chat_history' not in st.session_state:
-            # Pineconeから履歴をロード
-            if self.pinecone_available:
+            messages, offset = [], 0
+            if self.storage_available:
                 try:
-                    loaded_history = self.pinecone_client.load_chat_history()
-                    if loaded_history:
-                        st.session_state.chat_history = loaded_history
-                        print("Pineconeから会話履歴を復元しました")
+                    count = self.backend.count(self.session_id)
+                    offset = max(0, count - self.window)
+                    messages = self.backend.load_range(self.session_id, offset, count) if count else []
+                    # 読み込んだ内容は保存済みとして記録し、次の保存予約で書き直さない
+                    get_chat_history_writer().mark_saved(self.session_id, messages, offset)
+                    if messages:
+                        print(f"会話履歴を復元しました（{self.backend.name}）: {count}件中の直近{len(messages)}件")
                     else:
-                        st.session_state.chat_history = []
-                        print("Pineconeに復元可能な会話履歴がありませんでした")
+                        print("復元可能な会話履歴がありませんでした")
                 except Exception as e:
                     print(f"会話履歴のロードエラー: {e}")
                     print(f"詳細なエラー情報: {traceback.format_exc()}")
-                    st.session_state.chat_history = []
+                    messages, offset = [], 0
             else:
-                st.session_state.chat_history = []
-                print("Pineconeが利用できないため、ローカルのみで会話履歴を管理します")
+                print("会話履歴の保存先が利用できないため、ローカルのみで会話履歴を管理します")
+            st.session_state.chat_history = deque(messages, maxlen=self.window if self.storage_available else None)
+            st.session_state.chat_history_offset = offset
         
         if 'current_context' not in st.session_state:
             st.session_state.current_context = []
-        
-        # 前回の保存時刻を記録
-        if 'last_save_time' not in st.session_state:
-            st.session_state.last_save_time = time.time()
     
     def add_message(self, role: str, content: str, metadata: Dict[str, Any] = None):
         """メッセージを会話履歴に追加"""
@@ -83,11 +83,15 @@ class ChatHistory:
             'content': content,
             'metadata': metadata or {}
         }
-        st.session_state.chat_history.append(message)
+        history = st.session_state.chat_history
+        if history.maxlen is not None and len(history) == history.maxlen:
+            # 窓から溢れる最も古いメッセージは保存先にだけ残る
+            st.session_state.chat_history_offset += 1
+        history.append(message)
         
-        # Pineconeに保存（メッセージが追加されるたびに保存すると負荷が高いため、
-        # 最後の保存から一定時間経過している場合のみ保存）
-        self._save_to_pinecone_if_needed()
+        # 保存はバックグラウンドのライターに任せる（連続した追加は1回の保存にまとめられる。
+        # 窓から溢れた未保存のメッセージはライターの予約に引き継がれる）
+        self._schedule_save()
     
     def add_context(self, context: str):
         """コンテキストを追加"""
@@ -98,8 +102,39 @@ class ChatHistory:
         st.session_state.current_context = []
     
     def get_history(self) -> List[Dict[str, Any]]:
-        """会話履歴を取得"""
-        return st.session_state.chat_history
+        """メモリに保持している直近の会話履歴を取得"""
+        return list(st.session_state.chat_history)
+    
+    def message_count(self) -> int:
+        """会話全体のメッセージ数"""
+        return st.session_state.chat_history_offset + len(st.session_state.chat_history)
+    
+    def has_older(self) -> bool:
+        """メモリにない過去のメッセージがあるか"""
+        return st.session_state.chat_history_offset > 0
+    
+    def load_older(self, limit: int = OLDER_PAGE_SIZE, before: int = None) -> List[Dict[str, Any]]:
+        """メモリにない過去のメッセージを保存先から読み込む
+
+        before番目（省略時はメモリの先頭）の手前のlimit件を返す。読み込んだメッセージはメモリに保持しない。
+        """
+        if not self.storage_available:
+            return []
+        offset = st.session_state.chat_history_offset
+        before = offset if before is None else min(before, offset)
+        start = max(0, before - limit)
+        if start >= before:
+            return []
+        try:
+            # 窓から溢れたメッセージがまだ保存待ちの場合は、保存を待たずにライターの予約から読む
+            pending = get_chat_history_writer().pending_messages(self.session_id, start, before)
+            stored_end = min(pending, default=before)
+            messages = self.backend.load_range(self.session_id, start, stored_end) if start < stored_end else []
+            return messages + [pending[position] for position in range(stored_end, before) if position in pending]
+        except Exception as e:
+            print(f"過去の会話履歴の読み込みエラー: {e}")
+            print(f"詳細なエラー情報: {traceback.format_exc()}")
+            return []
     
     def get_context(self) -> List[str]:
         """現在のコンテキストを取得"""
@@ -107,18 +142,12 @@ class ChatHistory:
     
     def clear_history(self):
         """会話履歴をクリア"""
-        st.session_state.chat_history = []
+        st.session_state.chat_history.clear()
+        st.session_state.chat_history_offset = 0
         st.session_state.current_context = []
         
-        # Pineconeに空の履歴を保存（履歴クリアを同期）
-        if self.pinecone_available:
-            try:
-                self.pinecone_client.save_chat_history([])
-                st.session_state.last_save_time = time.time()
-                print("Pineconeの会話履歴をクリアしました")
-            except Exception as e:
-                print(f"会話履歴のクリア中にエラー: {e}")
-                print(f"詳細なエラー情報: {traceback.format_exc()}")
+        # 保存先の履歴もクリア（履歴クリアを同期）
+        self._schedule_save(reset=True)
     
     def get_formatted_history(self) -> str:
         """会話履歴を文字列形式で取得"""
@@ -129,12 +158,16 @@ class ChatHistory:
         return formatted
         
     def get_csv_export(self) -> bytes:
-        """会話履歴をCSV形式でエクスポート"""
-        if not self.get_history():
+        """会話履歴をCSV形式でエクスポート（メモリにない過去のメッセージも含む）"""
+        history = self.get_history()
+        if not history:
             return None
+        
+        if self.has_older():
+            history = self.load_older(limit=st.session_state.chat_history_offset) + history
             
         data = []
-        for msg in self.get_history():
+        for msg in history:
             role = "ユーザー" if msg['role'] == 'user' else "アシスタント"
             data.append({
                 "役割": role,
@@ -146,33 +179,30 @@ class ChatHistory:
         df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')  # BOM付きUTF-8でExcelでも文字化けしないように
         return csv_buffer.getvalue()
     
-    def _save_to_pinecone_if_needed(self):
-        """必要に応じてPineconeに会話履歴を保存"""
-        # Pineconeが利用可能で、最後の保存から一定時間（30秒）経過している場合に保存
-        current_time = time.time()
-        if (self.pinecone_available and 
-            (current_time - st.session_state.last_save_time > 30)):
-            try:
-                result = self.pinecone_client.save_chat_history(st.session_state.chat_history)
-                if result:
-                    st.session_state.last_save_time = current_time
-                    print("会話履歴をPineconeに保存しました")
-            except Exception as e:
-                print(f"会話履歴の保存中にエラー: {e}")
-                print(f"詳細なエラー情報: {traceback.format_exc()}")
+    def _schedule_save(self, reset: bool = False):
+        """現在の会話履歴の保存をバックグラウンドのライターに予約（待たずに戻る）"""
+        if not self.storage_available:
+            return False
+        try:
+            return get_chat_history_writer().submit(
+                self.session_id,
+                st.session_state.chat_history,
+                self.backend.save,
+                offset=st.session_state.chat_history_offset,
+                reset=reset
+            )
+        except Exception as e:
+            print(f"会話履歴の保存予約中にエラー: {e}")
+            print(f"詳細なエラー情報: {traceback.format_exc()}")
+            return False
     
-    def force_save(self):
-        """会話履歴を強制的にPineconeに保存"""
-        if self.pinecone_available:
-            try:
-                result = self.pinecone_client.save_chat_history(st.session_state.chat_history)
-                if result:
-                    st.session_state.last_save_time = time.time()
-                    print("会話履歴を強制的にPineconeに保存しました")
-                    return True
-                return False
-            except Exception as e:
-                print(f"会話履歴の強制保存中にエラー: {e}")
-                print(f"詳細なエラー情報: {traceback.format_exc()}")
-                return False
-        return False 
\ No newline at end of file
+    def force_save(self, wait: bool = False):
+        """会話履歴を保存先に保存
+
+        通常は保存を予約するだけで待たない（前回の保存から変わっていなければ何もしない）。
+        wait=True の場合は保存の完了まで（最大SAVE_WAIT_TIMEOUT秒）待ち、保存できたかどうかを返す。
+        """
+        scheduled = self._schedule_save()
+        if not wait or not self.storage_available:
+            return scheduled
+        return get_chat_history_writer().flush(self.session_id, timeout=SAVE_WAIT_TIMEOUT)
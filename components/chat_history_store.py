@@ -0,0 +1,222 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+import traceback
+from abc import ABC, abstractmethod
+
+from components.payload_codec import encode_bytes, decode_bytes
+
+# 保存先の種類と保存先のデフォルト（環境変数 CHAT_HISTORY_BACKEND / CHAT_HISTORY_DB_PATH で上書き可能）
+DEFAULT_BACKEND = "sqlite"
+DEFAULT_DB_PATH = os.path.join(".cache", "chat_history.sqlite3")
+
+
+class ChatHistoryBackend(ABC):
+    """会話履歴の保存先のインターフェース
+
+    会話はセッションごとに0から始まる連番のメッセージ列として保存する。save() は offset 番目以降の
+    メッセージ（メモリに残っている窓）を受け取り、保存できた場合に真となる値を返す。
+    どのメソッドもバックグラウンドのライターのスレッドから呼ばれることがある。
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self.available = False
+        self._default_session_id = None
+
+    def session_id(self, session_id=None):
+        """会話履歴のセッションID（未指定なら環境変数、なければプロセスで1つ生成したID）"""
+        if session_id:
+            return session_id
+        if not self._default_session_id:
+            self._default_session_id = os.environ.get("STREAMLIT_SESSION_ID") or str(uuid.uuid4())
+        return self._default_session_id
+
+    @abstractmethod
+    def save(self, chat_history, session_id=None, offset=0, reset=False):
+        """offset番目以降のメッセージを保存（reset=True なら保存済みのoffset番目以降を置き換える）"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self, session_id=None):
+        """保存済みのメッセージ数"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_range(self, session_id, start, end):
+        """start番目からend番目の手前までのメッセージを返す"""
+        raise NotImplementedError
+
+    def load_since(self, session_id, since):
+        """その時刻（UNIX時間）以降に保存されたメッセージを返す
+
+        時刻で検索できない保存先では NotImplementedError を送出する。
+        """
+        raise NotImplementedError(f"会話履歴の保存先 {self.name} は時刻による検索に対応していません")
+
+    def load(self, session_id=None):
+        """会話履歴全体を読み込む（なければNone）"""
+        session_id = self.session_id(session_id)
+        count = self.count(session_id)
+        return self.load_range(session_id, 0, count) if count else None
+
+
+class SQLiteChatHistoryBackend(ChatHistoryBackend):
+    """会話履歴をローカルのSQLiteに保存する（既定の保存先）
+
+    メッセージは (セッションID, 連番) を主キーに1行ずつ保存し、(セッションID, 時刻) にも索引を張る。
+    保存時は前回の保存以降に追加されたメッセージだけを1トランザクションでまとめて書き込む。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path or os.environ.get("CHAT_HISTORY_DB_PATH", DEFAULT_DB_PATH)
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                role TEXT,
+                data BLOB NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_time ON chat_messages (session_id, created_at)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                session_id TEXT PRIMARY KEY,
+                message_count INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.available = True
+
+    def _saved_count(self, session_id):
+        row = self._conn.execute("SELECT message_count FROM chat_sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else 0
+
+    def save(self, chat_history, session_id=None, offset=0, reset=False):
+        """会話履歴を保存（追記分のみ。クリアや前回より短い場合はoffset番目以降を書き直す）"""
+        if chat_history is None:
+            return None
+        session_id = self.session_id(session_id)
+        now = time.time()
+        total = offset + len(chat_history)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                saved = self._saved_count(session_id)
+                if reset or total < saved:
+                    self._conn.execute("DELETE FROM chat_messages WHERE session_id = ? AND seq >= ?", (session_id, offset))
+                    saved = min(saved, offset)
+                start = max(saved, offset)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chat_messages VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (session_id, seq, now, message.get("role"), encode_bytes(message))
+                        for seq, message in enumerate(chat_history[start - offset:], start=start)
+                    ]
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO chat_sessions VALUES (?, ?, ?)",
+                    (session_id, total, now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return session_id
+
+    def count(self, session_id=None):
+        with self._lock:
+            return self._saved_count(self.session_id(session_id))
+
+    def load_range(self, session_id, start, end):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM chat_messages WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (self.session_id(session_id), start, end)
+            ).fetchall()
+        return [decode_bytes(blob) for blob, in rows]
+
+    def load_since(self, session_id, since):
+        """その時刻（UNIX時間）以降に保存されたメッセージを返す（(セッションID, 時刻) の索引を使う）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM chat_messages WHERE session_id = ? AND created_at >= ? ORDER BY seq",
+                (self.session_id(session_id), since)
+            ).fetchall()
+        return [decode_bytes(blob) for blob, in rows]
+
+
+class PineconeChatHistoryBackend(ChatHistoryBackend):
+    """会話履歴をPineconeのインデックスに保存する（PineconeClientのページ形式）"""
+
+    name = "pinecone"
+
+    def __init__(self, client=None):
+        super().__init__()
+        if client is None:
+            from components.pinecone_client import PineconeClient
+            client = PineconeClient()
+        self.client = client
+        self.available = getattr(client, 'available', False)
+
+    def session_id(self, session_id=None):
+        return self.client.chat_session_id(session_id)
+
+    def save(self, chat_history, session_id=None, offset=0, reset=False):
+        return self.client.save_chat_history(chat_history, self.session_id(session_id), offset=offset, reset=reset)
+
+    def count(self, session_id=None):
+        return self.client.chat_message_count(self.session_id(session_id))
+
+    def load_range(self, session_id, start, end):
+        return self.client.load_chat_history(self.session_id(session_id), start=start, end=end) or []
+
+
+# SQLiteの保存先はパスごとにプロセスで共有する
+_sqlite_backends = {}
+_sqlite_lock = threading.Lock()
+
+
+def create_chat_history_backend(name=None, pinecone_client=None):
+    """環境変数 CHAT_HISTORY_BACKEND（sqlite / pinecone）に応じた保存先を返す（利用できなければNone）"""
+    name = (name or os.environ.get("CHAT_HISTORY_BACKEND", DEFAULT_BACKEND)).lower()
+    if name == "pinecone":
+        try:
+            backend = PineconeChatHistoryBackend(pinecone_client)
+            if backend.available:
+                return backend
+            print("Pineconeが利用できないため、会話履歴はSQLiteに保存します")
+        except Exception as e:
+            print(f"Pineconeの会話履歴ストアの初期化エラー: {e}")
+            print(f"詳細なエラー情報: {traceback.format_exc()}")
+    elif name != "sqlite":
+        print(f"不明な会話履歴の保存先です: {name}（SQLiteを使用します）")
+
+    path = os.environ.get("CHAT_HISTORY_DB_PATH", DEFAULT_DB_PATH)
+    try:
+        with _sqlite_lock:
+            backend = _sqlite_backends.get(path)
+            if backend is None:
+                backend = SQLiteChatHistoryBackend(path)
+                _sqlite_backends[path] = backend
+        return backend
+    except Exception as e:
+        print(f"SQLiteの会話履歴ストアの初期化エラー: {e}")
+        print(f"詳細なエラー情報: {traceback.format_exc()}")
+        return None
@@ -0,0 +1,231 @@
+import os
+import time
+import atexit
+import hashlib
+import threading
+import traceback
+from collections import OrderedDict
+
+from components.payload_codec import dumps_json
+
+# 最後の変更から保存までの待ち時間と、変更が続く場合の最大待ち時間（秒、環境変数で上書き可能）
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_MAX_DELAY = 10.0
+# 保存待ち（保存中を含む）にできるセッション数
+DEFAULT_MAX_PENDING = 256
+# 保存待ちが上限に達している場合に空きを待つ最大時間（秒）
+SUBMIT_TIMEOUT = 5.0
+# 保存に失敗した場合の再試行までの待ち時間（秒）
+RETRY_DELAY = 15.0
+# 終了時に保存を待つ最大時間（秒）
+SHUTDOWN_TIMEOUT = 10.0
+
+
+def history_fingerprint(history, offset=0):
+    """会話履歴の変更検出用の値（総件数と末尾のメッセージのハッシュ。履歴は追記かクリアでのみ変わる）"""
+    return offset + len(history), hashlib.sha1(dumps_json(history[-1:])).hexdigest()
+
+
+def _merge_pending(older, newer):
+    """同じセッションの未保存の予約をまとめる
+
+    newer が older の後ろの部分（メモリから溢れた先頭を含まない窓）であれば、older にしかない
+    先頭のメッセージを引き継ぐ。newer がクリア（reset）の場合は newer だけを残す。
+    """
+    if newer["reset"] or newer["offset"] < older["offset"]:
+        return newer["history"], newer["offset"], newer["reset"]
+    prefix = older["history"][:newer["offset"] - older["offset"]]
+    return prefix + newer["history"], older["offset"], older["reset"]
+
+
+class ChatHistoryWriter:
+    """会話履歴をバックグラウンドのスレッドで保存するライトビハインドのキュー
+
+    submit() は履歴のスナップショットを登録するだけで待たない。同じセッションの保存待ちは
+    1件にまとめ（メモリの窓から溢れた未保存のメッセージは引き継ぐ）、最後の変更からdebounce秒
+    （変更が続く場合もmax_delay秒以内）で保存する。
+    前回の保存から変わっていない履歴は保存しない。プロセス終了時には保存待ちをすべて書き込む。
+    保存待ちと保存中のセッション数は max_pending を超えない（溢れる場合は新しいセッションの登録が空きを待つ）。
+    """
+
+    def __init__(self, debounce=None, max_delay=None, max_pending=DEFAULT_MAX_PENDING):
+        self.debounce = float(os.environ.get("CHAT_SAVE_DEBOUNCE", DEFAULT_DEBOUNCE)) if debounce is None else debounce
+        self.max_delay = float(os.environ.get("CHAT_SAVE_MAX_DELAY", DEFAULT_MAX_DELAY)) if max_delay is None else max_delay
+        self.max_pending = max_pending
+        # セッションID → {"history", "offset", "reset", "fingerprint", "save", "first", "due"}
+        self._pending = OrderedDict()
+        self._saved = {}
+        # 保存中のセッションID → 予約
+        self._saving = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="chat-history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, session_id, history, save, offset=0, reset=False):
+        """保存を予約する（save(history, session_id, offset=offset, reset=reset) をバックグラウンドで呼ぶ）
+
+        history は会話全体のうち offset 番目以降のメッセージ。reset=True は保存済みの offset 番目以降を
+        置き換える（クリア）ことを示す。前回の保存から変わっていなければ何もしない。
+        保存待ちが上限に達している場合は、最も古い予約を先に保存させて空きを最大SUBMIT_TIMEOUT秒待ち、
+        空かなければ登録せずにFalseを返す（未保存のままのため、次の submit() で改めて登録される）。
+        """
+        snapshot = list(history)
+        deadline = time.monotonic() + SUBMIT_TIMEOUT
+        with self._condition:
+            entry = self._pending.get(session_id)
+            if entry is None:
+                if not reset and self._saved.get(session_id) == history_fingerprint(snapshot, offset):
+                    return False
+                while len(self._pending) + len(self._saving) >= self.max_pending:
+                    remaining = deadline - time.monotonic()
+                    if self._stopped or remaining <= 0:
+                        print(f"会話履歴の保存待ちが上限（{self.max_pending}件）に達しているため、保存を予約できませんでした")
+                        return False
+                    # 最も古い予約を先に保存させる（保存が終わると空きができる）
+                    for key, oldest in self._pending.items():
+                        if key not in self._saving:
+                            oldest["due"] = 0.0
+                            break
+                    self._condition.notify_all()
+                    self._condition.wait(remaining)
+                # 空きを待つ間に同じセッションの予約が登録された場合はまとめる
+                entry = self._pending.get(session_id)
+            if entry is None:
+                entry = {"first": time.monotonic()}
+                self._pending[session_id] = entry
+            else:
+                snapshot, offset, reset = _merge_pending(entry, {"history": snapshot, "offset": offset, "reset": reset})
+            now = time.monotonic()
+            entry.update(
+                history=snapshot,
+                offset=offset,
+                reset=reset,
+                fingerprint=history_fingerprint(snapshot, offset),
+                save=save,
+                due=min(now + self.debounce, entry["first"] + self.max_delay)
+            )
+            self._condition.notify()
+        return True
+
+    def mark_saved(self, session_id, history, offset=0):
+        """保存先から読み込んだ履歴など、保存済みの内容を記録する（同じ内容の保存を省く）"""
+        with self._condition:
+            self._saved[session_id] = history_fingerprint(list(history), offset)
+
+    def pending_messages(self, session_id, start, end):
+        """保存中・保存待ちの予約にある start番目からend番目の手前までのメッセージを {位置: メッセージ} で返す
+
+        保存先にまだ書き込まれていないメッセージを読むためのもので、保存の完了は待たない。
+        """
+        messages = {}
+        with self._condition:
+            # 保存中の予約より新しい保存待ちの予約を優先する
+            for entry in (self._saving.get(session_id), self._pending.get(session_id)):
+                if entry is None:
+                    continue
+                offset, history = entry["offset"], entry["history"]
+                for position in range(max(start, offset), min(end, offset + len(history))):
+                    messages[position] = history[position - offset]
+        return messages
+
+    def _next_due(self):
+        """期限を迎えた予約を1件取り出す（なければ次の期限までの秒数を返す）"""
+        now = time.monotonic()
+        wait = None
+        for session_id, entry in self._pending.items():
+            if session_id in self._saving:
+                continue
+            if self._stopped or entry["due"] <= now:
+                del self._pending[session_id]
+                self._saving[session_id] = entry
+                return session_id, entry, None
+            remaining = entry["due"] - now
+            wait = remaining if wait is None else min(wait, remaining)
+        return None, None, wait
+
+    def _save(self, session_id, entry):
+        """1セッション分を保存し、失敗した場合は再試行を予約する"""
+        ok = False
+        try:
+            ok = bool(entry["save"](entry["history"], session_id, offset=entry["offset"], reset=entry["reset"]))
+        except Exception as e:
+            print(f"会話履歴のバックグラウンド保存中にエラー: {e}")
+            print(traceback.format_exc())
+        with self._condition:
+            self._saving.pop(session_id, None)
+            newer = self._pending.get(session_id)
+            if ok:
+                self._saved[session_id] = entry["fingerprint"]
+            elif newer is not None:
+                # 保存中に追加された予約に、保存できなかった先頭のメッセージを引き継ぐ
+                history, offset, reset = _merge_pending(entry, newer)
+                newer.update(history=history, offset=offset, reset=reset)
+            elif not self._stopped:
+                now = time.monotonic()
+                entry.update(first=now, due=now + RETRY_DELAY)
+                self._pending[session_id] = entry
+            self._condition.notify_all()
+        return ok
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    session_id, entry, wait = self._next_due()
+                    if entry is not None:
+                        break
+                    if self._stopped:
+                        return
+                    self._condition.wait(wait)
+            self._save(session_id, entry)
+
+    def flush(self, session_id=None, timeout=None):
+        """保存待ち（session_id指定時はそのセッションのみ）を直ちに保存させ、完了まで待つ
+
+        対象をすべて保存できた場合にTrueを返す（失敗やタイムアウトの場合はFalse。失敗分は再試行を予約済み）。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            # 保存中の予約も対象に含める（失敗して再試行に回った場合はFalseを返す）
+            targets = {
+                key: entry["fingerprint"] for key, entry in self._saving.items()
+                if session_id is None or key == session_id
+            }
+            for key, entry in self._pending.items():
+                if session_id is None or key == session_id:
+                    entry["due"] = 0.0
+                    targets[key] = entry["fingerprint"]
+            waiting = set(targets)
+            self._condition.notify_all()
+            while any(key in self._saving or self._pending.get(key, {}).get("due") == 0.0 for key in waiting):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return all(self._saved.get(key) == fingerprint for key, fingerprint in targets.items())
+
+    def close(self):
+        """保存待ちをすべて書き込んでスレッドを止める"""
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join(SHUTDOWN_TIMEOUT)
+
+
+# プロセス全体で共有するライター
+_shared_writer = None
+_shared_lock = threading.Lock()
+
+
+def get_chat_history_writer():
+    """共有のChatHistoryWriterを取得（初回呼び出し時に生成）"""
+    global _shared_writer
+    if _shared_writer is None:
+        with _shared_lock:
+            if _shared_writer is None:
+                _shared_writer = ChatHistoryWriter()
+    return _shared_writer
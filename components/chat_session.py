@@ -0,0 +1,98 @@
+import os
+import re
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+
+# ブラウザごとのセッションIDを保持するURLのクエリパラメータ名
+SESSION_QUERY_PARAM = "sid"
+# セッションIDとして受け付ける文字列（PineconeのレコードIDにも使うため英数字と-_のみ）
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+# レジストリに保持するセッション数（環境変数 CHAT_SESSION_REGISTRY_SIZE で上書き可能）
+DEFAULT_REGISTRY_SIZE = 1000
+
+
+def _get_query_param(name):
+    """URLのクエリパラメータを取得（古いStreamlitでは experimental_get_query_params を使う）"""
+    if hasattr(st, "query_params"):
+        return st.query_params.get(name)
+    values = st.experimental_get_query_params().get(name)
+    return values[0] if values else None
+
+
+def _set_query_param(name, value):
+    if hasattr(st, "query_params"):
+        st.query_params[name] = value
+        return
+    params = st.experimental_get_query_params()
+    params[name] = value
+    st.experimental_set_query_params(**params)
+
+
+class ChatSessionRegistry:
+    """ブラウザごとの会話セッションIDを払い出し、プロセス内の利用中のセッションを記録する
+
+    セッションIDはURLのクエリパラメータ（?sid=...）に保持するため、同じブラウザで再読み込みしても
+    同じ会話を続けられる。同じプロセスを利用する他のブラウザとは別のIDになる。
+    記録するセッション数には上限があり、最も長く使われていないものから忘れる。
+    """
+
+    def __init__(self, max_sessions=None):
+        self.max_sessions = max_sessions or int(os.environ.get("CHAT_SESSION_REGISTRY_SIZE", DEFAULT_REGISTRY_SIZE))
+        # セッションID → {"created", "last_seen"}
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def touch(self, session_id):
+        """セッションの利用を記録"""
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = {"created": now}
+                self._sessions[session_id] = entry
+            entry["last_seen"] = now
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def active_sessions(self, idle_seconds=None):
+        """最近利用されたセッションを [{"session_id", "created", "last_seen"}] で返す（新しい順）"""
+        now = time.time()
+        with self._lock:
+            items = list(self._sessions.items())
+        return [
+            {"session_id": session_id, **entry}
+            for session_id, entry in reversed(items)
+            if idle_seconds is None or now - entry["last_seen"] <= idle_seconds
+        ]
+
+    def resolve(self):
+        """現在のブラウザのセッションIDを返す（URLになければ新しく払い出してURLに設定）"""
+        session_id = st.session_state.get("chat_session_id")
+        if not session_id:
+            session_id = _get_query_param(SESSION_QUERY_PARAM)
+            if not session_id or not SESSION_ID_PATTERN.match(session_id):
+                session_id = uuid.uuid4().hex
+                _set_query_param(SESSION_QUERY_PARAM, session_id)
+            st.session_state.chat_session_id = session_id
+        self.touch(session_id)
+        return session_id
+
+
+# プロセス全体で共有するレジストリ
+_shared_registry = None
+_shared_lock = threading.Lock()
+
+
+def get_session_registry():
+    """共有のChatSessionRegistryを取得（初回呼び出し時に生成）"""
+    global _shared_registry
+    if _shared_registry is None:
+        with _shared_lock:
+            if _shared_registry is None:
+                _shared_registry = ChatSessionRegistry()
+    return _shared_registry
@@ -0,0 +1,230 @@
+import os
+import re
+import asyncio
+import time
+import sqlite3
+import hashlib
+import threading
+import traceback
+import unicodedata
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# キャッシュファイルと容量のデフォルト（環境変数で上書き可能）
+DEFAULT_CACHE_PATH = os.path.join(".cache", "embeddings.sqlite3")
+DEFAULT_MAX_MB = 512
+
+# モデルごとの既定の次元数（dimensions未指定時）
+DEFAULT_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+# SQLiteのIN句に渡すキーの最大数
+LOOKUP_CHUNK = 500
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """キャッシュキー用にテキストを正規化（NFKC + 空白の統一）"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class CachedEmbeddings(Embeddings):
+    """埋め込みモデルをラップするディスクキャッシュ（SQLite, float32 BLOB）
+
+    キーは「モデル名・次元数・正規化テキストのハッシュ」で、同じ内容のテキストは
+    二度と埋め込みAPIを呼ばない。容量を超えると最終参照が古いものから削除する。
+    """
+
+    def __init__(self, embeddings, path=None, max_bytes=None, model_name=None, dimensions=None):
+        self.embeddings = embeddings
+        self.model_name = model_name or getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.dimensions = dimensions or getattr(embeddings, "dimensions", None) or DEFAULT_DIMENSIONS.get(self.model_name, 0)
+        self.path = path or os.environ.get("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.max_bytes = max_bytes or int(float(os.environ.get("EMBEDDING_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        print(f"埋め込みキャッシュ: {self.path} (モデル: {self.model_name}, 次元数: {self.dimensions}, 使用量: {self._total_bytes / 1024 / 1024:.1f}MB)")
+
+    def _key(self, text):
+        """キャッシュキーを生成"""
+        payload = f"{self.model_name}\x1f{self.dimensions}\x1f{normalize_text(text)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        """キーに対応するベクトルを取得し、参照時刻を更新"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(unique_keys), LOOKUP_CHUNK):
+                part = unique_keys[i:i + LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+        return found
+
+    def _store(self, items):
+        """(キー, ベクトル) を保存し、容量超過時は古いものから削除"""
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, vector in items:
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((key, self.model_name, len(vector), blob, len(blob), now, now))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                # 置き換えられる既存の行のサイズ（使用量は差分だけ更新する）
+                replaced = 0
+                keys = list({row[0] for row in rows})
+                for i in range(0, len(keys), LOOKUP_CHUNK):
+                    part = keys[i:i + LOOKUP_CHUNK]
+                    placeholders = ",".join("?" * len(part))
+                    replaced += self._conn.execute(
+                        f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({placeholders})", part
+                    ).fetchone()[0]
+                self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._total_bytes += sum({row[0]: row[4] for row in rows}.values()) - replaced
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """容量の90%以下になるまで最終参照が古いものから削除（ロック取得済みで呼ぶ）"""
+        target = int(self.max_bytes * 0.9)
+        excess = self._total_bytes - target
+        # 索引順に必要な分だけ読み出す（全件は読み込まない）
+        cursor = self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_access ASC")
+        victims = []
+        freed = 0
+        for key, size in cursor:
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+            freed += size
+        cursor.close()
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self._total_bytes -= freed
+        self.evictions += len(victims)
+        print(f"埋め込みキャッシュ: {len(victims)}件を削除しました (使用量: {self._total_bytes / 1024 / 1024:.1f}MB)")
+
+    def _split(self, texts):
+        """キャッシュ済みと未キャッシュに分け、(キー一覧, 取得済み, 未キャッシュのキー→テキスト) を返す"""
+        keys = [self._key(text) for text in texts]
+        try:
+            found = self._lookup(keys)
+        except Exception as e:
+            print(f"埋め込みキャッシュの参照エラー: {e}")
+            found = {}
+        missing = {}
+        hit_count = 0
+        for key, text in zip(keys, texts):
+            if key in found:
+                hit_count += 1
+            elif key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+        return keys, found, missing
+
+    def _merge(self, keys, found, missing, vectors):
+        """新しく計算したベクトルを保存し、入力順に結果を並べる"""
+        computed = dict(zip(missing.keys(), vectors))
+        try:
+            self._store(list(computed.items()))
+        except Exception as e:
+            print(f"埋め込みキャッシュの保存エラー: {e}")
+            print(traceback.format_exc())
+        found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """ドキュメントの埋め込み（キャッシュにないものだけAPIを呼ぶ）"""
+        keys, found, missing = self._split(texts)
+        vectors = self.embeddings.embed_documents(list(missing.values())) if missing else []
+        return self._merge(keys, found, missing, vectors)
+
+    def embed_query(self, text: str) -> List[float]:
+        """クエリの埋め込み（キャッシュにない場合のみAPIを呼ぶ）"""
+        keys, found, missing = self._split([text])
+        vectors = [self.embeddings.embed_query(text)] if missing else []
+        return self._merge(keys, found, missing, vectors)[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """ドキュメントの埋め込み（非同期。キャッシュの読み書きは別スレッドで行い、イベントループを止めない）"""
+        keys, found, missing = await asyncio.to_thread(self._split, texts)
+        vectors = await self.embeddings.aembed_documents(list(missing.values())) if missing else []
+        return await asyncio.to_thread(self._merge, keys, found, missing, vectors)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """クエリの埋め込み（非同期。キャッシュの読み書きは別スレッドで行う）"""
+        keys, found, missing = await asyncio.to_thread(self._split, [text])
+        vectors = [await self.embeddings.aembed_query(text)] if missing else []
+        return (await asyncio.to_thread(self._merge, keys, found, missing, vectors))[0]
+
+    def stats(self):
+        """キャッシュの統計情報"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            hits, misses, evictions, total_bytes = self.hits, self.misses, self.evictions, self._total_bytes
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "evictions": evictions,
+            "entries": entries,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self):
+        """キャッシュを全削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._total_bytes = 0
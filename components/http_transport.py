@@ -0,0 +1,172 @@
+import os
+import asyncio
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from components.payload_codec import dumps_json
+
+# 非同期クライアント（httpxはopenaiの依存として導入済み）
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except Exception as e:
+    print(f"httpxのインポートエラー: {e}")
+    HTTPX_AVAILABLE = False
+
+# HTTP/2はhttpx + h2が利用可能な場合のみ有効化する
+try:
+    import h2  # noqa: F401  httpx[http2]の依存
+    HTTP2_AVAILABLE = HTTPX_AVAILABLE
+except Exception:
+    HTTP2_AVAILABLE = False
+
+# 接続プールのデフォルト設定（環境変数で上書き可能）
+DEFAULT_POOL_SIZE = 10           # キャッシュするホスト別プール数
+DEFAULT_MAX_PER_HOST = 20        # ホストあたりの最大接続数
+DEFAULT_KEEPALIVE_EXPIRY = 60    # アイドル接続を保持する秒数（HTTP/2時）
+
+
+def env_int(name, default):
+    """整数の環境変数を読み込む（不正値はデフォルト値）"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_flag(name, default=False):
+    """真偽値の環境変数を読み込む"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+class HTTPTransport:
+    """Pinecone向けの共有HTTPトランスポート（keep-alive付き接続プール）
+
+    requests.Sessionを基本とし、HTTP/2が有効かつ利用可能な場合はhttpx.Clientを使う。
+    httpxの例外はrequestsの例外に変換するため、呼び出し側は従来通りの例外処理でよい。
+    非同期コード用の httpx.AsyncClient も同じプール設定で生成し、イベントループごとに1つ共有する
+    （async_client()）。
+    """
+
+    def __init__(self, pool_size=None, max_per_host=None, http2=None):
+        self.pool_size = pool_size or env_int("PINECONE_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)
+        self.max_per_host = max_per_host or env_int("PINECONE_HTTP_MAX_PER_HOST", DEFAULT_MAX_PER_HOST)
+        if http2 is None:
+            http2 = env_flag("PINECONE_HTTP2", True)
+        self.http2 = bool(http2) and HTTP2_AVAILABLE
+
+        # 非同期クライアントはイベントループに紐づくため、ループごとに保持する
+        self._async_clients = {}
+        self._async_lock = threading.Lock()
+
+        if self.http2:
+            self._client = httpx.Client(http2=True, limits=self._httpx_limits())
+            print(f"HTTPトランスポート: HTTP/2 (httpx) 最大接続数/ホスト={self.max_per_host}")
+        else:
+            session = requests.Session()
+            # pool_connections: ホスト別プールの数, pool_maxsize: ホストあたりの接続上限
+            # pool_block=True で上限を超える同時接続は空きが出るまで待機させる
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_size,
+                pool_maxsize=self.max_per_host,
+                pool_block=True
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._client = session
+            print(f"HTTPトランスポート: HTTP/1.1 keep-alive (requests) プール数={self.pool_size}, 最大接続数/ホスト={self.max_per_host}")
+
+    def _httpx_limits(self):
+        """httpxの接続プール設定（同期・非同期で共通）"""
+        return httpx.Limits(
+            max_connections=self.pool_size * self.max_per_host,
+            max_keepalive_connections=self.max_per_host,
+            keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY
+        )
+
+    def async_client(self):
+        """現在のイベントループ用の共有 httpx.AsyncClient を取得（初回呼び出し時に生成）"""
+        if not HTTPX_AVAILABLE:
+            raise ImportError("httpxが利用できないため、非同期クライアントを生成できません")
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = httpx.AsyncClient(http2=self.http2, limits=self._httpx_limits())
+                self._async_clients[loop] = client
+        return client
+
+    async def aclose_async_client(self):
+        """現在のイベントループに紐づく非同期クライアントを閉じる"""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            client = self._async_clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+    def request(self, method, url, headers=None, json=None, params=None, timeout=30):
+        """HTTPリクエストを実行してレスポンスを返す（JSONの本文は日本語をエスケープしないUTF-8で送信）"""
+        body = None
+        if json is not None:
+            body = dumps_json(json)
+            headers = {"Content-Type": "application/json", **(headers or {})}
+        
+        if not self.http2:
+            return self._client.request(
+                method.upper(),
+                url,
+                headers=headers,
+                data=body,
+                params=params,
+                timeout=timeout
+            )
+
+        try:
+            return self._client.request(
+                method.upper(),
+                url,
+                headers=headers,
+                content=body,
+                params=params,
+                timeout=timeout
+            )
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e))
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e))
+        except httpx.HTTPError as e:
+            raise requests.exceptions.RequestException(str(e))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        """プール内の接続をすべて閉じる"""
+        try:
+            self._client.close()
+        except Exception as e:
+            print(f"HTTPトランスポートのクローズ中にエラー: {e}")
+
+
+# プロセス全体で共有するトランスポート
+_shared_transport = None
+_shared_lock = threading.Lock()
+
+
+def get_transport():
+    """共有HTTPトランスポートを取得（初回呼び出し時に生成）"""
+    global _shared_transport
+    if _shared_transport is None:
+        with _shared_lock:
+            if _shared_transport is None:
+                _shared_transport = HTTPTransport()
+    return _shared_transport
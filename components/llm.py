@@ -18,6 +18,14 @@ oai_embeddings = OpenAIEmbeddings(
     api_key=OPENAI_API_KEY
 )
 
+# 埋め込みキャッシュ（同じテキストの再埋め込みを防ぐ。EMBEDDING_CACHE_ENABLED=false で無効化）
+if os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on'):
+    try:
+        from components.embedding_cache import CachedEmbeddings
+        oai_embeddings = CachedEmbeddings(oai_embeddings)
+    except Exception as e:
+        print(f"埋め込みキャッシュの初期化に失敗したため、キャッシュなしで動作します: {e}")
+
 # 動作確認
 if __name__ == "__main__":
     # LLM試験
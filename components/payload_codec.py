@@ -0,0 +1,71 @@
+import json
+import zlib
+import base64
+
+# zstdのインポートを試みる（なければzlibで圧縮）
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except Exception:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+# バイト列の先頭1バイトで形式（バージョン）を示す
+FORMAT_RAW = 0x01    # 無圧縮のUTF-8 JSON
+FORMAT_ZLIB = 0x02   # zlib圧縮
+FORMAT_ZSTD = 0x03   # zstd圧縮
+
+# 文字列形式（Pineconeのメタデータ用）の接頭辞。続きは上記のバイト列のbase64
+TEXT_PREFIX = "pc1:"
+
+# これより短いJSONは圧縮しない（圧縮してもほとんど小さくならない）
+MIN_COMPRESS_BYTES = 256
+
+# 旧形式（ChunkStoreが先頭バイトなしで保存していたzlibストリーム）の先頭バイト
+_LEGACY_ZLIB_HEADER = 0x78
+
+
+def dumps_json(obj):
+    """JSONをUTF-8のバイト列に変換（日本語を\\uエスケープせず、区切りの空白も省く）"""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_bytes(obj, compress=True):
+    """オブジェクトを形式タグ付きの（圧縮した）バイト列に変換"""
+    raw = dumps_json(obj)
+    if not compress or len(raw) < MIN_COMPRESS_BYTES:
+        return bytes([FORMAT_RAW]) + raw
+    if ZSTD_AVAILABLE:
+        return bytes([FORMAT_ZSTD]) + zstandard.ZstdCompressor(level=3).compress(raw)
+    return bytes([FORMAT_ZLIB]) + zlib.compress(raw, 6)
+
+
+def decode_bytes(data):
+    """encode_bytesで作ったバイト列を元のオブジェクトに戻す"""
+    data = bytes(data)
+    tag, body = data[0], data[1:]
+    if tag == FORMAT_RAW:
+        raw = body
+    elif tag == FORMAT_ZLIB:
+        raw = zlib.decompress(body)
+    elif tag == FORMAT_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise ValueError("zstdで圧縮されたデータですが、zstandardがインストールされていません")
+        raw = zstandard.ZstdDecompressor().decompress(body)
+    elif tag == _LEGACY_ZLIB_HEADER:
+        raw = zlib.decompress(data)
+    else:
+        raise ValueError(f"不明な形式のデータです: {tag:#x}")
+    return json.loads(raw.decode("utf-8"))
+
+
+def encode_text(obj, compress=True):
+    """オブジェクトをメタデータに格納できる文字列に変換（接頭辞 + base64）"""
+    return TEXT_PREFIX + base64.b64encode(encode_bytes(obj, compress)).decode("ascii")
+
+
+def decode_text(text):
+    """encode_textで作った文字列を元のオブジェクトに戻す（接頭辞がなければ従来のJSON文字列として読む）"""
+    if text.startswith(TEXT_PREFIX):
+        return decode_bytes(base64.b64decode(text[len(TEXT_PREFIX):]))
+    return json.loads(text)
@@ -6,6 +6,8 @@ import time
 import requests
 import traceback
 import streamlit as st
+from components.http_transport import get_transport, env_flag
+from components.payload_codec import encode_text, decode_text, dumps_json
 
 # Pineconeのインポートを試みる
 try:
@@ -16,6 +18,15 @@ except Exception as e:
     print(f"Pineconeのインポートエラー: {e}")
     PINECONE_AVAILABLE = False
 
+# 会話履歴の1ページ（1レコード）に格納するメッセージ数（環境変数 CHAT_HISTORY_PAGE_SIZE で上書き可能）
+DEFAULT_CHAT_PAGE_SIZE = 20
+
+# 会話履歴のレコードを取得・アップサートする1リクエストあたりの件数
+CHAT_RECORD_BATCH_SIZE = 100
+
+# 作成するインデックスの次元数（OpenAIの埋め込みの次元数）
+INDEX_DIMENSION = 1536
+
 class PineconeClient:
     def __init__(self):
         # 環境変数から直接取得
@@ -37,6 +48,16 @@ class PineconeClient:
         self.last_success_time = time.time()
         self.temporary_failure = False
         
+        # 会話履歴の保存状態（セッションID → 保存済みのメッセージ数 / 保存に使っているページサイズ）
+        self.chat_page_size = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", DEFAULT_CHAT_PAGE_SIZE))
+        self._chat_saved_counts = {}
+        self._chat_page_sizes = {}
+        self._index_dimension = None
+        self._default_chat_session_id = None
+        
+        # 共有HTTPトランスポート（全リクエストで接続を再利用）
+        self.transport = get_transport()
+        
         # Streamlit Secretsを試す (環境変数が設定されていない場合)
         if not self.api_key:
             try:
@@ -104,8 +125,8 @@ class PineconeClient:
                             # インデックスの作成を試みる（既存のインデックスがない場合）
                             pinecone.create_index(
                                 name=self.index_name,
-                                dimension=1536,  # OpenAI embedding size
-                                metric="cosine"
+                                dimension=INDEX_DIMENSION,
+                                metric=self._index_create_metric()
                             )
                             print(f"インデックス '{self.index_name}' を作成しました")
                         except Exception as e:
@@ -165,12 +186,11 @@ class PineconeClient:
             try:
                 # 大きなJSONデータの場合は省略表示
                 if json_data:
-                    json_str = json.dumps(json_data)
-                    log_length = min(100, len(json_str))
+                    json_bytes = dumps_json(json_data)
                     print(f"HTTP {method} リクエスト: {url}")
-                    print(f"データサイズ: {len(json_str)} バイト")
-                    if len(json_str) > 100:
-                        print(f"POSTデータ (先頭100バイト): {json_str[:log_length]}...")
+                    print(f"データサイズ: {len(json_bytes)} バイト")
+                    if len(json_bytes) > 100:
+                        print(f"POSTデータ (先頭100バイト): {json_bytes[:100].decode('utf-8', errors='ignore')}...")
                 else:
                     print(f"HTTP {method} リクエスト: {url}")
                 
@@ -187,35 +207,22 @@ class PineconeClient:
                 # リクエストを実行
                 retry_start_time = time.time()
                 
-                if method.upper() == "GET":
-                    response = requests.get(
-                        url, 
-                        headers=self.headers,
-                        params=params,
-                        timeout=current_timeout
-                    )
-                elif method.upper() == "POST":
-                    response = requests.post(
-                        url, 
-                        headers=self.headers,
-                        json=json_data,
-                        params=params,
-                        timeout=current_timeout
-                    )
-                elif method.upper() == "DELETE":
-                    response = requests.delete(
-                        url, 
-                        headers=self.headers,
-                        json=json_data,
-                        params=params,
-                        timeout=current_timeout
-                    )
-                else:
+                if method.upper() not in ("GET", "POST", "DELETE"):
                     print(f"サポートされていないHTTPメソッド: {method}")
                     request_info["error"] = "unsupported_method"
                     print(f"リクエスト詳細: {json.dumps(request_info, default=str)}")
                     return None
                 
+                # 共有トランスポート（keep-alive接続プール）経由で送信
+                response = self.transport.request(
+                    method,
+                    url,
+                    headers=self.headers,
+                    json=json_data if method.upper() != "GET" else None,
+                    params=params,
+                    timeout=current_timeout
+                )
+                
                 # レスポンス情報を記録
                 retry_info["duration"] = time.time() - retry_start_time
                 retry_info["status_code"] = response.status_code
@@ -414,6 +421,41 @@ class PineconeClient:
             print(traceback.format_exc())
             return False
     
+    @staticmethod
+    def _index_create_metric():
+        """インデックス作成時の距離尺度（スパース・デンス検索を使う場合はdotproductが必要）"""
+        return "dotproduct" if env_flag("PINECONE_SPARSE", False) else "cosine"
+
+    def index_metric(self):
+        """接続しているインデックスの距離尺度（describe_index）。取得できなければNone"""
+        try:
+            if PINECONE_AVAILABLE and hasattr(self, 'index') and isinstance(self.index, pinecone.Index):
+                return getattr(pinecone.describe_index(self.index_name), "metric", None)
+            response = self._make_request(
+                method="GET",
+                url=f"https://api.pinecone.io/indexes/{self.index_name}"
+            )
+            if response and response.status_code == 200:
+                return response.json().get("metric")
+        except Exception as e:
+            print(f"インデックスの距離尺度の取得エラー: {e}")
+        return None
+
+    def index_dimension(self):
+        """接続しているインデックスの次元数（describe_index）。取得できなければNone"""
+        try:
+            if PINECONE_AVAILABLE and hasattr(self, 'index') and isinstance(self.index, pinecone.Index):
+                return getattr(pinecone.describe_index(self.index_name), "dimension", None)
+            response = self._make_request(
+                method="GET",
+                url=f"https://api.pinecone.io/indexes/{self.index_name}"
+            )
+            if response and response.status_code == 200:
+                return response.json().get("dimension")
+        except Exception as e:
+            print(f"インデックスの次元数の取得エラー: {e}")
+        return None
+
     def _check_index_rest(self):
         """REST APIを使用してインデックスの存在確認と作成"""
         try:
@@ -433,8 +475,8 @@ class PineconeClient:
                 create_url = "https://api.pinecone.io/indexes"
                 create_data = {
                     "name": self.index_name,
-                    "dimension": 1536,  # OpenAI embeddings default
-                    "metric": "cosine"
+                    "dimension": INDEX_DIMENSION,
+                    "metric": self._index_create_metric()
                 }
                 
                 create_response = self._make_request(
@@ -463,89 +505,219 @@ class PineconeClient:
         """インターネット接続を確認する簡易的な関数"""
         try:
             # Googleの公開DNSサーバーに接続を試みる
-            response = requests.get("https://8.8.8.8", timeout=3)
+            response = self.transport.get("https://8.8.8.8", timeout=3)
             print("インターネット接続: OK")
             return True
         except requests.RequestException:
             try:
                 # バックアップとしてCloudflareのDNSにも試す
-                response = requests.get("https://1.1.1.1", timeout=3)
+                response = self.transport.get("https://1.1.1.1", timeout=3)
                 print("インターネット接続: OK (Cloudflare)")
                 return True
             except requests.RequestException:
                 print("インターネット接続: 失敗 - ネットワーク接続を確認してください")
                 return False
 
-    def save_chat_history(self, chat_history):
-        """会話履歴をPineconeに保存"""
-        if not chat_history or not self.available:
+    def _use_sdk(self):
+        """公式SDKのインデックスが利用可能か"""
+        return PINECONE_AVAILABLE and hasattr(self, 'index') and isinstance(self.index, pinecone.Index)
+
+    def chat_session_id(self, session_id=None):
+        """会話履歴のセッションID（未指定なら環境変数、なければプロセスで1つ生成したID）"""
+        if session_id:
+            return session_id
+        if not self._default_chat_session_id:
+            self._default_chat_session_id = os.environ.get("STREAMLIT_SESSION_ID") or str(uuid.uuid4())
+        return self._default_chat_session_id
+
+    @staticmethod
+    def _chat_manifest_id(session_id):
+        return f"chat_{session_id}_manifest"
+
+    @staticmethod
+    def _chat_page_id(session_id, page):
+        return f"chat_{session_id}_p{page:06d}"
+
+    def _record_vector(self):
+        """会話履歴のレコードに付けるダミーのベクトル
+
+        Pineconeはインデックスと次元数が異なるベクトルや、すべて0のベクトルを受け付けないため、
+        インデックスの次元数（取得できなければ作成時の INDEX_DIMENSION）の単位ベクトルにする。
+        レコードは会話履歴用の名前空間にだけ登録するため、ドキュメントの検索結果には現れない。
+        """
+        if not self._index_dimension:
+            self._index_dimension = self.index_dimension() or INDEX_DIMENSION
+        return [1.0] + [0.0] * (int(self._index_dimension) - 1)
+
+    def _upsert_records(self, records):
+        """(ID, メタデータ) のレコードをダミーベクトルでアップサート（順番に送信し、失敗した時点で中断）"""
+        values = self._record_vector()
+        vectors = [{"id": id_, "values": values, "metadata": metadata} for id_, metadata in records]
+        for i in range(0, len(vectors), CHAT_RECORD_BATCH_SIZE):
+            batch = vectors[i:i + CHAT_RECORD_BATCH_SIZE]
+            if self._use_sdk():
+                self.index.upsert(vectors=batch, namespace=self.namespace)
+                continue
+            response = self._make_request(
+                method="POST",
+                url=f"https://api.pinecone.io/vectors/upsert/{self.index_name}",
+                json_data={"vectors": batch, "namespace": self.namespace}
+            )
+            if not response or response.status_code not in (200, 201, 202):
+                print(f"会話履歴の保存エラー: {getattr(response, 'status_code', 'N/A')} - {getattr(response, 'text', 'No response')}")
+                return False
+        return True
+
+    def _fetch_records(self, ids):
+        """IDを指定してレコードのメタデータを取得し、{ID: メタデータ} を返す"""
+        records = {}
+        for i in range(0, len(ids), CHAT_RECORD_BATCH_SIZE):
+            part = ids[i:i + CHAT_RECORD_BATCH_SIZE]
+            if self._use_sdk():
+                response = self.index.fetch(ids=part, namespace=self.namespace)
+                for id_, vector in (response.vectors or {}).items():
+                    records[id_] = vector.metadata or {}
+                continue
+            response = self._make_request(
+                method="GET",
+                url=f"https://api.pinecone.io/vectors/fetch/{self.index_name}",
+                params={"ids": part, "namespace": self.namespace}
+            )
+            if not response or response.status_code != 200:
+                raise RuntimeError(f"会話履歴の取得エラー: {getattr(response, 'status_code', 'N/A')}")
+            for id_, vector in response.json().get("vectors", {}).items():
+                records[id_] = vector.get("metadata") or {}
+        return records
+
+    def _delete_records(self, ids):
+        """IDを指定してレコードを削除（順番に送信し、失敗した時点で中断）"""
+        for i in range(0, len(ids), CHAT_RECORD_BATCH_SIZE):
+            part = ids[i:i + CHAT_RECORD_BATCH_SIZE]
+            if self._use_sdk():
+                self.index.delete(ids=part, namespace=self.namespace)
+                continue
+            response = self._make_request(
+                method="POST",
+                url=f"https://api.pinecone.io/vectors/delete/{self.index_name}",
+                json_data={"ids": part, "namespace": self.namespace}
+            )
+            if not response or response.status_code not in (200, 202):
+                print(f"会話履歴の削除エラー: {getattr(response, 'status_code', 'N/A')} - {getattr(response, 'text', 'No response')}")
+                return False
+        return True
+
+    def _chat_manifest(self, session_id):
+        """セッションのマニフェストを取得（なければNone）"""
+        manifest_id = self._chat_manifest_id(session_id)
+        return self._fetch_records([manifest_id]).get(manifest_id)
+
+    def save_chat_history(self, chat_history, session_id=None, offset=0, reset=False):
+        """会話履歴をPineconeに保存
+
+        会話はセッションごとのマニフェストと、chat_page_size件ずつのページのレコード（IDはセッションIDとページ番号で固定）
+        に分けて保存する。前回の保存以降に追加されたメッセージを含むページとマニフェストだけを書き込むため、
+        1回の保存のコストは会話の長さによらない。chat_history は会話全体の offset 番目以降で、書き込むページの
+        先頭がそれより前にある場合はそのページを読み込んで補う。reset=True（クリア）や会話が前回より短い場合は
+        offset 番目以降を書き直す。
+        保存済みのセッションはマニフェストのページサイズを使い続け、会話全体がメモリにある（offset=0）場合だけ
+        設定のページサイズ（chat_page_size）で先頭から書き直す。
+        """
+        if chat_history is None or not self.available:
             return None
         
-        # 会話履歴をJSONに変換
-        chat_json = json.dumps(chat_history)
-        
-        # タイムスタンプとユーザーIDを含むIDを生成
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        session_id = os.environ.get("STREAMLIT_SESSION_ID", str(uuid.uuid4()))
-        vector_id = f"chat_{session_id}_{timestamp}"
-        
-        # メタデータ作成
-        metadata = {
-            "timestamp": timestamp,
-            "session_id": session_id,
-            "type": "chat_history",
-            "chat_data": chat_json
-        }
+        session_id = self.chat_session_id(session_id)
+        manifest_id = self._chat_manifest_id(session_id)
         
         try:
-            # 公式SDKが利用可能ならそれを使う
-            if hasattr(self, 'index') and isinstance(self.index, pinecone.Index):
-                self.index.upsert(
-                    vectors=[
-                        {
-                            "id": vector_id,
-                            "values": [0.0],  # ダミーベクトル値
-                            "metadata": metadata
-                        }
-                    ],
-                    namespace=self.namespace
-                )
-                print(f"会話履歴をPineconeに保存しました (SDK): {vector_id}")
-                return vector_id
+            saved = self._chat_saved_counts.get(session_id)
+            page_size = self._chat_page_sizes.get(session_id)
+            cached = saved is not None and page_size is not None
+            if cached:
+                saved_pages = (saved + page_size - 1) // page_size
+            else:
+                # このプロセスで初めて保存するセッションはマニフェストから保存済みの件数とページサイズを調べる
+                manifest = self._chat_manifest(session_id) or {}
+                saved = int(manifest.get("message_count", 0))
+                saved_pages = int(manifest.get("page_count", 0))
+                page_size = int(manifest.get("page_size", 0)) or self.chat_page_size
             
-            # REST APIでベクトルをアップサート
-            api_url = f"https://api.pinecone.io/vectors/upsert/{self.index_name}"
+            count = offset + len(chat_history)
+            if count == saved and not reset and cached:
+                return manifest_id
+            if page_size != self.chat_page_size and offset == 0:
+                # ページサイズの設定が変わった場合は、会話全体がメモリにあれば先頭から書き直す
+                # （offset>0 の場合は古いページの位置と合わないため、保存済みのページサイズのまま追記する）
+                page_size = self.chat_page_size
+                saved = 0
+            if reset or count < saved:
+                saved = min(saved, offset)
             
-            data = {
-                "vectors": [
-                    {
-                        "id": vector_id,
-                        "values": [0.0],  # ダミーベクトル値
-                        "metadata": metadata
-                    }
-                ],
-                "namespace": self.namespace
-            }
+            first_page = saved // page_size
+            base = first_page * page_size
+            if base < offset:
+                # 書き込むページの先頭はメモリにないため、保存済みのページから補う
+                page_id = self._chat_page_id(session_id, first_page)
+                page = self._fetch_records([page_id]).get(page_id)
+                prefix = decode_text(page.get("messages", "[]"))[:offset - base] if page else []
+                if len(prefix) < offset - base:
+                    print(f"会話履歴のページが見つからないため保存できません: {page_id}")
+                    return None
+                messages = prefix + list(chat_history)
+            else:
+                messages = list(chat_history[base - offset:])
             
-            response = self._make_request(
-                method="POST",
-                url=api_url,
-                json_data=data
-            )
+            page_count = (count + page_size - 1) // page_size
+            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+            records = [
+                (self._chat_page_id(session_id, page), {
+                    "type": "chat_page",
+                    "session_id": session_id,
+                    "page": page,
+                    "messages": encode_text(messages[(page - first_page) * page_size:(page - first_page + 1) * page_size])
+                })
+                for page in range(first_page, page_count)
+            ]
+            # マニフェストはページの書き込み後に更新する（途中で失敗しても前回の状態を読める）
+            records.append((manifest_id, {
+                "type": "chat_manifest",
+                "session_id": session_id,
+                "timestamp": timestamp,
+                "message_count": count,
+                "page_count": page_count,
+                "page_size": page_size
+            }))
             
-            if response and response.status_code in [200, 201, 202]:
-                print(f"会話履歴をPineconeに保存しました (REST): {vector_id}")
-                return vector_id
-            else:
-                print(f"会話履歴の保存エラー: {getattr(response, 'status_code', 'N/A')} - {getattr(response, 'text', 'No response')}")
+            if not self._upsert_records(records):
                 return None
+            self._chat_saved_counts[session_id] = count
+            self._chat_page_sizes[session_id] = page_size
+            if saved_pages > page_count:
+                # クリアや短くなった場合は、マニフェストの更新後に範囲外になった古いページを削除する
+                # 削除に失敗しても範囲外のページは読まれないため、保存自体は成功として扱う
+                stale = [self._chat_page_id(session_id, page) for page in range(page_count, saved_pages)]
+                try:
+                    deleted = self._delete_records(stale)
+                except Exception as e:
+                    print(f"会話履歴の古いページの削除エラー: {e}")
+                    deleted = False
+                if not deleted:
+                    print(f"会話履歴の古いページを削除できませんでした: {len(stale)}ページ")
+            print(f"会話履歴をPineconeに保存しました: {manifest_id} ({len(records) - 1}ページを更新, {count}件)")
+            return manifest_id
         except Exception as e:
             print(f"Pineconeへの保存エラー: {e}")
             print(traceback.format_exc())
             return None
     
-    def load_chat_history(self, session_id=None):
-        """Pineconeから会話履歴を読み込む"""
+    def chat_message_count(self, session_id=None):
+        """保存済みの会話のメッセージ数（マニフェストがなければ0）"""
+        if not self.available:
+            return 0
+        manifest = self._chat_manifest(self.chat_session_id(session_id))
+        return int(manifest.get("message_count", 0)) if manifest else 0
+    
+    def load_chat_history(self, session_id=None, start=0, end=None):
+        """Pineconeから会話履歴を読み込む（マニフェストと、start番目からend番目の手前までを含むページだけをIDで取得）"""
         if not self.available:
             return None
             
@@ -558,68 +730,39 @@ class PineconeClient:
             return None
         
         try:
-            print(f"セッションID '{session_id}' の会話履歴を検索中...")
-            
-            # 公式SDKが利用可能ならそれを使う
-            if hasattr(self, 'index') and isinstance(self.index, pinecone.Index):
-                filter_dict = {
-                    "session_id": {"$eq": session_id},
-                    "type": {"$eq": "chat_history"}
-                }
-                
-                results = self.index.query(
-                    vector=[0.0],
-                    filter=filter_dict,
-                    top_k=1,
-                    include_metadata=True,
-                    namespace=self.namespace
-                )
-                
-                if results.matches and len(results.matches) > 0:
-                    chat_data = results.matches[0].metadata.get("chat_data")
-                    if chat_data:
-                        print(f"Pineconeから会話履歴を読み込みました (SDK): {session_id}")
-                        return json.loads(chat_data)
-                    else:
-                        print("会話履歴データが見つかりません (SDK)")
-                else:
-                    print(f"セッションID '{session_id}' の会話履歴が見つかりませんでした (SDK)")
+            print(f"セッションID '{session_id}' の会話履歴を取得中...")
+            manifest = self._chat_manifest(session_id)
+            if not manifest:
+                print(f"セッションID '{session_id}' の会話履歴が見つかりませんでした")
                 return None
             
-            # REST APIでクエリ実行
-            api_url = f"https://api.pinecone.io/query/{self.index_name}"
-            
-            data = {
-                "vector": [0.0],  # ダミークエリベクトル
-                "filter": {
-                    "session_id": {"$eq": session_id},
-                    "type": {"$eq": "chat_history"}
-                },
-                "top_k": 1,
-                "include_metadata": True,
-                "namespace": self.namespace
-            }
+            count = int(manifest.get("message_count", 0))
+            page_size = int(manifest.get("page_size", 0)) or self.chat_page_size
+            end = count if end is None else min(end, count)
+            if start >= end:
+                return []
+            first_page = start // page_size
+            page_ids = [self._chat_page_id(session_id, page) for page in range(first_page, (end - 1) // page_size + 1)]
+            pages = self._fetch_records(page_ids)
             
-            response = self._make_request(
-                method="POST",
-                url=api_url,
-                json_data=data
-            )
+            messages = []
+            complete = True
+            for page_id in page_ids:
+                page = pages.get(page_id)
+                if page is None:
+                    print(f"会話履歴のページが見つかりません: {page_id}")
+                    complete = False
+                    break
+                messages.extend(decode_text(page.get("messages", "[]")))
+            base = first_page * page_size
+            messages = messages[start - base:end - base]
             
-            if response and response.status_code == 200:
-                result = response.json()
-                if result.get("matches") and len(result["matches"]) > 0:
-                    # 最新の会話履歴を取得
-                    chat_data = result["matches"][0]["metadata"].get("chat_data")
-                    if chat_data:
-                        print(f"Pineconeから会話履歴を読み込みました (REST): {session_id}")
-                        return json.loads(chat_data)
-                    else:
-                        print("会話履歴データが見つかりません (REST)")
-                else:
-                    print(f"セッションID '{session_id}' の会話履歴が見つかりませんでした (REST)")
-            else:
-                print(f"会話履歴の検索エラー: {getattr(response, 'status_code', 'N/A')} - {getattr(response, 'text', 'No response')}")
+            # 保存済みの件数とページサイズを記録（次回の保存は追記分のみ）
+            if complete:
+                self._chat_saved_counts[session_id] = count
+                self._chat_page_sizes[session_id] = page_size
+            print(f"Pineconeから会話履歴を読み込みました: {session_id} ({len(messages)}件)")
+            return messages
         except Exception as e:
             print(f"Pineconeからの読み込みエラー: {e}")
             print(traceback.format_exc())
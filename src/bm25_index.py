@@ -0,0 +1,220 @@
+import re
+import math
+import zlib
+import sqlite3
+import logging
+import threading
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+# ロガーの設定
+logger = logging.getLogger('app.bm25_index')
+
+# BM25のパラメータ
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+
+# 英数字は単語単位、日本語（かな・漢字）の連続は文字バイグラムに分割する
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff々〆]+")
+
+# 順位融合（Reciprocal Rank Fusion）の定数
+RRF_K = 60
+
+
+def tokenize(text):
+    """検索用のトークン列（NFKC正規化・小文字化した英数字の単語と日本語の文字バイグラム）"""
+    tokens = []
+    for run in _TOKEN.findall(unicodedata.normalize("NFKC", text).lower()):
+        if run[0].isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def term_index(term):
+    """Pineconeのスパースベクトル用の次元番号（32bitハッシュ）"""
+    return zlib.crc32(term.encode("utf-8"))
+
+
+def _sparse(weights):
+    """{次元番号: 重み} をPineconeのスパースベクトル形式に変換"""
+    indices = sorted(weights)
+    return {"indices": indices, "values": [float(weights[i]) for i in indices]}
+
+
+def rank_fusion(rankings, n_results, k=RRF_K):
+    """複数の順位リスト（行番号やIDの並び）をReciprocal Rank Fusionで統合
+
+    戻り値は (キーのリスト, 融合スコアの配列)。スコアは全リストで1位の場合に1.0となるよう正規化する。
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            key = key.item() if isinstance(key, np.generic) else key
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank + 1)
+    ordered = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:n_results]
+    scale = len(rankings) / (k + 1) if rankings else 1.0
+    return [key for key, _ in ordered], np.asarray([score / scale for _, score in ordered], dtype=np.float64)
+
+
+class BM25Index:
+    """文字バイグラムのBM25転置インデックス（SQLite）
+
+    文書は呼び出し側の行番号で識別する。path を省略するとメモリ内のみで動作する。
+    検索のほか、Pineconeのスパース・デンス検索用のスパースベクトルも生成する。
+    """
+
+    def __init__(self, path=None, k1=DEFAULT_K1, b=DEFAULT_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False, isolation_level=None)
+        if path:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, row INTEGER NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (term, row)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_row ON postings(row)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS docs (row INTEGER PRIMARY KEY, length INTEGER NOT NULL)")
+
+        # 文書長はメモリに保持（行番号 → トークン数、未登録は0）
+        rows = self._conn.execute("SELECT row, length FROM docs").fetchall()
+        self._lengths = np.zeros(max((row for row, _ in rows), default=-1) + 1, dtype=np.int32)
+        for row, length in rows:
+            self._lengths[row] = length
+        self._doc_count = len(rows)
+        self._total_length = int(self._lengths.sum())
+
+    def __len__(self):
+        return self._doc_count
+
+    @property
+    def max_row(self):
+        """登録済みの最大の行番号（未登録なら-1）"""
+        registered = np.flatnonzero(self._lengths)
+        return int(registered[-1]) if len(registered) else -1
+
+    @property
+    def avgdl(self):
+        return self._total_length / self._doc_count if self._doc_count else 0.0
+
+    def add(self, rows, texts):
+        """文書を登録"""
+        postings = []
+        docs = []
+        for row, text in zip(rows, texts):
+            counts = Counter(tokenize(text))
+            if not counts:
+                continue
+            postings.extend((term, row, tf) for term, tf in counts.items())
+            docs.append((row, sum(counts.values())))
+        if not docs:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO postings VALUES (?, ?, ?)", postings)
+                self._conn.executemany("INSERT OR REPLACE INTO docs VALUES (?, ?)", docs)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            required = max(row for row, _ in docs) + 1
+            if required > len(self._lengths):
+                self._lengths = np.concatenate([self._lengths, np.zeros(required - len(self._lengths), dtype=np.int32)])
+            for row, length in docs:
+                if self._lengths[row] == 0:
+                    self._doc_count += 1
+                self._total_length += length - int(self._lengths[row])
+                self._lengths[row] = length
+
+    def delete(self, rows):
+        """文書を削除"""
+        rows = [int(row) for row in rows if row < len(self._lengths) and self._lengths[row] > 0]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("DELETE FROM postings WHERE row = ?", [(row,) for row in rows])
+                self._conn.executemany("DELETE FROM docs WHERE row = ?", [(row,) for row in rows])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            for row in rows:
+                self._doc_count -= 1
+                self._total_length -= int(self._lengths[row])
+                self._lengths[row] = 0
+
+    def _postings(self, term):
+        """語の (行番号の配列, 出現回数の配列)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT row, tf FROM postings WHERE term = ?", (term,)).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        data = np.asarray(rows, dtype=np.int64)
+        return data[:, 0], data[:, 1].astype(np.float64)
+
+    def _idf(self, df):
+        return math.log(1.0 + (self._doc_count - df + 0.5) / (df + 0.5))
+
+    def search(self, query, n_results=10, candidates=None):
+        """BM25スコアの上位n_results件を (行番号の配列, スコアの配列) で返す
+
+        candidates（行番号の配列）を指定した場合はその中だけを対象にする。
+        """
+        terms = Counter(tokenize(query))
+        if not terms or not self._doc_count or n_results <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        avgdl = self.avgdl or 1.0
+        all_rows = []
+        all_scores = []
+        for term, query_tf in terms.items():
+            rows, tf = self._postings(term)
+            if not len(rows):
+                continue
+            norm = self.k1 * (1.0 - self.b + self.b * self._lengths[rows] / avgdl)
+            all_rows.append(rows)
+            all_scores.append(query_tf * self._idf(len(rows)) * tf * (self.k1 + 1.0) / (tf + norm))
+        if not all_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        if candidates is not None:
+            mask = np.isin(rows, candidates)
+            rows, scores = rows[mask], scores[mask]
+
+        k = min(n_results, len(scores))
+        if k == 0:
+            return rows[:0], scores[:0]
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
+
+    def encode_document(self, text):
+        """文書側のスパースベクトル（出現回数を文書長で正規化したBM25の重み）"""
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        avgdl = self.avgdl or max(length, 1)
+        weights = Counter()
+        for term, tf in counts.items():
+            weights[term_index(term)] += tf * (self.k1 + 1.0) / (tf + self.k1 * (1.0 - self.b + self.b * length / avgdl))
+        return _sparse(weights) if weights else None
+
+    def encode_query(self, text):
+        """クエリ側のスパースベクトル（IDFの重み、ローカルの統計を使用）"""
+        weights = Counter()
+        for term in set(tokenize(text)):
+            with self._lock:
+                df = self._conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+            weights[term_index(term)] += self._idf(df)
+        return _sparse(weights) if weights else None
@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+from components.payload_codec import encode_bytes, decode_bytes
+
+# ロガーの設定
+logger = logging.getLogger('app.chunk_store')
+
+# 保存先とキャッシュ件数のデフォルト（環境変数 CHUNK_STORE_PATH / CHUNK_STORE_CACHE_SIZE で上書き可能）
+DEFAULT_STORE_PATH = os.path.join(".cache", "chunk_store.sqlite3")
+DEFAULT_CACHE_SIZE = 2048
+
+# SQLiteのIN句に渡すIDの最大数
+ID_CHUNK = 500
+
+
+def _encode(text, metadata):
+    """本文とメタデータを1つの圧縮BLOBにまとめる"""
+    return encode_bytes([text, metadata])
+
+
+def _decode(blob):
+    text, metadata = decode_bytes(blob)
+    return text, metadata
+
+
+class ChunkStore:
+    """チャンクIDをキーに本文とメタデータを保持するローカルストア（SQLite + LRUキャッシュ）
+
+    Pineconeにはフィルター用の最小限のメタデータだけを登録し、検索・取得結果の本文は
+    このストアから補う。読み出しは直近のcache_size件をメモリにキャッシュする。
+    """
+
+    def __init__(self, path=None, cache_size=None):
+        self.path = path or os.environ.get("CHUNK_STORE_PATH", DEFAULT_STORE_PATH)
+        self.cache_size = cache_size or int(os.environ.get("CHUNK_STORE_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, data BLOB NOT NULL) WITHOUT ROWID")
+
+    def _remember(self, id_, entry):
+        """LRUキャッシュに追加（ロック取得済みで呼ぶ）"""
+        self._cache[id_] = entry
+        self._cache.move_to_end(id_)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def put_many(self, items):
+        """(チャンクID, 本文, メタデータ) を保存"""
+        items = list(items)
+        rows = [(id_, _encode(text, metadata)) for id_, text, metadata in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            for id_, text, metadata in items:
+                if id_ in self._cache:
+                    self._remember(id_, (text, dict(metadata)))
+
+    def get_many(self, ids):
+        """{チャンクID: (本文, メタデータ)} を返す（未登録のIDは含まない）"""
+        found = {}
+        missing = []
+        with self._lock:
+            for id_ in dict.fromkeys(ids):
+                entry = self._cache.get(id_)
+                if entry is None:
+                    missing.append(id_)
+                else:
+                    self._cache.move_to_end(id_)
+                    found[id_] = entry
+            self.hits += len(found)
+            for i in range(0, len(missing), ID_CHUNK):
+                part = missing[i:i + ID_CHUNK]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(f"SELECT id, data FROM chunks WHERE id IN ({placeholders})", part).fetchall()
+                for id_, blob in rows:
+                    entry = _decode(blob)
+                    self._remember(id_, entry)
+                    found[id_] = entry
+            self.misses += len(missing)
+        # 呼び出し側がメタデータを変更してもキャッシュに影響しないようコピーを返す
+        return {id_: (text, dict(metadata)) for id_, (text, metadata) in found.items()}
+
+    def get_texts(self, ids):
+        """{チャンクID: 本文} を返す（オフラインインデックスの本文の取得元）"""
+        return {id_: text for id_, (text, _) in self.get_many(ids).items()}
+
+    def delete(self, ids):
+        """チャンクを削除"""
+        ids = list(ids)
+        if not ids:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for i in range(0, len(ids), ID_CHUNK):
+                    part = ids[i:i + ID_CHUNK]
+                    placeholders = ",".join("?" * len(part))
+                    self._conn.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", part)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            for id_ in ids:
+                self._cache.pop(id_, None)
@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+# ロガーの設定
+logger = logging.getLogger('app.document_manifest')
+
+# マニフェストファイルのデフォルト（環境変数 DOCUMENT_MANIFEST_PATH で上書き可能）
+DEFAULT_MANIFEST_PATH = os.path.join(".cache", "document_manifest.sqlite3")
+
+# ドキュメントを識別するメタデータ項目（いずれもなければ本文のハッシュで識別する）
+DOCUMENT_KEY_FIELDS = ("municipality", "file_name")
+
+# 再登録のたびに変わるため、チャンクの同一性の判定に含めないメタデータ項目
+FINGERPRINT_EXCLUDED_KEYS = ("registration_date",)
+
+# SQLiteのIN句に渡すIDの最大数
+ID_CHUNK = 500
+
+# ハッシュ対象を連結する区切り文字
+_SEPARATOR = "\x1f"
+
+
+def _hash(payload, length=16):
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:length]
+
+
+def metadata_fingerprint(metadata):
+    """チャンクの同一性の判定に使うメタデータのハッシュ"""
+    stable = {k: v for k, v in metadata.items() if v is not None and k not in FINGERPRINT_EXCLUDED_KEYS}
+    return _hash(json.dumps(stable, ensure_ascii=False, sort_keys=True))
+
+
+def content_fingerprint(text, metadata_hash):
+    """ドキュメント全体（本文とメタデータ）のハッシュ"""
+    return _hash(metadata_hash + _SEPARATOR + text, length=32)
+
+
+def document_id(text, metadata):
+    """ドキュメントID（ファイル名などの識別項目があればそこから、なければ本文から生成）"""
+    if metadata.get("file_name"):
+        keys = [str(metadata.get(field) or "") for field in DOCUMENT_KEY_FIELDS]
+        return "doc_" + _hash(_SEPARATOR.join(keys))
+    return "doc_" + _hash(text)
+
+
+def chunk_id(doc_id, chunk, metadata_hash):
+    """チャンクID（ドキュメントID + チャンク本文とメタデータのハッシュ）"""
+    return f"{doc_id}#{_hash(metadata_hash + _SEPARATOR + chunk)}"
+
+
+class DocumentManifest:
+    """登録済みのドキュメントとチャンクIDの台帳（SQLite）
+
+    再登録時は台帳と比較して、新規・変更されたチャンクだけを埋め込み・アップロードし、
+    なくなったチャンクを削除する。scope（インデックス名と名前空間）ごとに管理する。
+    """
+
+    def __init__(self, path=None, scope=""):
+        self.path = path or os.environ.get("DOCUMENT_MANIFEST_PATH", DEFAULT_MANIFEST_PATH)
+        self.scope = scope
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                scope TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                name TEXT,
+                fingerprint TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                metadata TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (scope, doc_id)
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                scope TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                namespace TEXT,
+                PRIMARY KEY (scope, chunk_id)
+            )
+            """
+        )
+        # 登録先の名前空間の列がない古い台帳には列を追加する（既存の行はNULL = 登録先が不明）
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+        if "namespace" not in columns:
+            self._conn.execute("ALTER TABLE chunks ADD COLUMN namespace TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(scope, doc_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_updated ON documents(scope, updated_at)")
+
+    @staticmethod
+    def _document_from_row(row):
+        return {
+            "doc_id": row[0],
+            "name": row[1],
+            "fingerprint": row[2],
+            "chunk_count": row[3],
+            "metadata": json.loads(row[4]),
+            "updated_at": row[5],
+        }
+
+    def get_document(self, doc_id):
+        """ドキュメントの登録情報を返す（未登録ならNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doc_id, name, fingerprint, chunk_count, metadata, updated_at FROM documents WHERE scope = ? AND doc_id = ?",
+                (self.scope, doc_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return self._document_from_row(row)
+
+    @staticmethod
+    def _list_conditions(municipality=None, category=None):
+        """一覧の絞り込み条件（部分一致）をSQLのWHERE句に変換"""
+        clauses = ["scope = ?"]
+        params = []
+        if municipality:
+            clauses.append("json_extract(metadata, '$.municipality') LIKE ?")
+            params.append(f"%{municipality}%")
+        if category:
+            clauses.append("(json_extract(metadata, '$.major_category') LIKE ? OR json_extract(metadata, '$.medium_category') LIKE ?)")
+            params.extend([f"%{category}%"] * 2)
+        return " AND ".join(clauses), params
+
+    def list_documents(self, offset=0, limit=50, municipality=None, category=None):
+        """登録済みドキュメントを更新日時の新しい順に返す（市区町村名・カテゴリの部分一致で絞り込み可能）"""
+        where, params = self._list_conditions(municipality, category)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT doc_id, name, fingerprint, chunk_count, metadata, updated_at FROM documents WHERE {where} "
+                "ORDER BY updated_at DESC, doc_id LIMIT ? OFFSET ?",
+                [self.scope, *params, limit, offset]
+            ).fetchall()
+        return [self._document_from_row(row) for row in rows]
+
+    def count_documents(self, municipality=None, category=None):
+        """登録済みドキュメント数"""
+        where, params = self._list_conditions(municipality, category)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM documents WHERE {where}", [self.scope, *params]).fetchone()[0]
+
+    def chunk_ids(self, doc_id):
+        """ドキュメントの登録済みチャンクIDの集合"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id FROM chunks WHERE scope = ? AND doc_id = ?", (self.scope, doc_id)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def chunk_namespaces(self, chunk_ids):
+        """チャンクIDごとの登録先の名前空間（台帳にない、または登録先が不明なチャンクは含めない）"""
+        chunk_ids = list(chunk_ids)
+        namespaces = {}
+        with self._lock:
+            for i in range(0, len(chunk_ids), ID_CHUNK):
+                part = chunk_ids[i:i + ID_CHUNK]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT chunk_id, namespace FROM chunks WHERE scope = ? AND chunk_id IN ({placeholders}) "
+                    "AND namespace IS NOT NULL",
+                    [self.scope, *part]
+                ).fetchall()
+                namespaces.update(rows)
+        return namespaces
+
+    def namespaces(self):
+        """チャンクの登録先として記録されている名前空間の一覧"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT namespace FROM chunks WHERE scope = ? AND namespace IS NOT NULL", (self.scope,)
+            ).fetchall()
+        return sorted(row[0] for row in rows)
+
+    def record(self, doc_id, name, fingerprint, metadata, chunk_ids, namespaces=None):
+        """ドキュメントの登録済みチャンクを chunk_ids に置き換える
+
+        namespaces（チャンクID → 登録先の名前空間）にないチャンクは、記録済みの登録先を引き継ぐ。
+        """
+        namespaces = namespaces or {}
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                known = dict(self._conn.execute(
+                    "SELECT chunk_id, namespace FROM chunks WHERE scope = ? AND doc_id = ?", (self.scope, doc_id)
+                ).fetchall())
+                self._conn.execute("DELETE FROM chunks WHERE scope = ? AND doc_id = ?", (self.scope, doc_id))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                    [(self.scope, cid, doc_id, namespaces.get(cid, known.get(cid))) for cid in chunk_ids]
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (self.scope, doc_id, name, fingerprint, len(chunk_ids),
+                     json.dumps(metadata, ensure_ascii=False), now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def remove_chunks(self, chunk_ids):
+        """チャンクIDを台帳から削除（チャンクがなくなったドキュメントも削除）"""
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                doc_ids = set()
+                for i in range(0, len(chunk_ids), ID_CHUNK):
+                    part = chunk_ids[i:i + ID_CHUNK]
+                    placeholders = ",".join("?" * len(part))
+                    rows = self._conn.execute(
+                        f"SELECT DISTINCT doc_id FROM chunks WHERE scope = ? AND chunk_id IN ({placeholders})",
+                        [self.scope, *part]
+                    ).fetchall()
+                    doc_ids.update(row[0] for row in rows)
+                    self._conn.execute(
+                        f"DELETE FROM chunks WHERE scope = ? AND chunk_id IN ({placeholders})", [self.scope, *part]
+                    )
+                for doc_id in doc_ids:
+                    remaining = self._conn.execute(
+                        "SELECT COUNT(*) FROM chunks WHERE scope = ? AND doc_id = ?", (self.scope, doc_id)
+                    ).fetchone()[0]
+                    if remaining:
+                        self._conn.execute(
+                            "UPDATE documents SET chunk_count = ? WHERE scope = ? AND doc_id = ?",
+                            (remaining, self.scope, doc_id)
+                        )
+                    else:
+                        self._conn.execute("DELETE FROM documents WHERE scope = ? AND doc_id = ?", (self.scope, doc_id))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
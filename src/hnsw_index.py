@@ -0,0 +1,106 @@
+import os
+import logging
+import threading
+import numpy as np
+
+# hnswlibのインポートを試みる
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except Exception as e:
+    hnswlib = None
+    HNSWLIB_AVAILABLE = False
+
+# ロガーの設定
+logger = logging.getLogger('app.hnsw_index')
+
+# パラメータのデフォルト（環境変数 HNSW_M / HNSW_EF_CONSTRUCTION / HNSW_EF で上書き可能）
+DEFAULT_M = 16
+DEFAULT_EF_CONSTRUCTION = 200
+DEFAULT_EF = 64
+
+
+class HNSWIndex:
+    """hnswlibによる近似最近傍インデックス（コサイン類似度）
+
+    ラベルには呼び出し側の行番号を使う。add()で逐次追加でき、容量は自動で拡張する。
+    """
+
+    def __init__(self, dim, max_elements=1024, M=None, ef_construction=None, ef=None):
+        if not HNSWLIB_AVAILABLE:
+            raise ImportError("hnswlibが利用できないため、HNSWインデックスを使用できません")
+        self.dim = dim
+        self.M = M or int(os.environ.get("HNSW_M", DEFAULT_M))
+        self.ef_construction = ef_construction or int(os.environ.get("HNSW_EF_CONSTRUCTION", DEFAULT_EF_CONSTRUCTION))
+        self.ef = ef or int(os.environ.get("HNSW_EF", DEFAULT_EF))
+        self._lock = threading.Lock()
+        self._index = hnswlib.Index(space="cosine", dim=dim)
+        self._index.init_index(max_elements=max_elements, ef_construction=self.ef_construction, M=self.M)
+        self._index.set_ef(self.ef)
+
+    def __len__(self):
+        return self._index.get_current_count()
+
+    def set_ef(self, ef):
+        """検索時の探索幅を設定（大きいほど高精度・低速）"""
+        self.ef = ef
+        self._index.set_ef(ef)
+
+    def add(self, vectors, labels):
+        """ベクトルを追加（容量が足りない場合は2倍以上に拡張）"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        labels = np.asarray(labels, dtype=np.int64)
+        if len(labels) == 0:
+            return
+        with self._lock:
+            required = self._index.get_current_count() + len(labels)
+            if required > self._index.get_max_elements():
+                self._index.resize_index(max(required, self._index.get_max_elements() * 2))
+            self._index.add_items(vectors, labels)
+
+    def mark_deleted(self, labels):
+        """ラベルを検索対象から除外（削除済み・未登録のラベルは無視）"""
+        with self._lock:
+            for label in labels:
+                try:
+                    self._index.mark_deleted(int(label))
+                except RuntimeError:
+                    pass
+
+    def search(self, query, k=5, filter=None):
+        """上位k件を (ラベルの配列, コサイン類似度の配列) で返す
+
+        filter にはラベルを受け取って真偽値を返す関数を指定できる。
+        削除済みの要素やフィルターのために有効な要素がk件に満たない場合はNoneを返す
+        （見つかった件数を減らさないよう、呼び出し側で全件走査に切り替える）。
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        try:
+            labels, distances = self._index.knn_query(query, k=k, filter=filter)
+        except RuntimeError:
+            return None
+        return labels[0].astype(np.int64), 1.0 - distances[0]
+
+    def save(self, path):
+        """インデックスをファイルに保存（一時ファイル経由で置き換え）"""
+        tmp_path = path + ".tmp"
+        with self._lock:
+            self._index.save_index(tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, dim, max_elements=None, ef=None):
+        """保存済みのインデックスを読み込む"""
+        index = cls.__new__(cls)
+        index.dim = dim
+        index._lock = threading.Lock()
+        index._index = hnswlib.Index(space="cosine", dim=dim)
+        index._index.load_index(path, max_elements=max_elements or 0)
+        index.M = index._index.M
+        index.ef_construction = index._index.ef_construction
+        index.ef = ef or int(os.environ.get("HNSW_EF", DEFAULT_EF))
+        index._index.set_ef(index.ef)
+        return index
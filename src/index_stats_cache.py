@@ -0,0 +1,104 @@
+import os
+import time
+import logging
+import threading
+
+# ロガーの設定
+logger = logging.getLogger('app.index_stats_cache')
+
+# 統計の有効期間（秒、環境変数 INDEX_STATS_TTL で上書き可能）
+DEFAULT_TTL = 60
+
+
+class IndexStatsCache:
+    """インデックス統計（describe_index_stats）のTTL付きキャッシュ
+
+    期限切れの統計は即座に返しつつバックグラウンドで更新する（同時に走る更新は1つだけ）。
+    ローカルでのアップロード・削除は件数に反映したうえで期限切れ扱いにし、次の参照で再取得する。
+    fetch は {"total_vector_count", "dimension", "namespaces": {名前空間: 件数}} を返す同期関数。
+    """
+
+    def __init__(self, fetch, ttl=None):
+        self.fetch = fetch
+        self.ttl = float(os.environ.get("INDEX_STATS_TTL", DEFAULT_TTL)) if ttl is None else ttl
+        self._stats = None
+        self._fetched_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        # 実行中の更新の完了を待つための条件変数（_lockを共有）
+        self._refreshed = threading.Condition(self._lock)
+
+    def _is_fresh(self):
+        return self._stats is not None and time.monotonic() - self._fetched_at < self.ttl
+
+    def _refresh(self):
+        """統計を取得してキャッシュを更新（失敗時は古い統計を残す）"""
+        try:
+            stats = self.fetch()
+            if stats is not None:
+                with self._lock:
+                    self._stats = stats
+                    self._fetched_at = time.monotonic()
+            return stats
+        except Exception as e:
+            logger.error(f"インデックス統計の取得中にエラー: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._refreshing = False
+                self._refreshed.notify_all()
+
+    def refresh_async(self):
+        """バックグラウンドで統計を更新（更新中なら何もしない）"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="index-stats-refresh", daemon=True).start()
+
+    def get(self, wait=True):
+        """統計を返す
+
+        期限切れなら古い統計を返してバックグラウンドで更新する。まだ一度も取得していない場合、
+        wait=True なら取得を待ち（実行中の更新があればその完了を待つ）、wait=False ならNoneを返す
+        （取得はバックグラウンドで開始）。
+        """
+        with self._lock:
+            stats = self._stats
+            fresh = self._is_fresh()
+        if fresh:
+            return stats
+        if stats is not None or not wait:
+            self.refresh_async()
+            return stats
+        with self._lock:
+            if self._refreshing:
+                # 実行中の更新（起動時のバックグラウンド取得など）と重複して取得しない
+                while self._refreshing:
+                    self._refreshed.wait()
+                return self._stats
+            self._refreshing = True
+        return self._refresh()
+
+    def namespace_counts(self, wait=True):
+        """名前空間ごとのベクトル数"""
+        stats = self.get(wait=wait)
+        return dict(stats["namespaces"]) if stats else {}
+
+    def apply_delta(self, namespace, delta):
+        """ローカルでのアップロード・削除を件数に反映し、次の参照で再取得させる"""
+        with self._lock:
+            if self._stats is not None and delta:
+                namespaces = dict(self._stats["namespaces"])
+                namespaces[namespace] = max(0, namespaces.get(namespace, 0) + delta)
+                self._stats = {
+                    **self._stats,
+                    "total_vector_count": max(0, self._stats["total_vector_count"] + delta),
+                    "namespaces": namespaces,
+                }
+            self._fetched_at = 0.0
+
+    def invalidate(self):
+        """キャッシュを期限切れにする（統計は次の参照で再取得）"""
+        with self._lock:
+            self._fetched_at = 0.0
@@ -0,0 +1,74 @@
+import numpy as np
+
+# 転置インデックスを作成するメタデータ項目（manage_dbの登録フォームのカテゴリ項目）
+DEFAULT_INDEXED_FIELDS = ("municipality", "major_category", "medium_category", "source")
+
+
+class MetadataIndex:
+    """カテゴリ型メタデータの転置インデックス（項目 → 値 → 行番号の集合）
+
+    既存のフィルターと同じく、項目を持たない行はどの値の条件にも一致する扱いとする。
+    """
+
+    def __init__(self, fields=DEFAULT_INDEXED_FIELDS):
+        self.fields = tuple(fields)
+        self._postings = {field: {} for field in self.fields}
+        # 項目を持たない行
+        self._missing = {field: set() for field in self.fields}
+
+    def add(self, row, metadata):
+        """行を登録"""
+        for field in self.fields:
+            value = metadata.get(field)
+            if value is None or value == "":
+                self._missing[field].add(row)
+            else:
+                self._postings[field].setdefault(value, set()).add(row)
+
+    def remove(self, row, metadata):
+        """行を削除"""
+        for field in self.fields:
+            value = metadata.get(field)
+            if value is None or value == "":
+                self._missing[field].discard(row)
+                continue
+            rows = self._postings[field].get(value)
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del self._postings[field][value]
+
+    def values(self, field):
+        """項目の値ごとの件数"""
+        return {value: len(rows) for value, rows in self._postings.get(field, {}).items()}
+
+    def candidates(self, conditions):
+        """条件に一致する行番号の集合と、インデックス対象外の残りの条件を返す
+
+        インデックス対象の条件がない場合、集合は None を返す。
+        """
+        indexed = [(k, v) for k, v in conditions.items() if k in self._postings]
+        remaining = {k: v for k, v in conditions.items() if k not in self._postings}
+        if not indexed:
+            return None, remaining
+
+        # 各条件の候補（値が一致 ∪ 項目なし）を小さい順に積集合をとる
+        sets = []
+        for field, value in indexed:
+            matched = self._postings[field].get(value, set())
+            missing = self._missing[field]
+            sets.append((len(matched) + len(missing), matched, missing))
+        sets.sort(key=lambda item: item[0])
+
+        _, matched, missing = sets[0]
+        result = matched | missing
+        for _, matched, missing in sets[1:]:
+            if not result:
+                break
+            result = {row for row in result if row in matched or row in missing}
+        return result, remaining
+
+    @staticmethod
+    def to_array(rows):
+        """行番号の集合を昇順のnumpy配列に変換"""
+        return np.fromiter(sorted(rows), dtype=np.int64, count=len(rows))
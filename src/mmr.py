@@ -0,0 +1,40 @@
+import numpy as np
+
+# 関連度と多様性の重みのデフォルト（1.0で関連度のみ、0.0で多様性のみ）
+DEFAULT_LAMBDA = 0.5
+
+
+def _normalize(vectors):
+    """行ごとにL2正規化（ゼロベクトルはそのまま）"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def maximal_marginal_relevance(query_embedding, embeddings, k=5, lambda_mult=DEFAULT_LAMBDA):
+    """Maximal Marginal Relevanceで候補からk件を選び、選んだ順にインデックスを返す
+
+    候補同士の類似度行列を1回の行列積で求め、選択済みの候補との最大類似度を
+    ベクトルで更新しながら貪欲に選ぶ（計算量は O(n·d + k·n)）。
+    """
+    candidates = _normalize(np.asarray(embeddings, dtype=np.float32))
+    if candidates.ndim != 2 or len(candidates) == 0 or k <= 0:
+        return []
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+    k = min(k, len(candidates))
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    available = np.ones(len(candidates), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
@@ -0,0 +1,510 @@
+import os
+import json
+import atexit
+import logging
+import threading
+import numpy as np
+from src.hnsw_index import HNSWIndex, HNSWLIB_AVAILABLE
+from src.metadata_index import MetadataIndex
+from src.bm25_index import BM25Index, rank_fusion
+
+# ロガーの設定
+logger = logging.getLogger('app.offline_vector_index')
+
+# 永続化ファイルの配置先のデフォルト（環境変数 OFFLINE_INDEX_PATH で上書き、空文字でメモリ内のみ）
+DEFAULT_OFFLINE_INDEX_PATH = os.path.join(".cache", "offline_index")
+
+# 永続化ファイル名
+HEADER_FILE = "index.json"
+VECTORS_FILE = "vectors.f32"
+IDS_FILE = "ids.txt"
+METADATA_FILE = "metadata.jsonl"
+TEXTS_FILE = "texts.bin"
+TEXT_INDEX_FILE = "text_index.i64"
+HNSW_FILE = "hnsw.bin"
+DELETED_FILE = "deleted.i64"
+LEXICAL_FILE = "bm25.sqlite3"
+FORMAT_VERSION = 1
+
+# 近似最近傍検索（HNSW）の設定
+#   OFFLINE_ANN: auto（件数がHNSW_MIN_ROWS以上で使用）/ hnsw（常に使用）/ off（全件走査のみ）
+DEFAULT_HNSW_MIN_ROWS = 10000
+# フィルター後の候補がこれより少ない場合は全件走査の方が速い
+ANN_MIN_CANDIDATES = 2048
+# 追加がこの件数たまったらHNSWインデックスを保存する
+HNSW_SAVE_INTERVAL = 1000
+# HNSWインデックス構築時に一度に追加する行数
+HNSW_BUILD_CHUNK = 10000
+# ハイブリッド検索で各検索から取得する候補数（n_resultsに対する倍率）
+HYBRID_CANDIDATE_FACTOR = 4
+
+
+class OfflineVectorIndex:
+    """緊急オフラインモード用のベクトルインデックス
+
+    埋め込みは正規化済みのfloat32行列として連続領域に保持し、検索は
+    フィルター適用 → 行列ベクトル積1回 → argpartitionによる上位k件抽出で行う。
+
+    path を指定するとディスクに追記型で永続化し、行列はメモリマップで参照する。
+    チャンク本文は texts.bin に置いて検索結果に必要な分だけ読み出すため、
+    プロセスのメモリにはIDとテキスト以外のメタデータだけが残る。
+    set_text_source() で本文の取得元（チャンクストア）を指定した場合は本文を保持せず、
+    必要な分だけ取得元から読み出す（それ以前に texts.bin に書いた行はそのまま読める）。
+
+    フィルター条件はカテゴリ項目の転置インデックスで候補行の集合に変換する。
+    削除と同じIDの再追加は行を論理削除（deleted.i64に追記）して扱う。
+    チャンク本文はBM25の転置インデックス（bm25.sqlite3）にも登録し、キーワード検索・ハイブリッド検索に使う。
+    """
+
+    def __init__(self, dim=None, initial_capacity=1024, path=None):
+        self.dim = dim
+        self.path = path
+        self._capacity = initial_capacity
+        self._matrix = None
+        self._size = 0
+        self._lock = threading.RLock()
+        self.ids = []
+        # テキストを除いたメタデータ（フィルターと検索結果に使用）
+        self.attributes = []
+        # メモリ内モードのテキスト / 永続化モードのテキスト位置 (offset, length)
+        self._texts = []
+        self._text_index = np.empty((0, 2), dtype=np.int64)
+        self._texts_handle = None
+        # 本文の取得元（IDのリストを受け取り {ID: 本文} を返す関数。Noneなら本文を自分で保持する）
+        self.text_source = None
+
+        # IDから有効な行番号への対応、論理削除した行、カテゴリ項目の転置インデックス
+        self._row_of = {}
+        self._deleted = set()
+        self._deleted_rows = np.empty(0, dtype=np.int64)
+        self.metadata_index = MetadataIndex()
+
+        # 近似最近傍インデックス（必要になった時点で構築・読み込み）
+        self.ann_mode = os.environ.get("OFFLINE_ANN", "auto").lower()
+        self.hnsw_min_rows = int(os.environ.get("HNSW_MIN_ROWS", DEFAULT_HNSW_MIN_ROWS))
+        self._ann = None
+        self._ann_unsaved = 0
+
+        if self.path:
+            self._open()
+        self.lexical = BM25Index(self._file(LEXICAL_FILE) if self.path else None)
+        self._sync_lexical()
+
+    def __len__(self):
+        return self._size - len(self._deleted)
+
+    # ---- 永続化 ----
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _open(self):
+        """既存のファイルを読み込む（なければ空のインデックスを作成）"""
+        os.makedirs(self.path, exist_ok=True)
+        header_path = self._file(HEADER_FILE)
+        if not os.path.exists(header_path):
+            for name in (VECTORS_FILE, IDS_FILE, METADATA_FILE, TEXTS_FILE, TEXT_INDEX_FILE, DELETED_FILE):
+                open(self._file(name), "wb").close()
+            self._write_header()
+            logger.info(f"オフラインインデックスを作成しました: {self.path}")
+            return
+
+        with open(header_path, "r", encoding="utf-8") as f:
+            header = json.load(f)
+        count = header.get("count", 0)
+        self.dim = header.get("dim") or self.dim
+
+        # ヘッダーの件数を正とし、書き込み途中で終了した末尾のデータは切り捨てる
+        with open(self._file(IDS_FILE), "r", encoding="utf-8") as f:
+            self.ids = [line.rstrip("\n") for _, line in zip(range(count), f)]
+        with open(self._file(METADATA_FILE), "r", encoding="utf-8") as f:
+            self.attributes = [json.loads(line) for _, line in zip(range(count), f)]
+        self._text_index = np.fromfile(self._file(TEXT_INDEX_FILE), dtype=np.int64)[:count * 2].reshape(-1, 2)
+        if len(self.ids) != count or len(self.attributes) != count or len(self._text_index) != count:
+            raise ValueError(f"オフラインインデックスのファイルが破損しています: {self.path}")
+        self._truncate_to(count)
+
+        deleted_path = self._file(DELETED_FILE)
+        if os.path.exists(deleted_path):
+            deleted = np.fromfile(deleted_path, dtype=np.int64)
+            self._deleted = {int(row) for row in deleted if row < count}
+
+        self._size = count
+        self._remap()
+        self._rebuild_lookup()
+        logger.info(f"オフラインインデックスを読み込みました: {self.path} ({len(self)}件, 次元数: {self.dim})")
+
+    def _truncate_to(self, count):
+        """ヘッダーの件数を超える末尾のデータを削除"""
+        row_bytes = (self.dim or 0) * 4
+        with open(self._file(VECTORS_FILE), "r+b") as f:
+            f.truncate(count * row_bytes)
+        with open(self._file(TEXT_INDEX_FILE), "r+b") as f:
+            f.truncate(count * 16)
+        text_end = int(self._text_index[-1].sum()) if count else 0
+        with open(self._file(TEXTS_FILE), "r+b") as f:
+            f.truncate(text_end)
+        for name, lines in ((IDS_FILE, self.ids), (METADATA_FILE, self.attributes)):
+            with open(self._file(name), "r+b") as f:
+                end = 0
+                for _ in range(len(lines)):
+                    end += len(f.readline())
+                f.truncate(end)
+
+    def _rebuild_lookup(self):
+        """IDの対応表と転置インデックスを読み込んだメタデータから再構築"""
+        self._row_of = {}
+        self.metadata_index = MetadataIndex()
+        for row, (id_, metadata) in enumerate(zip(self.ids, self.attributes)):
+            if row in self._deleted:
+                continue
+            self._row_of[id_] = row
+            self.metadata_index.add(row, metadata)
+        self._deleted_rows = MetadataIndex.to_array(self._deleted)
+
+    def _sync_lexical(self):
+        """BM25インデックスをベクトルの行と揃える（導入前のインデックスの移行・書き込み途中の終了への対処）"""
+        if self.lexical.max_row >= self._size:
+            self.lexical.delete(range(self._size, self.lexical.max_row + 1))
+        start = self.lexical.max_row + 1
+        rows = [row for row in range(start, self._size) if row not in self._deleted]
+        if not rows:
+            return
+        logger.info(f"BM25インデックスに{len(rows)}件を追加します")
+        for begin in range(0, len(rows), HNSW_BUILD_CHUNK):
+            part = rows[begin:begin + HNSW_BUILD_CHUNK]
+            self.lexical.add(part, [self.get_text(row) for row in part])
+
+    def _write_header(self):
+        """ヘッダーを原子的に書き換える（追記したデータはこの時点で確定する）"""
+        header = {"version": FORMAT_VERSION, "dim": self.dim, "count": self._size}
+        tmp_path = self._file(HEADER_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(header, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._file(HEADER_FILE))
+
+    def _remap(self):
+        """ベクトルファイルをメモリマップし直す"""
+        if self._size == 0 or not self.dim:
+            self._matrix = None
+            return
+        self._matrix = np.memmap(self._file(VECTORS_FILE), dtype=np.float32, mode="r", shape=(self._size, self.dim))
+
+    def _append_files(self, ids, block, metadatas):
+        """ベクトル・ID・メタデータ・テキストをファイル末尾に追記"""
+        with open(self._file(VECTORS_FILE), "ab") as f:
+            f.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+
+        with open(self._file(TEXTS_FILE), "ab") as f:
+            offset = f.tell()
+            positions = np.empty((len(metadatas), 2), dtype=np.int64)
+            for i, metadata in enumerate(metadatas):
+                encoded = b"" if self.text_source is not None else str(metadata.get("text", "")).encode("utf-8")
+                f.write(encoded)
+                positions[i] = (offset, len(encoded))
+                offset += len(encoded)
+        with open(self._file(TEXT_INDEX_FILE), "ab") as f:
+            f.write(positions.tobytes())
+
+        with open(self._file(IDS_FILE), "a", encoding="utf-8") as f:
+            f.write("".join(f"{id_}\n" for id_ in ids))
+        with open(self._file(METADATA_FILE), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(self._strip_text(m), ensure_ascii=False) + "\n" for m in metadatas))
+        return positions
+
+    # ---- メモリ内の行列 ----
+
+    def _ensure_capacity(self, required):
+        """行列の容量を確保（不足時は2倍ずつ拡張）"""
+        if self._matrix is None:
+            self._capacity = max(self._capacity, required)
+            self._matrix = np.zeros((self._capacity, self.dim), dtype=np.float32)
+            return
+        if required <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < required:
+            capacity *= 2
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        self._matrix = matrix
+        self._capacity = capacity
+
+    @staticmethod
+    def _normalize(vectors):
+        """行ごとにL2正規化（ゼロベクトルはそのまま）"""
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @staticmethod
+    def _strip_text(metadata):
+        return {k: v for k, v in metadata.items() if k != "text"}
+
+    # ---- 近似最近傍インデックス ----
+
+    def _ann_enabled(self):
+        if self.ann_mode == "off" or not HNSWLIB_AVAILABLE or not self.dim:
+            return False
+        return self.ann_mode == "hnsw" or self._size >= self.hnsw_min_rows
+
+    def _ensure_ann(self):
+        """HNSWインデックスを取得（未構築なら保存済みファイルの読み込みか新規構築を行う）"""
+        if not self._ann_enabled():
+            return None
+        with self._lock:
+            created = self._ann is None
+            if created:
+                hnsw_path = self._file(HNSW_FILE) if self.path else None
+                if hnsw_path and os.path.exists(hnsw_path):
+                    try:
+                        self._ann = HNSWIndex.load(hnsw_path, self.dim, max_elements=self._size)
+                        logger.info(f"HNSWインデックスを読み込みました: {len(self._ann)}件")
+                    except Exception as e:
+                        logger.error(f"HNSWインデックスの読み込みに失敗したため再構築します: {e}")
+                if self._ann is None or len(self._ann) > self._size:
+                    self._ann = HNSWIndex(self.dim, max_elements=max(self._size, 1024))
+
+            # 未登録の行を追加（ラベル = 行番号）
+            start = len(self._ann)
+            if start < self._size:
+                logger.info(f"HNSWインデックスに{self._size - start}件を追加します")
+                for begin in range(start, self._size, HNSW_BUILD_CHUNK):
+                    end = min(begin + HNSW_BUILD_CHUNK, self._size)
+                    self._ann.add(self._matrix[begin:end], np.arange(begin, end))
+                self._ann_unsaved += self._size - start
+            if created or start < self._size:
+                # 読み込み・構築後に論理削除済みの行を反映（反映済みの行は無視される）
+                self._ann.mark_deleted(self._deleted_rows)
+            self._save_ann_if_needed(force=True)
+            return self._ann
+
+    def _save_ann_if_needed(self, force=False):
+        """一定件数の追加ごとにHNSWインデックスを保存（永続化モードのみ）"""
+        if not self.path or self._ann is None or self._ann_unsaved == 0:
+            return
+        if force or self._ann_unsaved >= HNSW_SAVE_INTERVAL:
+            try:
+                self._ann.save(self._file(HNSW_FILE))
+                self._ann_unsaved = 0
+            except Exception as e:
+                logger.error(f"HNSWインデックスの保存中にエラー: {e}")
+
+    def flush(self):
+        """未保存のHNSWインデックスを保存"""
+        with self._lock:
+            self._save_ann_if_needed(force=True)
+
+    # ---- 公開API ----
+
+    def add(self, ids, vectors, metadatas):
+        """ベクトルを追加（永続化モードではファイルに追記）"""
+        if not ids:
+            return
+        block = np.asarray(vectors, dtype=np.float32)
+        if block.ndim != 2:
+            raise ValueError(f"ベクトルの形状が不正です: {block.shape}")
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = block.shape[1]
+            elif block.shape[1] != self.dim:
+                raise ValueError(f"ベクトルの次元数が一致しません: {block.shape[1]} (期待値: {self.dim})")
+            block = self._normalize(block)
+
+            if self.path:
+                positions = self._append_files(ids, block, metadatas)
+                self._text_index = np.concatenate([self._text_index, positions])
+                self._size += len(block)
+                self._write_header()
+                self._remap()
+            else:
+                self._ensure_capacity(self._size + len(block))
+                self._matrix[self._size:self._size + len(block)] = block
+                self._size += len(block)
+                self._texts.extend("" if self.text_source is not None else str(m.get("text", "")) for m in metadatas)
+
+            start = self._size - len(block)
+            self.ids.extend(ids)
+            self.attributes.extend(self._strip_text(m) for m in metadatas)
+            self.lexical.add(range(start, self._size), [str(m.get("text", "")) for m in metadatas])
+
+            # 同じIDの古い行は論理削除し、新しい行を登録する
+            replaced = [self._row_of[id_] for id_ in ids if id_ in self._row_of]
+            for row, id_ in enumerate(ids, start):
+                self._row_of[id_] = row
+                self.metadata_index.add(row, self.attributes[row])
+            if replaced:
+                self._mark_deleted(replaced)
+
+            # 構築済みのHNSWインデックスには逐次追加する
+            if self._ann is not None:
+                self._ann.add(block, np.arange(start, self._size))
+                self._ann_unsaved += len(block)
+                self._save_ann_if_needed()
+
+    def delete(self, ids):
+        """IDを指定して行を論理削除し、削除した件数を返す"""
+        with self._lock:
+            rows = [self._row_of.pop(id_) for id_ in ids if id_ in self._row_of]
+            if rows:
+                self._mark_deleted(rows)
+            return len(rows)
+
+    def _mark_deleted(self, rows):
+        """行を論理削除して転置インデックスとHNSWインデックスから除外（ロック取得済みで呼ぶ）"""
+        rows = [row for row in rows if row not in self._deleted]
+        if not rows:
+            return
+        for row in rows:
+            self.metadata_index.remove(row, self.attributes[row])
+        self.lexical.delete(rows)
+        self._deleted.update(rows)
+        self._deleted_rows = MetadataIndex.to_array(self._deleted)
+        if self.path:
+            with open(self._file(DELETED_FILE), "ab") as f:
+                f.write(np.asarray(rows, dtype=np.int64).tobytes())
+        if self._ann is not None:
+            self._ann.mark_deleted(rows)
+
+    def set_text_source(self, fetch):
+        """本文の取得元を指定（以降に追加する行の本文は保持しない）"""
+        self.text_source = fetch
+
+    def get_text(self, row):
+        """行番号に対応するチャンク本文を返す（保持していなければ取得元から読み出す）"""
+        text = ""
+        if not self.path:
+            text = self._texts[row]
+        else:
+            offset, length = self._text_index[row]
+            if length:
+                with self._lock:
+                    if self._texts_handle is None:
+                        self._texts_handle = open(self._file(TEXTS_FILE), "rb")
+                    self._texts_handle.seek(int(offset))
+                    text = self._texts_handle.read(int(length)).decode("utf-8")
+        if not text and self.text_source is not None:
+            id_ = self.ids[row]
+            text = self.text_source([id_]).get(id_, "")
+        return text
+
+    def row_of(self, id_):
+        """IDに対応する有効な行番号（なければNone）"""
+        return self._row_of.get(id_)
+
+    def get_vectors(self, rows):
+        """行番号に対応する正規化済みベクトルを返す"""
+        with self._lock:
+            matrix = self._matrix
+        return np.asarray(matrix[np.asarray(rows, dtype=np.int64)])
+
+    def get_metadata(self, row):
+        """行番号に対応するメタデータ（本文を含む）を返す"""
+        return {"text": self.get_text(row), **self.attributes[row]}
+
+    def _filter_rows(self, filter_conditions):
+        """フィルター条件に一致する有効な行番号を返す（キーを持たない行は一致扱い）
+
+        カテゴリ項目は転置インデックスの積集合で求め、それ以外の項目だけを候補の行で照合する。
+        """
+        conditions = {k: v for k, v in filter_conditions.items() if k and v}
+        if not conditions:
+            return None
+        with self._lock:
+            rows, remaining = self.metadata_index.candidates(conditions)
+            if rows is None:
+                rows = self._row_of.values()
+            if remaining:
+                rows = [
+                    row for row in rows
+                    if all(self.attributes[row].get(key, value) == value for key, value in remaining.items())
+                ]
+            return MetadataIndex.to_array(set(rows))
+
+    def search(self, query_embedding, n_results=5, filter_conditions=None):
+        """コサイン類似度の上位n_results件を (行番号の配列, 類似度の配列) で返す"""
+        with self._lock:
+            size = self._size
+            matrix = self._matrix
+            deleted_rows = self._deleted_rows
+        if size == len(deleted_rows) or n_results <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = self._normalize(np.asarray(query_embedding, dtype=np.float32))
+
+        # スコア計算の前に候補を絞り込む
+        candidates = self._filter_rows(filter_conditions) if filter_conditions else None
+
+        # 候補が多い場合は近似最近傍検索を使う
+        if candidates is None or len(candidates) >= ANN_MIN_CANDIDATES:
+            ann = self._ensure_ann()
+            if ann is not None:
+                allowed = None
+                if candidates is not None:
+                    candidate_set = set(candidates.tolist())
+                    allowed = candidate_set.__contains__
+                result = ann.search(query, n_results, filter=allowed)
+                if result is not None:
+                    return result
+                # 有効な要素がn_results件に満たない場合は下の全件走査で正確に求める
+
+        if candidates is None:
+            scores = matrix[:size] @ query
+            if len(deleted_rows):
+                scores[deleted_rows] = -np.inf
+        elif len(candidates) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        else:
+            scores = matrix[candidates] @ query
+
+        k = min(n_results, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+
+        if candidates is None and len(deleted_rows):
+            top = top[np.isfinite(scores[top])]
+        rows = candidates[top] if candidates is not None else top
+        return rows, scores[top]
+
+
+    def lexical_search(self, query, n_results=5, filter_conditions=None):
+        """BM25スコアの上位n_results件を (行番号の配列, スコアの配列) で返す"""
+        candidates = self._filter_rows(filter_conditions) if filter_conditions else None
+        return self.lexical.search(query, n_results, candidates)
+
+    def hybrid_search(self, query, query_embedding, n_results=5, filter_conditions=None):
+        """ベクトル検索とBM25検索の順位を融合した上位n_results件を (行番号の配列, 融合スコアの配列) で返す"""
+        candidates_count = n_results * HYBRID_CANDIDATE_FACTOR
+        dense_rows, _ = self.search(query_embedding, candidates_count, filter_conditions)
+        lexical_rows, _ = self.lexical_search(query, candidates_count, filter_conditions)
+        rows, scores = rank_fusion([dense_rows, lexical_rows], n_results)
+        return np.asarray(rows, dtype=np.int64), scores
+
+
+# パスごとに共有するインデックス（Streamlitの再実行ごとに読み込み直さない）
+_shared_indexes = {}
+_shared_lock = threading.Lock()
+
+
+def open_offline_index(path=None):
+    """オフラインインデックスを開く（同じパスは同じインスタンスを返す）"""
+    if path is None:
+        path = os.environ.get("OFFLINE_INDEX_PATH", DEFAULT_OFFLINE_INDEX_PATH)
+    if not path:
+        return OfflineVectorIndex()
+
+    path = os.path.abspath(path)
+    with _shared_lock:
+        index = _shared_indexes.get(path)
+        if index is None:
+            try:
+                index = OfflineVectorIndex(path=path)
+            except Exception as e:
+                logger.error(f"オフラインインデックスを開けないため、メモリ内のみで動作します: {e}")
+                return OfflineVectorIndex()
+            _shared_indexes[path] = index
+            atexit.register(index.flush)
+    return index
@@ -1,4 +1,5 @@
 import os
+import asyncio
 from dotenv import load_dotenv
 import sys
 import tempfile
@@ -6,21 +7,63 @@ import streamlit as st
 import json
 import traceback
 import time
-import uuid
+import itertools
 from datetime import datetime
+import heapq
 import logging
 import requests
-import math
+import numpy as np
 
 # 環境変数のロード
 load_dotenv()
 
 # 必要なライブラリのインポート
 from langchain_openai import OpenAIEmbeddings
+from components.http_transport import get_transport
+from components.async_pinecone_client import AsyncPineconeClient
+from src.offline_vector_index import open_offline_index, HYBRID_CANDIDATE_FACTOR
+from src.bm25_index import rank_fusion
+from src.mmr import maximal_marginal_relevance, DEFAULT_LAMBDA
+from src.text_chunker import TextChunker
+from src.document_manifest import DocumentManifest, document_id, chunk_id, metadata_fingerprint, content_fingerprint
+from src.chunk_store import ChunkStore
+from src.index_stats_cache import IndexStatsCache
+from src.metadata_index import DEFAULT_INDEXED_FIELDS
 
 # 固定のコレクション名
 PINECONE_NAMESPACE = ""  # デフォルトの名前空間を使用
 
+# アップロード1回あたりのベクトル数
+BATCH_SIZE = 50
+
+# 1回の埋め込みAPI呼び出しで処理するチャンク数のデフォルト（環境変数 INGEST_EMBED_BATCH_SIZE で上書き可能）
+DEFAULT_EMBED_BATCH_SIZE = 64
+
+# 同時にアップロードするバッチ数のデフォルト（環境変数 PINECONE_UPSERT_MAX_IN_FLIGHT で上書き可能）
+DEFAULT_UPSERT_MAX_IN_FLIGHT = 4
+
+# 削除リクエスト1回あたりのID数（Pineconeの上限）
+DELETE_BATCH_SIZE = 1000
+
+# 取得（fetch）リクエスト1回あたりのID数（URLの長さとPineconeの上限に収まる数）
+FETCH_BATCH_SIZE = 100
+
+# 検索モード（環境変数 SEARCH_MODE で既定値を変更可能）
+#   dense: ベクトル検索のみ / hybrid: ベクトル検索とBM25（文字バイグラム）の融合
+SEARCH_MODES = ("dense", "hybrid")
+# スパース・デンス検索でのベクトル検索の重み（環境変数 HYBRID_ALPHA で上書き可能）
+DEFAULT_HYBRID_ALPHA = 0.5
+
+# MMRで多様化する場合に取得する候補数（n_resultsに対する倍率、環境変数 MMR_FETCH_FACTOR で上書き可能）
+DEFAULT_MMR_FETCH_FACTOR = 4
+
+# PINECONE_MINIMAL_METADATA=true の場合にPineconeへ登録するメタデータ項目（フィルター用）
+#   本文とその他のメタデータはローカルのチャンクストアに保存し、検索結果に結合する
+MINIMAL_METADATA_FIELDS = ("doc_id",) + DEFAULT_INDEXED_FIELDS
+
+# パーティション（名前空間）の区切り文字。名前空間名は「キー:値」（例: municipality:札幌市）
+PARTITION_SEPARATOR = ":"
+
 # ロガーの設定
 logger = logging.getLogger('app.pinecone_vector_store')
 
@@ -43,6 +86,9 @@ class PineconeVectorStore:
             logger.info(f"環境変数: PINECONE_ENVIRONMENT={st.secrets.get('PINECONE_ENVIRONMENT', os.environ.get('PINECONE_ENVIRONMENT'))}")
             logger.info(f"環境変数: PINECONE_INDEX={self.index_name}")
             
+            # 共有HTTPトランスポート（PineconeClientと同じ接続プールを使用）
+            self.transport = get_transport()
+            
             # Pineconeクライアントが既にセッションにあれば再利用
             if 'pinecone_client' in st.session_state and st.session_state.pinecone_client:
                 self.pinecone_client = st.session_state.pinecone_client
@@ -112,6 +158,14 @@ class PineconeVectorStore:
             logger.info(f"名前空間: {self.namespace if self.namespace else 'デフォルト'}")
             self.pinecone_client.namespace = self.namespace
 
+            # 非同期クライアント（REST APIの検索・取得・削除・統計はこのクライアント上で実行）
+            self.async_client = AsyncPineconeClient(
+                api_key=self.api_key,
+                index_name=self.index_name,
+                base_url=self.base_url,
+                timeout=int(os.environ.get('PINECONE_REQUEST_TIMEOUT', 30))
+            )
+
             # 埋め込みモデルの設定
             try:
                 from components.llm import oai_embeddings
@@ -126,12 +180,63 @@ class PineconeVectorStore:
             self.temporary_failure = getattr(self.pinecone_client, 'temporary_failure', False)
             self.is_streamlit_cloud = getattr(self.pinecone_client, 'is_streamlit_cloud', False)
             
-            # 緊急オフラインモード用のメモリ内ストレージ
-            self.offline_storage = {
-                "vectors": [],
-                "metadata": [],
-                "ids": []
-            }
+            # 緊急オフラインモード用のストレージ（ディスクに永続化し、再起動後もすぐに利用可能）
+            self.offline_index = open_offline_index()
+            
+            # チャンク分割（文・段落の境界で区切り、トークン数でサイズを揃える）
+            self.chunker = TextChunker()
+            
+            # 登録済みドキュメントの台帳（再登録時は新規・変更されたチャンクだけをアップロード）
+            try:
+                self.manifest = DocumentManifest(scope=f"{self.index_name}/{self.namespace}")
+            except Exception as e:
+                logger.error(f"ドキュメント台帳を開けないため、差分登録を無効にします: {e}")
+                self.manifest = None
+            
+            # チャンクの本文・メタデータのローカルストア（検索結果に本文がない場合はここから補う）
+            try:
+                self.chunk_store = ChunkStore()
+                # チャンク本文はチャンクストアにだけ保存し、オフラインインデックスはそこから読み出す
+                self.offline_index.set_text_source(self.chunk_store.get_texts)
+            except Exception as e:
+                logger.error(f"チャンクストアを開けないため、本文はPineconeのメタデータから取得します: {e}")
+                self.chunk_store = None
+            self.minimal_metadata = (
+                os.environ.get('PINECONE_MINIMAL_METADATA', 'false').lower() in ('1', 'true', 'yes', 'on')
+                and self.chunk_store is not None
+            )
+            
+            # ローカルリードレプリカ（有効時はPineconeが利用可能でもローカルインデックスから検索する）
+            self.local_replica = os.environ.get('PINECONE_LOCAL_REPLICA', 'false').lower() in ('1', 'true', 'yes', 'on')
+            
+            # インデックスの次元数（統計の取得時に設定し、アップロード前の検証に使う）
+            self.index_dimension = None
+            
+            # 名前空間によるパーティション分割（PINECONE_PARTITION_KEY=municipality などで有効）
+            #   チャンクはメタデータの値ごとの名前空間に登録し、検索はフィルターで値が決まれば
+            #   その名前空間だけ、決まらなければ全パーティションへ並行に問い合わせて上位を統合する
+            self.partition_key = os.environ.get('PINECONE_PARTITION_KEY', '').strip() or None
+            
+            # インデックス統計のキャッシュ（起動時にバックグラウンドで取得を開始）
+            self.stats_cache = IndexStatsCache(self._fetch_index_stats)
+            self.stats_cache.refresh_async()
+            
+            # ハイブリッド検索の設定
+            #   PINECONE_SPARSE=true でアップロード時にBM25のスパースベクトルも登録し、
+            #   Pinecone上でスパース・デンス検索を行う（dotproductのインデックスが必要）
+            self.search_mode = os.environ.get('SEARCH_MODE', 'dense').lower()
+            if self.search_mode not in SEARCH_MODES:
+                logger.warning(f"不明な検索モードのためdenseを使用します: {self.search_mode}")
+                self.search_mode = "dense"
+            self.sparse_enabled = os.environ.get('PINECONE_SPARSE', 'false').lower() in ('1', 'true', 'yes', 'on')
+            if self.sparse_enabled:
+                self._check_sparse_metric()
+            self.hybrid_alpha = float(os.environ.get('HYBRID_ALPHA', DEFAULT_HYBRID_ALPHA))
+            
+            # 検索結果の多様化（MMR）の設定（SEARCH_MMR=true で既定で有効）
+            self.mmr_enabled = os.environ.get('SEARCH_MMR', 'false').lower() in ('1', 'true', 'yes', 'on')
+            self.mmr_lambda = float(os.environ.get('MMR_LAMBDA', DEFAULT_LAMBDA))
+            self.mmr_fetch_factor = int(os.environ.get('MMR_FETCH_FACTOR', DEFAULT_MMR_FETCH_FACTOR))
             
             logger.info("PineconeVectorStoreの初期化が完了しました")
             
@@ -169,278 +274,452 @@ class PineconeVectorStore:
             logger.error(traceback.format_exc())
             return False
 
+    def _check_sparse_metric(self):
+        """スパースベクトルはdotproductのインデックスでしか扱えないため、距離尺度を確認する
+
+        dotproduct以外のインデックスではスパースベクトルのアップロード・検索がすべて拒否されるため、
+        警告を出してスパース・デンス検索を無効にする（ハイブリッド検索はローカルのBM25で行う）。
+        """
+        metric = self.pinecone_client.index_metric() if hasattr(self.pinecone_client, 'index_metric') else None
+        if metric is None:
+            logger.warning("インデックスの距離尺度を確認できませんでした。PINECONE_SPARSEにはdotproductのインデックスが必要です")
+        elif metric != "dotproduct":
+            logger.warning(
+                f"インデックス '{self.index_name}' の距離尺度が {metric} のため、スパースベクトルを無効にします"
+                "（PINECONE_SPARSEにはdotproductのインデックスが必要です）"
+            )
+            self.sparse_enabled = False
+
     def add_documents(self, documents):
-        """ドキュメントを追加"""
-        return self.upsert_documents(documents)
+        """ドキュメントを追加（成功したかどうかを返す。詳細なレポートはupsert_documentsを使う）"""
+        return self.upsert_documents(documents)["success"]
 
     def update_documents(self, documents):
-        """ドキュメントを更新"""
-        return self.upsert_documents(documents)
+        """ドキュメントを更新（成功したかどうかを返す。詳細なレポートはupsert_documentsを使う）"""
+        return self.upsert_documents(documents)["success"]
+
+    @staticmethod
+    def _normalize_metadata(metadata):
+        """メタデータの検証と正規化"""
+        normalized = {}
+        for key, value in (metadata or {}).items():
+            # 空の文字列はNoneに変換
+            if value == "":
+                value = None
+            # 文字列の場合は前後の空白を削除
+            elif isinstance(value, str):
+                value = value.strip()
+            normalized[key] = value
+        return normalized
+
+    def _iter_chunks(self, text):
+        """テキストを文・段落の境界でチャンクへ分割して逐次返す"""
+        return self.chunker.iter_chunks(text)
 
-    def upsert_documents(self, texts, metadatas=None):
+    def _plan_documents(self, texts, metadatas=None):
+        """ドキュメントごとにIDと台帳に登録済みのチャンクIDを求める（チャンク分割はアップロード時に1回だけ行う）
+
+        チャンクIDは「ドキュメントID + チャンク本文とメタデータのハッシュ」なので、
+        内容が変わらないチャンクは再登録しても同じIDになり、埋め込みとアップロードを省略できる。
+        chunk_ids / new_ids は _iter_new_chunks() がチャンクを分割しながら埋める。
         """
-        ドキュメントをPineconeにアップロードする
+        plans = []
+        seen = set()
+        for i, text in enumerate(texts):
+            # メタデータはドキュメント単位で正規化し、チャンク間で共有する
+            metadata = metadatas[i] if metadatas and i < len(metadatas) else {}
+            normalized = self._normalize_metadata(metadata)
+            doc_id = document_id(text, normalized)
+            if doc_id in seen:
+                logger.warning(f"同じドキュメントが重複しているためスキップします: {doc_id}")
+                continue
+            seen.add(doc_id)
+            
+            metadata_hash = metadata_fingerprint(normalized)
+            plans.append({
+                "index": i,
+                "doc_id": doc_id,
+                "name": normalized.get("file_name") or normalized.get("source"),
+                "fingerprint": content_fingerprint(text, metadata_hash),
+                "metadata": normalized,
+                "metadata_hash": metadata_hash,
+                "namespace": self._partition_namespace(normalized),
+                "known_ids": self.manifest.chunk_ids(doc_id) if self.manifest else set(),
+                "chunk_ids": [],
+                "new_ids": set(),
+                "removed_ids": set(),
+            })
+        return plans
+
+    def _iter_new_chunks(self, texts, plans):
+        """チャンクを分割しながらIDを求め、アップロードが必要なチャンクを (チャンクID, チャンク, メタデータ, 名前空間) として逐次返す
+
+        分割したチャンクのIDは plan["chunk_ids"] に、アップロードするものは plan["new_ids"] に記録する
+        （台帳との差分のうち、なくなったチャンクは全チャンクの分割後に _afinalize_documents() で求める）。
+        """
+        for plan in plans:
+            base = {k: v for k, v in plan["metadata"].items() if v is not None}
+            emitted = set()
+            for chunk_index, chunk in enumerate(self._iter_chunks(texts[plan["index"]])):
+                cid = chunk_id(plan["doc_id"], chunk, plan["metadata_hash"])
+                if cid in emitted:
+                    continue
+                emitted.add(cid)
+                plan["chunk_ids"].append(cid)
+                if cid in plan["known_ids"]:
+                    continue
+                plan["new_ids"].add(cid)
+                yield cid, chunk, {"doc_id": plan["doc_id"], "chunk_index": chunk_index, **base}, plan["namespace"]
+
+    def _prepare_vectors(self, items, embeddings, batch_label=""):
+        """埋め込みからベクトルを作成・検証し、ローカルのインデックスとチャンクストアに保存する
+
+        ファイルやSQLiteへの書き込みを含むため、イベントループのスレッドからは asyncio.to_thread で呼ぶ。
+        戻り値は (有効なベクトル, 不正なベクトルのID)。
         """
+        vectors = self._build_vectors([item[:3] for item in items], embeddings)
+        vectors, invalid_ids = self._validate_vectors(vectors, batch_label)
+        
+        # 一時的なストレージに保存
+        self.offline_index.add(
+            [v["id"] for v in vectors],
+            [v["values"] for v in vectors],
+            [v["metadata"] for v in vectors]
+        )
+        self._store_chunks(vectors)
+        return vectors, invalid_ids
+
+    def _build_vectors(self, items, embeddings):
+        """(チャンクID, チャンク, メタデータ) と埋め込みからアップサート用のベクトルを作成"""
+        vectors = [
+            {"id": cid, "values": embedding, "metadata": {"text": chunk, **metadata}}
+            for (cid, chunk, metadata), embedding in zip(items, embeddings)
+        ]
+        if self.sparse_enabled:
+            # スパース・デンス検索用のBM25スパースベクトル（アップロードはREST APIのため、項目名はREST APIの sparseValues）
+            for vector, (_, chunk, _) in zip(vectors, items):
+                sparse_values = self.offline_index.lexical.encode_document(chunk)
+                if sparse_values:
+                    vector["sparseValues"] = sparse_values
+        return vectors
+
+    def _store_chunks(self, vectors):
+        """本文とメタデータをチャンクストアに保存し、最小メタデータモードではPineconeに送るメタデータを絞る"""
+        if self.chunk_store is None or not vectors:
+            return
         try:
-            # テキストのチャンク分割
-            CHUNK_SIZE = 500  # 文字数制限
-            chunked_texts = []
-            chunked_metadatas = []
-            
-            for i, text in enumerate(texts):
-                # テキストをチャンクに分割
-                chunks = [text[j:j+CHUNK_SIZE] for j in range(0, len(text), CHUNK_SIZE)]
-                chunked_texts.extend(chunks)
-                
-                # メタデータの複製
-                if metadatas and i < len(metadatas):
-                    metadata = metadatas[i]
-                    chunked_metadatas.extend([metadata.copy() for _ in chunks])
-                else:
-                    chunked_metadatas.extend([{} for _ in chunks])
-            
-            # 埋め込みベクトルの生成
-            logger.info(f"{len(chunked_texts)}件のドキュメントチャンクの埋め込みベクトルを生成中...")
-            embeddings = self.embeddings.embed_documents(chunked_texts)
-            
-            # ベクトルIDの生成
-            ids = [f"doc_{i}_{uuid.uuid4()}" for i in range(len(chunked_texts))]
-            
-            # メタデータの準備と検証
-            if chunked_metadatas is None:
-                chunked_metadatas = [{} for _ in chunked_texts]
-            
-            # メタデータの検証と正規化
-            normalized_metadatas = []
-            for metadata in chunked_metadatas:
-                normalized = {}
-                for key, value in metadata.items():
-                    # 空の文字列はNoneに変換
-                    if value == "":
-                        value = None
-                    # 文字列の場合は前後の空白を削除
-                    elif isinstance(value, str):
-                        value = value.strip()
-                    normalized[key] = value
-                normalized_metadatas.append(normalized)
-            
-            # ベクトルデータの準備
-            vectors = []
-            for i, (text, embedding, metadata) in enumerate(zip(chunked_texts, embeddings, normalized_metadatas)):
-                vector = {
-                    "id": ids[i],
-                    "values": embedding,
-                    "metadata": {
-                        "text": text,
-                        "chunk_index": i,
-                        "total_chunks": len(chunked_texts),
-                        **{k: v for k, v in metadata.items() if v is not None}
-                    }
-                }
-                vectors.append(vector)
-            
-            # デバッグ情報の出力
-            logger.info("=== デバッグ情報 ===")
-            logger.info(f"インデックス名: {self.index_name}")
-            logger.info(f"名前空間: {self.namespace if self.namespace else 'デフォルト'}")
-            logger.info(f"ベクトル数: {len(vectors)}")
-            logger.info(f"埋め込み次元数: {len(embeddings[0])}")
-            
-            # インデックスの状態確認
-            try:
-                if hasattr(self.pinecone_client, 'index'):
-                    stats = self.pinecone_client.index.describe_index_stats()
-                    logger.info("インデックス統計:")
-                    logger.info(f"- 総ベクトル数: {stats.total_vector_count}")
-                    logger.info(f"- 名前空間数: {len(stats.namespaces)}")
-                    if self.namespace in stats.namespaces:
-                        logger.info(f"- 現在の名前空間のベクトル数: {stats.namespaces[self.namespace].vector_count}")
-                else:
-                    # REST APIで統計を取得
-                    api_url = f"https://api.pinecone.io/describe_index_stats/{self.index_name}"
-                    response = self.pinecone_client._make_request(method="GET", url=api_url)
-                    if response and response.status_code == 200:
-                        stats = response.json()
-                        logger.info("インデックス統計 (REST):")
-                        logger.info(f"- 総ベクトル数: {stats.get('total_vector_count', 'N/A')}")
-                        logger.info(f"- 名前空間数: {len(stats.get('namespaces', {}))}")
-                        if self.namespace in stats.get('namespaces', {}):
-                            logger.info(f"- 現在の名前空間のベクトル数: {stats['namespaces'][self.namespace].get('vector_count', 'N/A')}")
-            except Exception as e:
-                logger.error(f"インデックス統計の取得中にエラー: {e}")
-            
-            # リクエストデータの検証
+            self.chunk_store.put_many(
+                (v["id"], v["metadata"].get("text", ""), {k: val for k, val in v["metadata"].items() if k != "text"})
+                for v in vectors
+            )
+        except Exception as e:
+            logger.error(f"チャンクストアへの保存中にエラー: {e}")
+            return
+        if self.minimal_metadata:
+            for vector in vectors:
+                vector["metadata"] = {k: vector["metadata"][k] for k in MINIMAL_METADATA_FIELDS if k in vector["metadata"]}
+
+    def _join_chunks(self, ids, documents, metadatas):
+        """本文がない結果（最小メタデータで登録したチャンク）にチャンクストアの本文とメタデータを結合"""
+        if self.chunk_store is None:
+            return
+        missing = [id_ for id_, document in zip(ids, documents) if not document]
+        if not missing:
+            return
+        try:
+            stored = self.chunk_store.get_many(missing)
+        except Exception as e:
+            logger.error(f"チャンクストアの読み込み中にエラー: {e}")
+            return
+        for i, id_ in enumerate(ids):
+            if not documents[i] and id_ in stored:
+                text, metadata = stored[id_]
+                documents[i] = text
+                metadatas[i] = {**metadata, **metadatas[i]}
+
+    def _fetch_index_stats(self):
+        """インデックス統計を取得（IndexStatsCacheから呼ばれる。イベントループのスレッドからは呼ばないこと）"""
+        if hasattr(self.pinecone_client, 'index'):
+            stats = self.pinecone_client.index.describe_index_stats()
+            if not stats:
+                return None
+            result = {
+                "total_vector_count": stats.total_vector_count,
+                "dimension": getattr(stats, 'dimension', None),
+                "namespaces": {name: ns.vector_count for name, ns in stats.namespaces.items()},
+            }
+        else:
+            # REST APIで統計を取得（非同期クライアント上で実行）
+            data = self.async_client.run_sync(self.async_client.describe_index_stats())
+            if not data:
+                return None
+            result = {
+                "total_vector_count": data.get("total_vector_count", data.get("totalVectorCount", 0)),
+                "dimension": data.get("dimension"),
+                "namespaces": {
+                    name: ns.get("vector_count", ns.get("vectorCount", 0))
+                    for name, ns in (data.get("namespaces") or {}).items()
+                },
+            }
+        self.index_dimension = result["dimension"] or self.index_dimension
+        return result
+
+    def _log_index_stats(self):
+        """キャッシュ済みのインデックス統計をログに出力（Pineconeには問い合わせない）"""
+        stats = self.stats_cache.get(wait=False)
+        if stats is None:
+            logger.info("インデックス統計: 取得中")
+            return
+        logger.info("インデックス統計:")
+        logger.info(f"- 総ベクトル数: {stats['total_vector_count']}")
+        logger.info(f"- 名前空間数: {len(stats['namespaces'])}")
+        if self.namespace in stats['namespaces']:
+            logger.info(f"- 現在の名前空間のベクトル数: {stats['namespaces'][self.namespace]}")
+
+    def _validate_vectors(self, vectors, batch_label=""):
+        """埋め込みブロックをまとめて検証し、(有効なベクトル, 不正なベクトルのID) を返す
+
+        数値・有限値・次元数のチェックはブロック全体へのNumPy演算1回で行い、
+        ログはバッチごとの要約のみ（ベクトルごとの詳細はDEBUGレベル）。
+        """
+        if not vectors:
+            return vectors, []
+        expected_dim = self.index_dimension
+        
+        try:
+            block = np.asarray([v["values"] for v in vectors], dtype=np.float32)
+            if block.ndim != 2:
+                raise ValueError(f"ベクトルの形状が不正です: {block.shape}")
+            if expected_dim and block.shape[1] != expected_dim:
+                valid = np.zeros(len(vectors), dtype=bool)
+            else:
+                valid = np.isfinite(block).all(axis=1)
+            dims = np.full(len(vectors), block.shape[1])
+        except (TypeError, ValueError):
+            # 次元数が揃っていない・数値以外を含む場合だけ行ごとに確認する
+            valid = np.zeros(len(vectors), dtype=bool)
+            dims = np.zeros(len(vectors), dtype=np.int64)
             for i, vector in enumerate(vectors):
-                logger.info(f"\nベクトル {i+1} の検証:")
-                logger.info(f"- ID: {vector['id']}")
-                logger.info(f"- ベクトル次元数: {len(vector['values'])}")
-                logger.info(f"- メタデータキー: {list(vector['metadata'].keys())}")
-                logger.info(f"- テキスト長: {len(vector['metadata'].get('text', ''))}")
-                
-                # ベクトル値の検証
-                if any(not isinstance(v, (int, float)) for v in vector['values']):
-                    logger.error(f"ベクトル {i+1} に不正な値が含まれています")
-                if any(math.isnan(v) or math.isinf(v) for v in vector['values']):
-                    logger.error(f"ベクトル {i+1} にNaNまたはInf値が含まれています")
-            
-            # バッチサイズの設定
-            BATCH_SIZE = 50  # バッチサイズを小さくする
-            total_batches = (len(vectors) + BATCH_SIZE - 1) // BATCH_SIZE
-            
-            # 一時的なストレージに保存
-            self.offline_storage["vectors"].extend(vectors)
-            self.offline_storage["metadata"].extend([v["metadata"] for v in vectors])
-            self.offline_storage["ids"].extend([v["id"] for v in vectors])
-            
-            # バッチ処理
-            for batch_idx in range(total_batches):
-                start_idx = batch_idx * BATCH_SIZE
-                end_idx = min((batch_idx + 1) * BATCH_SIZE, len(vectors))
-                current_batch = vectors[start_idx:end_idx]
-                
-                # バッチ情報の出力
-                logger.info(f"\nバッチ {batch_idx+1}/{total_batches} の情報:")
-                logger.info(f"- ベクトル数: {len(current_batch)}")
-                logger.info(f"- 開始インデックス: {start_idx}")
-                logger.info(f"- 終了インデックス: {end_idx}")
-                
-                # リトライロジックの改善
-                max_retries = 5
-                base_delay = 2
-                last_error = None
-                
-                for attempt in range(max_retries):
-                    try:
-                        logger.info(f"REST APIを使用してベクトルをアップロード中... (バッチ {batch_idx+1}/{total_batches}, 試行 {attempt+1}/{max_retries})")
-                        
-                        # リクエストヘッダーの設定
-                        headers = {
-                            "Api-Key": self.api_key,
-                            "Accept": "application/json",
-                            "Content-Type": "application/json"
-                        }
-                        
-                        # リクエストデータの準備（名前空間は空文字列の場合は省略）
-                        data = {
-                            "vectors": current_batch
-                        }
-                        if self.namespace:  # 名前空間が指定されている場合のみ追加
-                            data["namespace"] = self.namespace
-                        
-                        # リクエストデータの検証
-                        logger.info(f"リクエストデータサイズ: {len(json.dumps(data))} bytes")
-                        if len(json.dumps(data)) > 1000000:  # 1MB以上の場合は警告
-                            logger.warning("リクエストデータが大きすぎる可能性があります")
-                        
-                        # リクエストの送信
-                        response = requests.post(
-                            f"{self.base_url}/vectors/upsert/{self.index_name}",
-                            headers=headers,
-                            json=data,
-                            timeout=30 * (attempt + 1)  # タイムアウトを徐々に増加
-                        )
-                        
-                        # レスポンスの検証
-                        if response.status_code == 200:
-                            logger.info(f"バッチ {batch_idx+1}/{total_batches} のアップロードに成功")
-                            break
-                        elif response.status_code == 429:  # Rate Limit
-                            delay = int(response.headers.get('Retry-After', base_delay * (2 ** attempt)))
-                            logger.warning(f"レート制限に達しました。{delay}秒後に再試行します...")
-                            time.sleep(delay)
-                        elif response.status_code == 500:  # Internal Server Error
-                            delay = base_delay * (2 ** attempt)  # 指数バックオフ
-                            logger.warning(f"サーバーエラー (500): {delay}秒後に再試行します...")
-                            logger.warning(f"エラーレスポンス: {response.text}")
-                            # エラーの詳細を記録
-                            try:
-                                error_data = response.json()
-                                logger.error(f"エラーの詳細: {json.dumps(error_data, indent=2)}")
-                            except:
-                                logger.error(f"エラーレスポンスの解析に失敗: {response.text}")
-                            time.sleep(delay)
-                            
-                            # 500エラーが3回連続で発生した場合、一時的なストレージモードに切り替え
-                            if attempt >= 2:
-                                logger.warning("500エラーが3回連続で発生したため、一時的なストレージモードに切り替えます")
-                                self.temporary_failure = True
-                                return True  # 一時的なストレージに保存済みなので成功とみなす
-                        else:
-                            error_msg = f"予期せぬエラー: {response.status_code}"
-                            logger.error(error_msg)
-                            logger.error(f"エラーレスポンス: {response.text}")
-                            raise Exception(error_msg)
-                            
-                    except requests.exceptions.Timeout:
-                        delay = base_delay * (2 ** attempt)
-                        logger.warning(f"タイムアウト: {delay}秒後に再試行します...")
-                        time.sleep(delay)
-                    except requests.exceptions.RequestException as e:
-                        delay = base_delay * (2 ** attempt)
-                        logger.warning(f"リクエストエラー: {delay}秒後に再試行します...")
-                        logger.warning(f"エラー: {str(e)}")
-                        time.sleep(delay)
-                    except Exception as e:
-                        logger.error(f"予期せぬエラー: {str(e)}")
-                        logger.error(traceback.format_exc())
-                        raise
-                    
-                    # 最後の試行で失敗した場合
-                    if attempt == max_retries - 1:
-                        error_msg = f"バッチ {batch_idx+1}/{total_batches} のアップロードに失敗しました"
-                        logger.error(error_msg)
-                        if last_error:
-                            logger.error(f"最後のエラー: {str(last_error)}")
-                        raise Exception(error_msg)
-            
-            return True
-            
+                try:
+                    row = np.asarray(vector["values"], dtype=np.float32)
+                except (TypeError, ValueError):
+                    continue
+                dims[i] = row.size if row.ndim == 1 else 0
+                valid[i] = row.ndim == 1 and np.isfinite(row).all()
+            expected_dim = expected_dim or int(np.bincount(dims).argmax())
+            valid &= dims == expected_dim
+        
+        text_lengths = np.fromiter((len(v["metadata"].get("text", "")) for v in vectors), dtype=np.int64, count=len(vectors))
+        invalid_ids = [v["id"] for v, ok in zip(vectors, valid) if not ok]
+        logger.info(
+            f"ベクトル検証{batch_label}: {len(vectors)}件 (次元数: {int(dims.max())}, 不正: {len(invalid_ids)}件, "
+            f"テキスト長: 平均{text_lengths.mean():.0f} / 最大{text_lengths.max()})"
+        )
+        if invalid_ids:
+            logger.error(f"不正な値（数値以外・NaN・Inf・次元数の不一致）を含む{len(invalid_ids)}件のベクトルを除外します: {invalid_ids[:5]}")
+        if logger.isEnabledFor(logging.DEBUG):
+            for vector, dim, ok in zip(vectors, dims, valid):
+                logger.debug(
+                    f"- ID: {vector['id']}, 次元数: {dim}, メタデータキー: {list(vector['metadata'].keys())}, "
+                    f"テキスト長: {len(vector['metadata'].get('text', ''))}, 検証: {'OK' if ok else 'NG'}"
+                )
+        
+        if not invalid_ids:
+            return vectors, []
+        return [v for v, ok in zip(vectors, valid) if ok], invalid_ids
+
+    def upsert_documents(self, texts, metadatas=None, max_in_flight=None, embed_batch_size=None):
+        """
+        ドキュメントをPineconeにアップロードする
+        
+        チャンク分割・埋め込み生成・アップロードはパイプラインとして並行に実行される（aupsert_documentsを参照）。
+        戻り値はバッチごとの結果を含むレポート（dict）。report["success"]で成否を判定する。
+        """
+        try:
+            return self.async_client.run_sync(
+                self.aupsert_documents(texts, metadatas, max_in_flight=max_in_flight, embed_batch_size=embed_batch_size)
+            )
         except Exception as e:
             logger.error(f"ドキュメントのアップロード中にエラーが発生しました: {str(e)}")
             logger.error(traceback.format_exc())
-            return False
+            return self._new_upsert_report(error=str(e))
+
+    @staticmethod
+    def _new_upsert_report(total_vectors=0, error=None):
+        """アップサート結果のレポートを作成"""
+        return {
+            "success": error is None,
+            "total_vectors": total_vectors,
+            "upserted_count": 0,
+            "failed_ids": [],
+            "temporary_failure": False,
+            "error": error,
+            "skipped_count": 0,
+            "deleted_count": 0,
+            "batches": []
+        }
+
+    async def _aupsert_batch(self, batch, max_retries, namespace=None):
+        """1バッチをアップロードし、クライアントエラーの場合は分割して失敗したベクトルだけを特定する"""
+        namespace = self.namespace if namespace is None else namespace
+        result = await self.async_client.upsert_batch(batch, namespace=namespace, max_retries=max_retries)
+        if result["ok"]:
+            return result["upserted_count"], [], result, 1
+        
+        # 4xx（レート制限以外）はベクトル自体の問題の可能性があるため、二分して正常なベクトルを救済する
+        status_code = result["status_code"]
+        if len(batch) > 1 and status_code is not None and 400 <= status_code < 500 and status_code != 429:
+            mid = len(batch) // 2
+            left, right = await asyncio.gather(
+                self._aupsert_batch(batch[:mid], max_retries, namespace),
+                self._aupsert_batch(batch[mid:], max_retries, namespace)
+            )
+            return left[0] + right[0], left[1] + right[1], result, left[3] + right[3] + 1
+        
+        return 0, batch, result, 1
+
+    async def _aupsert_stream(self, batch_queue, report, max_in_flight):
+        """キューから (バッチ番号, 開始位置, バッチ, 名前空間) を受け取り、max_in_flight個のワーカーで並行アップロードする
+
+        キューの終端は None で示す。失敗したベクトルだけを最後にまとめて再試行し、
+        バッチ番号順に並べた結果を report に書き込む。
+        """
+        max_retries = 5
+        outcomes = []
+        
+        async def _worker():
+            while True:
+                item = await batch_queue.get()
+                if item is None:
+                    # 他のワーカーにも終端を伝える
+                    await batch_queue.put(None)
+                    return
+                batch_idx, start, batch, namespace = item
+                started = time.time()
+                upserted, failed, last_result, attempts = await self._aupsert_batch(batch, max_retries, namespace)
+                entry = {
+                    "batch_index": batch_idx,
+                    "namespace": namespace,
+                    "start": start,
+                    "end": start + len(batch),
+                    "vector_count": len(batch),
+                    "upserted_count": upserted,
+                    "failed_ids": [v["id"] for v in failed],
+                    "requests": attempts,
+                    "status": "success" if not failed else ("partial" if upserted else "failed"),
+                    "status_code": last_result["status_code"],
+                    "error": None if not failed else last_result["error"],
+                    "duration": time.time() - started
+                }
+                if failed:
+                    logger.warning(f"バッチ {batch_idx+1}: {len(failed)}件のアップロードに失敗 ({last_result['status_code']})")
+                else:
+                    logger.info(f"バッチ {batch_idx+1} のアップロードに成功 ({len(batch)}件)")
+                outcomes.append((entry, failed))
+        
+        await asyncio.gather(*[_worker() for _ in range(max_in_flight)])
+        outcomes.sort(key=lambda outcome: outcome[0]["batch_index"])
+        
+        # 一時的なエラーで失敗したベクトルだけを再試行
+        entries = [entry for entry, _ in outcomes]
+        retry_vectors = {}
+        for entry, failed in outcomes:
+            if failed and (entry["status_code"] is None or entry["status_code"] >= 500 or entry["status_code"] == 429):
+                retry_vectors.setdefault(entry["namespace"], []).extend(failed)
+        if retry_vectors:
+            logger.info(f"失敗した{sum(len(v) for v in retry_vectors.values())}件のベクトルを再試行します")
+            retry_batches = [
+                (namespace, vectors[i:i + BATCH_SIZE])
+                for namespace, vectors in retry_vectors.items()
+                for i in range(0, len(vectors), BATCH_SIZE)
+            ]
+            retry_outcomes = await self.async_client.gather_limited(
+                [self._aupsert_batch(batch, max_retries, namespace) for namespace, batch in retry_batches],
+                limit=max_in_flight
+            )
+            recovered = {v["id"] for _, batch in retry_batches for v in batch}
+            for _, failed, _, _ in retry_outcomes:
+                recovered -= {v["id"] for v in failed}
+            for entry in entries:
+                if not entry["failed_ids"]:
+                    continue
+                retried = [vid for vid in entry["failed_ids"] if vid in recovered]
+                if retried:
+                    entry["failed_ids"] = [vid for vid in entry["failed_ids"] if vid not in recovered]
+                    entry["upserted_count"] += len(retried)
+                    entry["retried_count"] = len(retried)
+                    entry["status"] = "success" if not entry["failed_ids"] else "partial"
+                    if not entry["failed_ids"]:
+                        entry["error"] = None
+        
+        report["batches"] = entries
+        report["upserted_count"] = sum(entry["upserted_count"] for entry in entries)
+        report["failed_ids"] = [vid for entry in entries for vid in entry["failed_ids"]]
+        
+        if report["failed_ids"]:
+            server_errors = [entry for entry in entries if entry["failed_ids"] and (entry["status_code"] or 0) >= 500]
+            if server_errors:
+                # サーバーエラーが続く場合は一時的なストレージモードに切り替え（一時的なストレージに保存済み）
+                logger.warning("サーバーエラーが続いたため、一時的なストレージモードに切り替えます")
+                self.temporary_failure = True
+                report["temporary_failure"] = True
+            report["success"] = report["temporary_failure"]
+            logger.error(f"{len(report['failed_ids'])}/{report['total_vectors']}件のベクトルのアップロードに失敗しました")
+        else:
+            logger.info(f"{len(entries)}バッチ ({report['upserted_count']}件) のアップロードに成功")
+        
+        return report
+
+    async def _aupsert_vectors(self, vectors, max_in_flight=None):
+        """作成済みのベクトルをバッチに分割し、同時実行数を制限して並行アップロードする"""
+        max_in_flight = max_in_flight or int(os.environ.get("PINECONE_UPSERT_MAX_IN_FLIGHT", DEFAULT_UPSERT_MAX_IN_FLIGHT))
+        report = self._new_upsert_report(total_vectors=len(vectors))
+        
+        batch_queue = asyncio.Queue()
+        for batch_idx, start in enumerate(range(0, len(vectors), BATCH_SIZE)):
+            batch_queue.put_nowait((batch_idx, start, vectors[start:start + BATCH_SIZE], self.namespace))
+        batch_queue.put_nowait(None)
+        
+        return await self._aupsert_stream(batch_queue, report, max_in_flight)
 
     def delete_documents(self, ids):
-        """ドキュメントを削除"""
+        """ドキュメントを削除（非同期クライアント上で実行。公式SDKがあればSDKで削除する）"""
         if not self.available or not ids:
             return False
             
         try:
-            # 公式SDKがある場合はSDKを使用
-            if hasattr(self.pinecone_client, 'index'):
-                self.pinecone_client.index.delete(
-                    ids=ids,
-                    namespace=self.namespace
-                )
-                logger.info(f"{len(ids)}件のドキュメントを削除しました")
-                return True
-                
-            # REST APIで削除
-            api_url = f"https://api.pinecone.io/vectors/delete/{self.pinecone_client.index_name}"
-            data = {
-                "ids": ids,
-                "namespace": self.namespace
-            }
-            
-            response = self.pinecone_client._make_request(
-                method="POST",
-                url=api_url,
-                json_data=data
-            )
-            
-            if response and response.status_code in [200, 201, 202]:
-                logger.info(f"{len(ids)}件のドキュメントを削除しました")
-                return True
-            else:
-                logger.error(f"ドキュメント削除エラー: {getattr(response, 'status_code', 'N/A')} - {getattr(response, 'text', 'No response')}")
-                return False
+            return self.async_client.run_sync(self.adelete_documents(ids))
+        except Exception as e:
+            logger.error(f"ドキュメント削除中のエラー: {e}")
+            logger.error(traceback.format_exc())
+            return False
+
+    def list_documents(self, offset=0, limit=50, municipality=None, category=None):
+        """登録済みドキュメント（ファイル単位）の一覧を台帳から取得（Pineconeには問い合わせない）"""
+        if self.manifest is None:
+            return []
+        return self.manifest.list_documents(offset, limit, municipality=municipality, category=category)
+
+    def count_documents(self, municipality=None, category=None):
+        """登録済みドキュメント（ファイル単位）の数を台帳から取得"""
+        if self.manifest is None:
+            return 0
+        return self.manifest.count_documents(municipality=municipality, category=category)
+
+    def delete_document(self, doc_id):
+        """ドキュメント（登録したファイル）の全チャンクをバッチに分けて並行に削除"""
+        try:
+            return self.async_client.run_sync(self.adelete_document(doc_id))
         except Exception as e:
             logger.error(f"ドキュメント削除中のエラー: {e}")
             logger.error(traceback.format_exc())
             return False
 
     def get_documents(self, ids=None):
-        """ドキュメントを取得"""
+        """ドキュメントを取得
+
+        IDはFETCH_BATCH_SIZE件ずつのページに分けて並行に取得する（aget_documentsを参照）。
+        """
         if not self.available:
             return {"ids": [], "documents": [], "metadatas": []}
             
@@ -450,126 +729,242 @@ class PineconeVectorStore:
                 logger.info("Pineconeでは全てのドキュメントを一度に取得することはできません")
                 return {"ids": [], "documents": [], "metadatas": []}
             
-            # IDsが指定されている場合は、それらを取得
-            # 公式SDKがある場合はSDKを使用
-            results = {"ids": [], "documents": [], "metadatas": []}
-            
-            if hasattr(self.pinecone_client, 'index'):
-                fetch_response = self.pinecone_client.index.fetch(
-                    ids=ids,
-                    namespace=self.namespace
-                )
-                
-                if fetch_response and fetch_response.vectors:
-                    for id_, vector in fetch_response.vectors.items():
-                        results["ids"].append(id_)
-                        results["documents"].append(vector.metadata.get("text", ""))
-                        results["metadatas"].append({k: v for k, v in vector.metadata.items() if k != "text"})
-                
-                return results
-                
-            # REST APIで取得
-            api_url = f"https://api.pinecone.io/vectors/fetch/{self.pinecone_client.index_name}"
-            params = {
-                "ids": ids,
-                "namespace": self.namespace
-            }
-            
-            response = self.pinecone_client._make_request(
-                method="GET",
-                url=api_url,
-                params=params
-            )
-            
-            if response and response.status_code == 200:
-                try:
-                    data = response.json()
-                    if "vectors" in data:
-                        for id_, vector in data["vectors"].items():
-                            results["ids"].append(id_)
-                            results["documents"].append(vector.get("metadata", {}).get("text", ""))
-                            
-                            # テキスト以外のメタデータを取得
-                            metadata = {k: v for k, v in vector.get("metadata", {}).items() if k != "text"}
-                            results["metadatas"].append(metadata)
-                
-                    return results
-                except Exception as e:
-                    logger.error(f"レスポンスのJSON解析エラー: {e}")
-            
-            return results
+            return self.async_client.run_sync(self.aget_documents(ids))
         except Exception as e:
             logger.error(f"ドキュメント取得中のエラー: {e}")
             logger.error(traceback.format_exc())
             return {"ids": [], "documents": [], "metadatas": []}
 
-    def search(self, query, n_results=5, filter_conditions=None):
-        """クエリに基づいてドキュメントを検索"""
-        # 緊急モード検出
+    def iter_documents(self, ids, page_size=FETCH_BATCH_SIZE):
+        """ドキュメントを (ID, 本文, メタデータ) として取得できたページから逐次返す（順序はIDの順と限らない）"""
+        if not self.available or not ids:
+            return
+        agen = self.aiter_documents(ids, page_size)
+        try:
+            while True:
+                try:
+                    yield self.async_client.run_sync(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.async_client.run_sync(agen.aclose())
+
+    @staticmethod
+    def _empty_query_results():
+        """空の検索結果（ChromaDB形式）"""
+        return {"ids": [[]], "documents": [[]], "distances": [[]], "metadatas": [[]]}
+
+    def _results_from_matches(self, matches, include_values=False):
+        """検索結果のマッチ（REST APIのdict・SDKのオブジェクト）をChromaDB形式の結果に変換
+
+        include_values=True の場合は "embeddings" にベクトルも含める。
+        """
+        results = self._empty_query_results()
+        if include_values:
+            results["embeddings"] = [[]]
+        for match in matches or []:
+            if isinstance(match, dict):
+                id_, score, metadata = match.get("id", ""), match.get("score", 0), match.get("metadata") or {}
+                values = match.get("values")
+            else:
+                id_, score, metadata = match.id, match.score, match.metadata or {}
+                values = getattr(match, "values", None)
+            if include_values:
+                results["embeddings"][0].append(values or None)
+            results["ids"][0].append(id_)
+            results["documents"][0].append(metadata.get("text", ""))
+            results["distances"][0].append(1.0 - score)  # cosine類似度を距離に変換
+            
+            # テキスト以外のメタデータを取得
+            results["metadatas"][0].append({k: v for k, v in metadata.items() if k != "text"})
+        self._join_chunks(results["ids"][0], results["documents"][0], results["metadatas"][0])
+        return results
+
+    @staticmethod
+    def _merge_query_results(results_list):
+        """1クエリずつの検索結果を、クエリごとに1行のChromaDB形式の結果にまとめる"""
+        return {
+            key: [results[key][0] for results in results_list]
+            for key in ("ids", "documents", "distances", "metadatas")
+        }
+
+    @staticmethod
+    def _build_filter(filter_conditions):
+        """フィルター条件をPineconeのフィルター形式に変換"""
+        filter_dict = {}
+        if filter_conditions:
+            for key, value in filter_conditions.items():
+                if key and value:
+                    filter_dict[key] = {"$eq": value}
+        return filter_dict
+
+    def _partition_namespace(self, metadata):
+        """メタデータからチャンクを登録する名前空間を決める（パーティションの値がなければ既定の名前空間）"""
+        if not self.partition_key:
+            return self.namespace
+        value = (metadata or {}).get(self.partition_key)
+        if value is None or value == "":
+            return self.namespace
+        return f"{self.partition_key}{PARTITION_SEPARATOR}{value}"
+
+    def _partition_namespaces(self):
+        """既定の名前空間と、インデックス上に存在するパーティションの名前空間（統計のキャッシュから取得）
+
+        統計を取得できない場合は台帳に記録された名前空間を使う（どちらもなければ警告を出す）。
+        統計が未取得の場合は取得を待つため、イベントループのスレッドからは呼ばないこと。
+        """
+        if not self.partition_key:
+            return [self.namespace]
+        prefix = f"{self.partition_key}{PARTITION_SEPARATOR}"
+        counts = self.stats_cache.namespace_counts()
+        partitions = {name for name, count in counts.items() if name.startswith(prefix) and count}
+        if not counts:
+            # 統計を取得できない場合は、台帳に記録したチャンクの登録先の名前空間で代替する
+            recorded = self.manifest.namespaces() if self.manifest else []
+            partitions.update(name for name in recorded if name.startswith(prefix))
+            if partitions:
+                logger.warning(f"インデックスの統計を取得できないため、台帳に記録された{len(partitions)}個のパーティションを検索します")
+            else:
+                logger.warning("インデックスの統計を取得できず台帳にも記録がないため、既定の名前空間だけを検索します（パーティションの結果は含まれません）")
+        return [self.namespace] + sorted(partitions - {self.namespace})
+
+    def _namespaces_for_ids(self, ids):
+        """チャンクIDを名前空間ごとに分ける（台帳に記録した登録先の名前空間で判定）
+
+        登録先が記録されていないチャンク（名前空間の記録を始める前の台帳）は、既定の名前空間と
+        ドキュメントのメタデータから決まる名前空間の両方に振り分ける（同じIDが複数の組に入る）。
+        """
+        if not self.partition_key or self.manifest is None:
+            return {self.namespace: list(ids)}
+        recorded = self.manifest.chunk_namespaces(ids)
+        groups = {}
+        guessed = {}
+        for id_ in ids:
+            if id_ in recorded:
+                candidates = [recorded[id_]]
+            else:
+                doc_id = id_.split("#", 1)[0]
+                if doc_id not in guessed:
+                    document = self.manifest.get_document(doc_id)
+                    guessed[doc_id] = self._partition_namespace(document["metadata"] if document else None)
+                candidates = list(dict.fromkeys([self.namespace, guessed[doc_id]]))
+            for namespace in candidates:
+                groups.setdefault(namespace, []).append(id_)
+        return groups
+
+    def _apply_deleted(self, groups, count):
+        """削除した件数を統計のキャッシュに反映（登録先が不明なIDを含む場合は件数が分からないため再取得させる）"""
+        if sum(len(group) for group in groups.values()) > count:
+            self.stats_cache.invalidate()
+            return
+        for namespace, group in groups.items():
+            self.stats_cache.apply_delta(namespace, -len(group))
+
+    def _apply_mmr(self, results, query_embedding, n_results):
+        """多めに取得した1クエリ分の結果からMMRで多様な上位n_results件を選ぶ
+
+        ベクトルは結果の "embeddings" を使い、ない場合はローカルインデックスから補う。
+        ベクトルが得られない候補は選択後の空きを元の順位で埋めるのに使う。
+        """
+        ids = results["ids"][0]
+        embeddings = results.get("embeddings", [[]])[0] or [None] * len(ids)
+        positions = []
+        vectors = []
+        for position, (id_, values) in enumerate(zip(ids, embeddings)):
+            if values is None:
+                row = self.offline_index.row_of(id_)
+                if row is None:
+                    continue
+                values = self.offline_index.get_vectors([row])[0]
+            positions.append(position)
+            vectors.append(values)
+        
+        order = []
+        if vectors:
+            order = [positions[i] for i in maximal_marginal_relevance(query_embedding, vectors, n_results, self.mmr_lambda)]
+        chosen = set(order)
+        order.extend(p for p in range(len(ids)) if p not in chosen)
+        order = order[:n_results]
+        return {key: [[results[key][0][p] for p in order]] for key in ("ids", "documents", "distances", "metadatas")}
+
+    def _offline_retrieve(self, query, query_embedding, n_results, filter_conditions, mode, mmr=False):
+        """ローカルインデックスを検索（mmr指定時は多めに取得してMMRで多様化）"""
+        if not mmr:
+            return self._offline_search(query_embedding, n_results, filter_conditions, query=query, mode=mode)
+        results = self._offline_search(
+            query_embedding, n_results * self.mmr_fetch_factor, filter_conditions,
+            query=query, mode=mode, include_values=True
+        )
+        return self._apply_mmr(results, query_embedding, n_results)
+
+    def _offline_search(self, query_embedding, n_results=5, filter_conditions=None, query=None, mode="dense",
+                        include_values=False):
+        """緊急オフラインモード: ローカルインデックスを検索（件数が多い場合はHNSWで近似検索）
+
+        mode="hybrid" の場合はBM25検索と順位を融合し、距離は 1 - 融合スコア とする。
+        """
+        if mode == "hybrid" and query:
+            rows, scores = self.offline_index.hybrid_search(query, query_embedding, n_results, filter_conditions)
+        else:
+            rows, scores = self.offline_index.search(query_embedding, n_results, filter_conditions)
+        
+        # 結果を構築
+        metadatas = [self.offline_index.get_metadata(i) for i in rows]
+        results = {
+            "ids": [[self.offline_index.ids[i] for i in rows]],
+            "documents": [[metadata.get("text", "") for metadata in metadatas]],
+            "distances": [[1.0 - float(score) for score in scores]],
+            "metadatas": [[{k: v for k, v in metadata.items() if k != "text"} for metadata in metadatas]]
+        }
+        if include_values:
+            results["embeddings"] = [list(self.offline_index.get_vectors(rows)) if len(rows) else []]
+        
+        logger.info(f"緊急モード: {len(rows)}件の結果をローカルインデックスから検索しました")
+        return results
+
+    def _is_emergency_mode(self):
+        """ローカルインデックスで検索すべきかどうか（緊急オフラインモードまたはローカルリードレプリカ）"""
         emergency_mode = self.is_streamlit_cloud and self.temporary_failure
-        if emergency_mode and len(self.offline_storage["vectors"]) > 0:
-            logger.info("緊急オフラインモード: メモリ内ストレージを検索します")
+        return (emergency_mode or self.local_replica) and len(self.offline_index) > 0
+
+    def search(self, query, n_results=5, filter_conditions=None, mode=None, mmr=None):
+        """クエリに基づいてドキュメントを検索
+
+        mode には "dense"（ベクトル検索）か "hybrid"（ベクトル検索 + BM25）を指定できる（省略時は SEARCH_MODE）。
+        mmr=True の場合は多めに取得した候補からMMRで内容の重複が少ない上位n_results件を選ぶ（省略時は SEARCH_MMR）。
+        """
+        mode = mode or self.search_mode
+        mmr = self.mmr_enabled if mmr is None else mmr
+        if mode == "hybrid" or mmr or self.partition_key:
+            try:
+                return self.async_client.run_sync(self.asearch(query, n_results, filter_conditions, mode=mode, mmr=mmr))
+            except Exception as e:
+                logger.error(f"検索中にエラーが発生しました: {e}")
+                logger.error(traceback.format_exc())
+                return self._empty_query_results()
+        
+        # 緊急モード検出
+        if self._is_emergency_mode():
+            logger.info("緊急オフラインモード: ローカルインデックスを検索します")
             
             try:
                 # クエリの埋め込みを生成
                 query_embedding = self.embeddings.embed_query(query)
-                
-                # コサイン類似度を計算
-                cos_scores = []
-                for vec in self.offline_storage["vectors"]:
-                    # 簡易的なコサイン類似度計算
-                    dot_product = sum(a*b for a, b in zip(query_embedding, vec))
-                    magnitude1 = sum(a*a for a in query_embedding) ** 0.5
-                    magnitude2 = sum(b*b for b in vec) ** 0.5
-                    similarity = dot_product / (magnitude1 * magnitude2) if magnitude1 * magnitude2 > 0 else 0
-                    cos_scores.append(similarity)
-                
-                # フィルター条件の適用（簡易的）
-                filtered_indices = list(range(len(cos_scores)))
-                if filter_conditions:
-                    filtered_indices = []
-                    for i, metadata in enumerate(self.offline_storage["metadata"]):
-                        match = True
-                        for key, value in filter_conditions.items():
-                            if key in metadata and metadata[key] != value:
-                                match = False
-                                break
-                        if match:
-                            filtered_indices.append(i)
-                
-                # スコアでソートして上位n_results件を取得
-                sorted_indices = sorted(filtered_indices, key=lambda i: cos_scores[i], reverse=True)[:n_results]
-                
-                # 結果を構築
-                results = {
-                    "ids": [[self.offline_storage["ids"][i] for i in sorted_indices]],
-                    "documents": [[self.offline_storage["metadata"][i].get("text", "") for i in sorted_indices]],
-                    "distances": [[1.0 - cos_scores[i] for i in sorted_indices]],
-                    "metadatas": [[{k: v for k, v in self.offline_storage["metadata"][i].items() if k != "text"} for i in sorted_indices]]
-                }
-                
-                logger.info(f"緊急モード: {len(sorted_indices)}件の結果をメモリ内ストレージから検索しました")
-                return results
+                return self._offline_search(query_embedding, n_results, filter_conditions)
             except Exception as e:
                 logger.error(f"緊急モードでの検索中にエラー: {e}")
                 logger.error(traceback.format_exc())
         
         if not self.available:
-            return {"ids": [[]], "documents": [[]], "distances": [[]], "metadatas": [[]]}
+            return self._empty_query_results()
         
         try:
-            # クエリの埋め込みを生成
-            query_embedding = self.embeddings.embed_query(query)
-            
-            # フィルター条件の処理
-            filter_dict = {}
-            if filter_conditions:
-                for key, value in filter_conditions.items():
-                    if key and value:
-                        filter_dict[key] = {"$eq": value}
-            
             # 公式SDKがある場合はSDKを使用
             if hasattr(self.pinecone_client, 'index'):
+                # クエリの埋め込みを生成
+                query_embedding = self.embeddings.embed_query(query)
+                filter_dict = self._build_filter(filter_conditions)
+                
                 query_response = self.pinecone_client.index.query(
                     vector=query_embedding,
                     top_k=n_results,
@@ -579,105 +974,615 @@ class PineconeVectorStore:
                 )
                 
                 # ChromaDB形式の結果に変換
-                results = {
-                    "ids": [[]],
-                    "documents": [[]],
-                    "distances": [[]],
-                    "metadatas": [[]]
-                }
+                return self._results_from_matches(query_response.matches if query_response else None)
                 
-                if query_response and query_response.matches:
-                    for match in query_response.matches:
-                        results["ids"][0].append(match.id)
-                        results["documents"][0].append(match.metadata.get("text", ""))
-                        results["distances"][0].append(1.0 - match.score)  # cosine類似度を距離に変換
-                        
-                        # テキスト以外のメタデータを取得
-                        metadata = {k: v for k, v in match.metadata.items() if k != "text"}
-                        results["metadatas"][0].append(metadata)
-                
-                return results
-                
-            # REST APIで検索
-            api_url = f"https://api.pinecone.io/query/{self.pinecone_client.index_name}"
-            data = {
-                "vector": query_embedding,
-                "topK": n_results,
-                "includeMetadata": True,
-                "filter": filter_dict if filter_dict else None,
-                "namespace": self.namespace
-            }
-            
-            response = self.pinecone_client._make_request(
-                method="POST",
-                url=api_url,
-                json_data=data
-            )
-            
-            # ChromaDB形式の結果に変換
-            results = {
-                "ids": [[]],
-                "documents": [[]],
-                "distances": [[]],
-                "metadatas": [[]]
-            }
-            
-            if response and response.status_code == 200:
-                try:
-                    data = response.json()
-                    if "matches" in data:
-                        for match in data["matches"]:
-                            results["ids"][0].append(match.get("id", ""))
-                            results["documents"][0].append(match.get("metadata", {}).get("text", ""))
-                            results["distances"][0].append(1.0 - match.get("score", 0))  # cosine類似度を距離に変換
-                            
-                            # テキスト以外のメタデータを取得
-                            metadata = {k: v for k, v in match.get("metadata", {}).items() if k != "text"}
-                            results["metadatas"][0].append(metadata)
-                except Exception as e:
-                    logger.error(f"検索結果の処理中にエラーが発生しました: {e}")
-            
-            return results
+            # REST APIで検索（非同期クライアント上で実行）
+            return self.async_client.run_sync(self.asearch(query, n_results, filter_conditions))
         except Exception as e:
             logger.error(f"検索中にエラーが発生しました: {e}")
             logger.error(traceback.format_exc())
-            return {"ids": [[]], "documents": [[]], "distances": [[]], "metadatas": [[]]}
+            return self._empty_query_results()
+
+    def _count_from_stats(self, stats):
+        """統計からドキュメント数を求める（パーティション分割時は全パーティションの合計）"""
+        namespaces = stats["namespaces"]
+        count = namespaces.get(self.namespace, 0)
+        if self.partition_key:
+            prefix = f"{self.partition_key}{PARTITION_SEPARATOR}"
+            count += sum(value for name, value in namespaces.items() if name.startswith(prefix))
+        return count
 
-    def count(self):
-        """ドキュメント数を取得"""
+    def namespace_counts(self, wait=True):
+        """名前空間ごとのベクトル数（キャッシュ済みの統計から取得）"""
+        if not self.available:
+            return {}
+        return self.stats_cache.namespace_counts(wait=wait)
+
+    def search_many(self, queries, n_results=5, filter_conditions=None, mode=None, mmr=None):
+        """複数のクエリをまとめて検索（埋め込みは1回のAPI呼び出し、検索は並行に実行）
+
+        filter_conditions には全クエリ共通の条件か、クエリごとの条件のリストを指定できる。
+        戻り値はクエリごとに1行のChromaDB形式の結果。条件のリストの長さがクエリ数と異なる場合はValueErrorを送出する。
+        """
+        queries = list(queries)
+        conditions_list = self._conditions_per_query(queries, filter_conditions)
+        try:
+            return self.async_client.run_sync(self.asearch_many(queries, n_results, conditions_list, mode=mode, mmr=mmr))
+        except Exception as e:
+            logger.error(f"複数クエリの検索中にエラーが発生しました: {e}")
+            logger.error(traceback.format_exc())
+            return self._merge_query_results([self._empty_query_results() for _ in queries])
+
+    def count(self, wait=True):
+        """ドキュメント数を取得（統計はINDEX_STATS_TTLの間キャッシュし、期限切れ後はバックグラウンドで更新）
+
+        wait=False の場合は統計をまだ一度も取得していなければNoneを返す（画面の描画を待たせない）。
+        """
         if not self.available:
             return 0
             
         try:
-            # 公式SDKがある場合はSDKを使用
-            if hasattr(self.pinecone_client, 'index'):
-                stats = self.pinecone_client.index.describe_index_stats()
-                if stats and hasattr(stats, "namespaces") and self.namespace in stats.namespaces:
-                    count = stats.namespaces[self.namespace].vector_count
-                    logger.info(f"Pineconeコレクションには{count}件のドキュメントが登録されています")
-                    return count
-                return 0
-                
-            # REST APIで統計を取得
-            api_url = f"https://api.pinecone.io/describe_index_stats/{self.pinecone_client.index_name}"
-            
-            response = self.pinecone_client._make_request(
-                method="GET",
-                url=api_url
+            stats = self.stats_cache.get(wait=wait)
+            if stats is None:
+                return 0 if wait else None
+            return self._count_from_stats(stats)
+        except Exception as e:
+            logger.error(f"ドキュメント数の取得中にエラーが発生しました: {e}")
+            logger.error(traceback.format_exc())
+            return 0
+
+    # ---- 非同期API（AsyncPineconeClient上で動作） ----
+
+    async def asearch(self, query, n_results=5, filter_conditions=None, mode=None, mmr=None):
+        """クエリに基づいてドキュメントを検索（非同期）"""
+        mode = mode or self.search_mode
+        mmr = self.mmr_enabled if mmr is None else mmr
+        if self._is_emergency_mode():
+            logger.info("緊急オフラインモード: ローカルインデックスを検索します")
+            try:
+                query_embedding = await self.embeddings.aembed_query(query)
+                return self._offline_retrieve(query, query_embedding, n_results, filter_conditions, mode, mmr)
+            except Exception as e:
+                logger.error(f"緊急モードでの検索中にエラー: {e}")
+                logger.error(traceback.format_exc())
+        
+        if not self.available:
+            return self._empty_query_results()
+        
+        try:
+            query_embedding = await self.embeddings.aembed_query(query)
+            return await self._aretrieve(query, query_embedding, n_results, filter_conditions, mode, mmr)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"検索中にエラーが発生しました: {e}")
+            logger.error(traceback.format_exc())
+            return self._empty_query_results()
+
+    async def _aretrieve(self, query, query_embedding, n_results, filter_conditions, mode, mmr=False):
+        """検索モードに応じてPineconeを検索（mmr指定時は多めに取得してMMRで多様化）"""
+        fetch_count = n_results * self.mmr_fetch_factor if mmr else n_results
+        if mode == "hybrid":
+            results = await self._ahybrid_query(query, query_embedding, fetch_count, filter_conditions, include_values=mmr)
+        else:
+            results = await self._aquery_partitions(query_embedding, fetch_count, filter_conditions, include_values=mmr)
+        if mmr:
+            results = self._apply_mmr(results, query_embedding, n_results)
+        return results
+
+    async def _aquery_partitions(self, query_embedding, n_results=5, filter_conditions=None, sparse_vector=None,
+                                 include_values=False):
+        """パーティション分割時は対象の名前空間を検索し、複数の場合は並行に検索して上位n_results件を統合する
+
+        フィルターでパーティションの値が指定されていればその名前空間だけを検索する。
+        """
+        if not self.partition_key:
+            return await self._aquery_embedding(
+                query_embedding, n_results, filter_conditions, sparse_vector=sparse_vector, include_values=include_values
+            )
+        value = (filter_conditions or {}).get(self.partition_key)
+        if value:
+            namespaces = [self._partition_namespace({self.partition_key: value})]
+            # パーティション分割前に既定の名前空間へ登録したチャンクが残っている間は、既定の名前空間も検索する
+            counts = await asyncio.to_thread(self.stats_cache.namespace_counts)
+            if counts.get(self.namespace) and self.namespace not in namespaces:
+                namespaces.append(self.namespace)
+        else:
+            # 統計が未取得の場合は取得を待つため別スレッドで実行
+            namespaces = await asyncio.to_thread(self._partition_namespaces)
+        results_list = await self.async_client.gather_limited([
+            self._aquery_embedding(
+                query_embedding, n_results, filter_conditions,
+                sparse_vector=sparse_vector, include_values=include_values, namespace=namespace
             )
+            for namespace in namespaces
+        ])
+        if len(results_list) == 1:
+            return results_list[0]
+        return self._merge_top_k(results_list, n_results)
+
+    @staticmethod
+    def _merge_top_k(results_list, n_results):
+        """複数の名前空間の検索結果（1クエリ分）を距離の小さい順にn_results件へ統合"""
+        keys = [key for key in ("ids", "documents", "distances", "metadatas", "embeddings") if key in results_list[0]]
+        candidates = (
+            (distance, i, j)
+            for i, results in enumerate(results_list)
+            for j, distance in enumerate(results["distances"][0])
+        )
+        top = heapq.nsmallest(n_results, candidates)
+        return {key: [[results_list[i][key][0][j] for _, i, j in top]] for key in keys}
+
+    async def _aquery_embedding(self, query_embedding, n_results=5, filter_conditions=None, sparse_vector=None,
+                                include_values=False, namespace=None):
+        """埋め込み済みのクエリでPineconeを検索し、ChromaDB形式の結果を返す"""
+        namespace = self.namespace if namespace is None else namespace
+        filter_dict = self._build_filter(filter_conditions)
+        if hasattr(self.pinecone_client, 'index'):
+            # 公式SDKは同期APIのため別スレッドで実行
+            options = {"sparse_vector": sparse_vector} if sparse_vector else {}
+            query_response = await asyncio.to_thread(
+                self.pinecone_client.index.query,
+                vector=query_embedding,
+                top_k=n_results,
+                include_metadata=True,
+                include_values=include_values,
+                filter=filter_dict if filter_dict else None,
+                namespace=namespace,
+                **options
+            )
+            return self._results_from_matches(query_response.matches if query_response else None, include_values)
+        
+        data = await self.async_client.query(
+            vector=query_embedding,
+            top_k=n_results,
+            filter=filter_dict if filter_dict else None,
+            namespace=namespace,
+            include_values=include_values,
+            sparse_vector=sparse_vector
+        )
+        return self._results_from_matches(data.get("matches") if data else None, include_values)
+
+    async def _ahybrid_query(self, query, query_embedding, n_results=5, filter_conditions=None, include_values=False):
+        """ベクトル検索とBM25検索を組み合わせてPineconeを検索
+
+        PINECONE_SPARSE が有効ならPinecone上のスパース・デンス検索（重みはHYBRID_ALPHA）、
+        無効ならPineconeのベクトル検索とローカルのBM25検索の順位を融合する。
+        """
+        lexical = self.offline_index.lexical
+        if self.sparse_enabled:
+            sparse_vector = lexical.encode_query(query)
+            if sparse_vector:
+                alpha = self.hybrid_alpha
+                sparse_vector = {
+                    "indices": sparse_vector["indices"],
+                    "values": [v * (1.0 - alpha) for v in sparse_vector["values"]]
+                }
+                query_embedding = [v * alpha for v in query_embedding]
+            return await self._aquery_partitions(
+                query_embedding, n_results, filter_conditions, sparse_vector=sparse_vector, include_values=include_values
+            )
+        
+        candidates_count = n_results * HYBRID_CANDIDATE_FACTOR
+        dense = await self._aquery_partitions(query_embedding, candidates_count, filter_conditions, include_values=include_values)
+        lexical_rows, _ = self.offline_index.lexical_search(query, candidates_count, filter_conditions)
+        lexical_ids = [self.offline_index.ids[row] for row in lexical_rows]
+        fused_ids, scores = rank_fusion([dense["ids"][0], lexical_ids], n_results)
+        
+        # ChromaDB形式の結果に変換（BM25のみの結果はローカルインデックスから本文を取得）
+        dense_values = dense.get("embeddings", [[]])[0] or [None] * len(dense["ids"][0])
+        dense_hits = {
+            id_: (document, metadata, values)
+            for id_, document, metadata, values in zip(dense["ids"][0], dense["documents"][0], dense["metadatas"][0], dense_values)
+        }
+        results = self._empty_query_results()
+        if include_values:
+            results["embeddings"] = [[]]
+        for id_, score in zip(fused_ids, scores):
+            if id_ in dense_hits:
+                document, metadata, values = dense_hits[id_]
+            else:
+                row = self.offline_index.row_of(id_)
+                if row is None:
+                    continue
+                metadata = self.offline_index.get_metadata(row)
+                document = metadata.pop("text", "")
+                values = None  # MMRではローカルインデックスのベクトルを使う
+            results["ids"][0].append(id_)
+            results["documents"][0].append(document)
+            results["distances"][0].append(1.0 - float(score))
+            results["metadatas"][0].append(metadata)
+            if include_values:
+                results["embeddings"][0].append(values)
+        return results
+
+    @staticmethod
+    def _conditions_per_query(queries, filter_conditions):
+        """フィルター条件をクエリごとのリストにそろえる（リストの長さがクエリ数と異なればValueError）"""
+        if isinstance(filter_conditions, (list, tuple)):
+            if len(filter_conditions) != len(queries):
+                raise ValueError(
+                    f"filter_conditionsの件数（{len(filter_conditions)}）がクエリ数（{len(queries)}）と一致しません"
+                )
+            return list(filter_conditions)
+        return [filter_conditions] * len(queries)
+
+    async def asearch_many(self, queries, n_results=5, filter_conditions=None, mode=None, mmr=None):
+        """複数のクエリをまとめて検索（非同期、戻り値はsearch_manyと同じ）"""
+        mode = mode or self.search_mode
+        mmr = self.mmr_enabled if mmr is None else mmr
+        queries = list(queries)
+        conditions_list = self._conditions_per_query(queries, filter_conditions)
+        if not queries:
+            return self._merge_query_results([])
+        
+        if not self.available and not self._is_emergency_mode():
+            return self._merge_query_results([self._empty_query_results() for _ in queries])
+        
+        # 全クエリの埋め込みを1回のAPI呼び出しで生成
+        query_embeddings = await self.embeddings.aembed_documents(queries)
+        
+        if self._is_emergency_mode():
+            logger.info(f"緊急オフラインモード: {len(queries)}件のクエリをローカルインデックスで検索します")
+            return self._merge_query_results([
+                self._offline_retrieve(query, embedding, n_results, conditions, mode, mmr)
+                for query, embedding, conditions in zip(queries, query_embeddings, conditions_list)
+            ])
+        
+        async def _query(query, embedding, conditions):
+            try:
+                return await self._aretrieve(query, embedding, n_results, conditions, mode, mmr)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"検索中にエラーが発生しました: {e}")
+                return self._empty_query_results()
+        
+        results_list = await self.async_client.gather_limited(
+            [_query(query, embedding, conditions)
+             for query, embedding, conditions in zip(queries, query_embeddings, conditions_list)]
+        )
+        logger.info(f"{len(queries)}件のクエリをまとめて検索しました")
+        return self._merge_query_results(results_list)
+
+    async def aupsert_documents(self, texts, metadatas=None, max_in_flight=None, embed_batch_size=None):
+        """ドキュメントをPineconeにアップロードする（非同期、戻り値はupsert_documentsと同じレポート）
+
+        チャンク分割 → 埋め込み生成（embed_batch_size件ずつ） → アップロードを、
+        容量制限付きのキューでつないだパイプラインとして実行する。アップロードが詰まると
+        埋め込み生成が待機するため、メモリ上のベクトルはキューの容量分に抑えられる。
+        チャンク分割やローカルへの保存などのブロッキングする処理は別スレッドで実行し、
+        共有のイベントループ（他のセッションの検索も使う）では埋め込みとアップロードの待機だけを行う。
+        """
+        max_in_flight = max_in_flight or int(os.environ.get("PINECONE_UPSERT_MAX_IN_FLIGHT", DEFAULT_UPSERT_MAX_IN_FLIGHT))
+        embed_batch_size = embed_batch_size or int(os.environ.get("INGEST_EMBED_BATCH_SIZE", DEFAULT_EMBED_BATCH_SIZE))
+        
+        # 台帳に登録済みのチャンクと比較し、新規・変更されたチャンクだけを取り込む
+        plans = await asyncio.to_thread(self._plan_documents, texts, metadatas)
+        report = self._new_upsert_report()
+        logger.info(f"{len(plans)}件のドキュメントを取り込みます (埋め込みバッチ: {embed_batch_size}, 同時アップロード: {max_in_flight})")
+        
+        # デバッグ情報の出力
+        logger.info("=== デバッグ情報 ===")
+        logger.info(f"インデックス名: {self.index_name}")
+        logger.info(f"名前空間: {self.namespace if self.namespace else 'デフォルト'}")
+        
+        # インデックスの状態確認（キャッシュ済みの統計のみ）
+        self._log_index_stats()
+        
+        # アップロード待ちのバッチ数を制限してバックプレッシャーをかける
+        batch_queue = asyncio.Queue(maxsize=max_in_flight * 2)
+        
+        # 検証で除外したベクトル（失敗として扱い、台帳には記録しない）
+        invalid = []
+        
+        async def _produce():
+            started = time.time()
+            chunk_index = 0
+            batch_idx = 0
+            queued = 0
+            pending = {}
+            chunk_iter = self._iter_new_chunks(texts, plans)
+            while True:
+                # チャンク分割は別スレッドで、埋め込みバッチ1つ分ずつ進める
+                sub_batch = await asyncio.to_thread(lambda: list(itertools.islice(chunk_iter, embed_batch_size)))
+                if not sub_batch:
+                    break
+                report["total_vectors"] += len(sub_batch)
+                embeddings = await self.embeddings.aembed_documents([chunk for _, chunk, _, _ in sub_batch])
+                if chunk_index == 0 and embeddings:
+                    logger.info(f"埋め込み次元数: {len(embeddings[0])}")
+                vectors, invalid_ids = await asyncio.to_thread(
+                    self._prepare_vectors, sub_batch, embeddings,
+                    f" (チャンク {chunk_index + 1}〜{chunk_index + len(sub_batch)})"
+                )
+                invalid.extend(invalid_ids)
+                
+                # 名前空間ごとにバッチを組む（チャンクIDごとの登録先はパーティション分割時はドキュメントごとに異なる）
+                namespaces = {cid: namespace for cid, _, _, namespace in sub_batch}
+                for vector in vectors:
+                    pending.setdefault(namespaces[vector["id"]], []).append(vector)
+                for namespace, buffered in pending.items():
+                    while len(buffered) >= BATCH_SIZE:
+                        await batch_queue.put((batch_idx, queued, buffered[:BATCH_SIZE], namespace))
+                        if batch_idx == 0:
+                            logger.info(f"最初のバッチを送信キューに投入しました ({time.time() - started:.2f}秒)")
+                        del buffered[:BATCH_SIZE]
+                        queued += BATCH_SIZE
+                        batch_idx += 1
+                chunk_index += len(sub_batch)
             
-            if response and response.status_code == 200:
-                try:
-                    data = response.json()
-                    if "namespaces" in data and self.namespace in data["namespaces"]:
-                        count = data["namespaces"][self.namespace].get("vector_count", 0)
-                        logger.info(f"Pineconeコレクションには{count}件のドキュメントが登録されています")
-                        return count
-                except Exception as e:
-                    logger.error(f"レスポンスの解析中にエラーが発生しました: {e}")
+            for namespace, buffered in pending.items():
+                if buffered:
+                    await batch_queue.put((batch_idx, queued, buffered, namespace))
+                    queued += len(buffered)
+                    batch_idx += 1
+            report["skipped_count"] = sum(len(plan["chunk_ids"]) - len(plan["new_ids"]) for plan in plans)
+            logger.info(f"{report['total_vectors']}件のチャンクを送信キューに投入しました (変更なし: {report['skipped_count']}件)")
+            await batch_queue.put(None)
+        
+        producer = asyncio.ensure_future(_produce())
+        consumer = asyncio.ensure_future(self._aupsert_stream(batch_queue, report, max_in_flight))
+        try:
+            # どちらかのステージが失敗した場合はもう一方も止める
+            await asyncio.wait({producer, consumer}, return_when=asyncio.FIRST_EXCEPTION)
+            for stage, other in ((producer, consumer), (consumer, producer)):
+                if stage.done() and not stage.cancelled() and stage.exception():
+                    other.cancel()
+                    raise stage.exception()
+            await producer
+            report = await consumer
+            if invalid:
+                report["failed_ids"].extend(invalid)
+                report["success"] = False
+            await self._afinalize_documents(plans, report)
+            failed = set(report["failed_ids"])
+            for plan in plans:
+                self.stats_cache.apply_delta(plan["namespace"], len(plan["new_ids"] - failed))
+            return report
+        except asyncio.CancelledError:
+            producer.cancel()
+            consumer.cancel()
+            raise
+        except Exception as e:
+            producer.cancel()
+            consumer.cancel()
+            logger.error(f"ドキュメントのアップロード中にエラーが発生しました: {str(e)}")
+            logger.error(traceback.format_exc())
+            report["success"] = False
+            report["error"] = str(e)
+            return report
+
+    async def _afinalize_documents(self, plans, report):
+        """アップロード結果を台帳に反映し、ドキュメントからなくなったチャンクを削除する
+
+        なくなったチャンクは、台帳に登録済みのチャンクのうち今回の分割で現れなかったもの。
+        新しいチャンクのアップロードに失敗したドキュメントは古いチャンクを残し、
+        失敗したチャンクは台帳に記録しない（次回の登録で再度アップロードされる）。
+        """
+        failed = set(report["failed_ids"])
+        for plan in plans:
+            plan["removed_ids"] = plan["known_ids"] - set(plan["chunk_ids"])
+        removable = [
+            cid for plan in plans if not (plan["new_ids"] & failed)
+            for cid in plan["removed_ids"]
+        ]
+        not_deleted = set()
+        if removable:
+            await asyncio.to_thread(self._delete_local, removable)
+            not_deleted = await self._adelete_batches(removable)
+            report["deleted_count"] = len(removable) - len(not_deleted)
+            logger.info(f"ドキュメントからなくなった{report['deleted_count']}件のチャンクを削除しました")
+        
+        if self.manifest is not None:
+            await asyncio.to_thread(self._record_documents, plans, failed, not_deleted)
+
+    def _delete_local(self, ids):
+        """ローカルのインデックスとチャンクストアからチャンクを削除"""
+        self.offline_index.delete(ids)
+        if self.chunk_store:
+            self.chunk_store.delete(ids)
+
+    def _record_documents(self, plans, failed, not_deleted):
+        """アップロード結果を台帳に記録"""
+        for plan in plans:
+            # 削除できなかったチャンクは台帳に残し、次回の登録で再度削除する
+            recorded = [cid for cid in plan["chunk_ids"] if cid not in failed]
+            recorded.extend(cid for cid in plan["removed_ids"] if cid in not_deleted or plan["new_ids"] & failed)
+            # 今回アップロードしたチャンクは登録先の名前空間を記録する（既存のチャンクは記録済みの登録先のまま）
+            namespaces = {cid: plan["namespace"] for cid in plan["new_ids"] if cid not in failed}
+            try:
+                self.manifest.record(
+                    plan["doc_id"], plan["name"], plan["fingerprint"], plan["metadata"], recorded, namespaces
+                )
+            except Exception as e:
+                logger.error(f"ドキュメント台帳の更新中にエラー: {e}")
+
+    async def _afetch_page(self, ids, namespace=None):
+        """1ページ分のIDをPineconeから取得し、(ID, 本文, メタデータ) のリストを返す"""
+        namespace = self.namespace if namespace is None else namespace
+        try:
+            if hasattr(self.pinecone_client, 'index'):
+                # 公式SDKは同期APIのため別スレッドで実行
+                fetch_response = await asyncio.to_thread(self.pinecone_client.index.fetch, ids=ids, namespace=namespace)
+                vectors = {
+                    id_: {"metadata": vector.metadata or {}}
+                    for id_, vector in (fetch_response.vectors if fetch_response and fetch_response.vectors else {}).items()
+                }
+            else:
+                data = await self.async_client.fetch(ids, namespace=namespace)
+                vectors = data.get("vectors", {}) if data else {}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"ドキュメント取得中のエラー ({len(ids)}件): {e}")
+            logger.error(traceback.format_exc())
+            return []
+        
+        items = []
+        for id_, vector in vectors.items():
+            metadata = vector.get("metadata") or {}
+            # テキスト以外のメタデータを取得
+            items.append((id_, metadata.get("text", ""), {k: v for k, v in metadata.items() if k != "text"}))
+        return items
+
+    async def aiter_documents(self, ids, page_size=FETCH_BATCH_SIZE):
+        """ドキュメントを (ID, 本文, メタデータ) として逐次返す（非同期ジェネレーター）
+
+        チャンクストアにあるIDはネットワークを使わずに返し、残りはpage_size件ずつのページに分けて
+        同時実行数を制限しながら並行に取得する。結果は取得できたページから順に返す。
+        """
+        ids = list(dict.fromkeys(ids or []))
+        local = {}
+        if self.chunk_store and ids:
+            try:
+                local = self.chunk_store.get_many(ids)
+            except Exception as e:
+                logger.error(f"チャンクストアの読み込み中にエラー: {e}")
+        for id_, (text, metadata) in local.items():
+            yield id_, text, metadata
+        
+        remote = [id_ for id_ in ids if id_ not in local]
+        if not remote or not self.available:
+            return
+        pages = [
+            (namespace, group[i:i + page_size])
+            for namespace, group in self._namespaces_for_ids(remote).items()
+            for i in range(0, len(group), page_size)
+        ]
+        logger.info(f"{len(remote)}件のドキュメントを{len(pages)}ページに分けて取得します (ローカル: {len(local)}件)")
+        
+        semaphore = asyncio.Semaphore(self.async_client.max_concurrency)
+        
+        async def _fetch(namespace, page):
+            async with semaphore:
+                return await self._afetch_page(page, namespace)
+        
+        tasks = [asyncio.ensure_future(_fetch(namespace, page)) for namespace, page in pages]
+        try:
+            for future in asyncio.as_completed(tasks):
+                for item in await future:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _adelete_batch(self, ids, namespace):
+        """1バッチを削除し、成功したかどうかを返す（公式SDKがあればSDK、なければREST APIを使う）"""
+        if not hasattr(self.pinecone_client, 'index'):
+            return await self.async_client.delete(ids, namespace=namespace)
+        try:
+            # 公式SDKは同期APIのため別スレッドで実行
+            await asyncio.to_thread(self.pinecone_client.index.delete, ids=ids, namespace=namespace)
+            return True
+        except Exception as e:
+            logger.error(f"ベクトル削除エラー ({len(ids)}件, 名前空間: {namespace or 'デフォルト'}): {e}")
+            return False
+
+    async def _adelete_batches(self, ids):
+        """IDを名前空間ごと・DELETE_BATCH_SIZE件ずつのバッチに分けて並行に削除し、削除できなかったIDの集合を返す"""
+        groups = await asyncio.to_thread(self._namespaces_for_ids, ids)
+        batches = [
+            (namespace, group[i:i + DELETE_BATCH_SIZE])
+            for namespace, group in groups.items()
+            for i in range(0, len(group), DELETE_BATCH_SIZE)
+        ]
+        results = await self.async_client.gather_limited(
+            [self._adelete_batch(batch, namespace) for namespace, batch in batches]
+        )
+        not_deleted = set()
+        deleted = {}
+        for (namespace, batch), ok in zip(batches, results):
+            if ok:
+                deleted.setdefault(namespace, []).extend(batch)
+            else:
+                not_deleted.update(batch)
+        self._apply_deleted(deleted, len({id_ for batch in deleted.values() for id_ in batch}))
+        return not_deleted
+
+    async def aget_documents(self, ids=None):
+        """ドキュメントを取得（非同期、結果は指定したIDの順）"""
+        results = {"ids": [], "documents": [], "metadatas": []}
+        if not self.available or ids is None:
+            return results
+        
+        try:
+            found = {id_: (text, metadata) async for id_, text, metadata in self.aiter_documents(ids)}
+            for id_ in dict.fromkeys(ids):
+                if id_ in found:
+                    results["ids"].append(id_)
+                    results["documents"].append(found[id_][0])
+                    results["metadatas"].append(found[id_][1])
+            return results
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"ドキュメント取得中のエラー: {e}")
+            logger.error(traceback.format_exc())
+            return {"ids": [], "documents": [], "metadatas": []}
+
+    async def adelete_documents(self, ids):
+        """ドキュメントを削除（非同期）"""
+        if not self.available or not ids:
+            return False
+        
+        try:
+            # ローカルインデックスからも削除（転置インデックスも更新される）
+            await asyncio.to_thread(self._delete_local, ids)
+            not_deleted = await self._adelete_batches(list(ids))
+            if self.manifest:
+                await asyncio.to_thread(self.manifest.remove_chunks, [id_ for id_ in ids if id_ not in not_deleted])
+            if not not_deleted:
+                logger.info(f"{len(ids)}件のドキュメントを削除しました")
+                return True
+            logger.error(f"ドキュメント削除エラー ({len(not_deleted)}/{len(ids)}件)")
+            return False
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"ドキュメント削除中のエラー: {e}")
+            logger.error(traceback.format_exc())
+            return False
+
+    async def adelete_document(self, doc_id):
+        """ドキュメント（登録したファイル）の全チャンクを削除（非同期）"""
+        if not self.available or self.manifest is None:
+            return False
+        
+        try:
+            ids = sorted(await asyncio.to_thread(self.manifest.chunk_ids, doc_id))
+            if not ids:
+                logger.warning(f"ドキュメント {doc_id} のチャンクは台帳に登録されていません")
+                return False
+            await asyncio.to_thread(self._delete_local, ids)
+            not_deleted = await self._adelete_batches(ids)
             
+            # 削除できたチャンクだけを台帳から外す（残ったチャンクは再度削除できる）
+            await asyncio.to_thread(self.manifest.remove_chunks, [cid for cid in ids if cid not in not_deleted])
+            if not_deleted:
+                logger.error(f"ドキュメント {doc_id}: {len(not_deleted)}/{len(ids)}件のチャンクの削除に失敗しました")
+                return False
+            logger.info(f"ドキュメント {doc_id} の{len(ids)}件のチャンクを削除しました")
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"ドキュメント削除中のエラー: {e}")
+            logger.error(traceback.format_exc())
+            return False
+
+    async def acount(self):
+        """ドキュメント数を取得（非同期）"""
+        if not self.available:
             return 0
+        
+        try:
+            # キャッシュが空の場合の取得は同期APIのため別スレッドで実行
+            stats = await asyncio.to_thread(self.stats_cache.get)
+            return self._count_from_stats(stats) if stats else 0
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"ドキュメント数の取得中にエラーが発生しました: {e}")
             logger.error(traceback.format_exc())
-            return 0 
\ No newline at end of file
+            return 0
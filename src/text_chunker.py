@@ -0,0 +1,152 @@
+import os
+import re
+import math
+import logging
+from functools import lru_cache
+
+# tiktokenのインポートを試みる（langchain-openaiの依存として導入済み）
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except Exception as e:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+# ロガーの設定
+logger = logging.getLogger('app.text_chunker')
+
+# チャンクサイズと重なりのデフォルト（環境変数 CHUNK_MAX_TOKENS / CHUNK_OVERLAP_TOKENS で上書き可能）
+DEFAULT_MAX_TOKENS = 400
+DEFAULT_OVERLAP_TOKENS = 50
+# トークン数の計測に使うエンコーディング（環境変数 CHUNK_TOKENIZER で上書き可能）
+DEFAULT_ENCODING = "cl100k_base"
+# トークン数をキャッシュする文の数
+TOKEN_CACHE_SIZE = 65536
+
+# チャンク内で段落を連結する区切り
+PARAGRAPH_SEPARATOR = "\n\n"
+# 段落の区切り（空行）
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t　]*\n+")
+# 文の区切り（。！？または改行の後。閉じ括弧は前の文に含める）
+_SENTENCE = re.compile(r".+?(?:[。！？!?]+[」』）)]*\n?|\n|$)", re.S)
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(name):
+    """エンコーディングを取得（初回はネットワークから取得するため、失敗時はNoneを返して以降は文字数で計測）"""
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"tiktokenのエンコーディング {name} を取得できないため、文字数で計測します: {e}")
+        return None
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def count_tokens(text, encoding_name=DEFAULT_ENCODING):
+    """トークン数を返す（tiktokenが使えない場合は文字数）"""
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return len(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_sentences(text):
+    """テキストを段落ごとの文のリストに分割"""
+    paragraphs = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        sentences = [s for s in _SENTENCE.findall(paragraph.strip()) if s.strip()]
+        if sentences:
+            paragraphs.append(sentences)
+    return paragraphs
+
+
+class TextChunker:
+    """日本語の文・段落の境界で区切り、トークン数でサイズを揃えるチャンク分割
+
+    文（。！？・改行）を単位にmax_tokens以下になるまで詰め、次のチャンクの先頭には
+    直前のチャンク末尾の文をoverlap_tokens以内で重ねる。1文がmax_tokensを超える場合のみ文の途中で分割する。
+    文ごとのトークン数はキャッシュするため、同じテキストを再度分割する場合は計測を省略できる。
+    """
+
+    def __init__(self, max_tokens=None, overlap_tokens=None, encoding_name=None):
+        self.max_tokens = max_tokens or int(os.environ.get("CHUNK_MAX_TOKENS", DEFAULT_MAX_TOKENS))
+        if overlap_tokens is None:
+            overlap_tokens = int(os.environ.get("CHUNK_OVERLAP_TOKENS", DEFAULT_OVERLAP_TOKENS))
+        self.overlap_tokens = min(overlap_tokens, self.max_tokens // 2)
+        self.encoding_name = encoding_name or os.environ.get("CHUNK_TOKENIZER", DEFAULT_ENCODING)
+
+    def count(self, text):
+        return count_tokens(text, self.encoding_name)
+
+    def _split_long(self, sentence):
+        """max_tokensを超える文を文字数で均等に分割"""
+        pieces = math.ceil(self.count(sentence) / self.max_tokens)
+        size = math.ceil(len(sentence) / pieces)
+        for i in range(0, len(sentence), size):
+            piece = sentence[i:i + size]
+            if self.count(piece) > self.max_tokens and len(piece) > 1:
+                yield from self._split_long(piece)
+            else:
+                yield piece
+
+    def _units(self, text):
+        """(文, トークン数, 段落の先頭か) を順に返す"""
+        for paragraph in split_sentences(text):
+            first = True
+            for sentence in paragraph:
+                tokens = self.count(sentence)
+                if tokens <= self.max_tokens:
+                    yield sentence, tokens, first
+                else:
+                    for piece in self._split_long(sentence):
+                        yield piece, self.count(piece), first
+                        first = False
+                first = False
+
+    @staticmethod
+    def _join(units):
+        """文を連結（段落の先頭には空行を入れる）"""
+        parts = []
+        for i, (sentence, _, paragraph_start) in enumerate(units):
+            if i and paragraph_start:
+                parts.append(PARAGRAPH_SEPARATOR)
+            parts.append(sentence)
+        return "".join(parts).strip()
+
+    @staticmethod
+    def _cost(units, separator_tokens):
+        """連結後のトークン数（文のトークン数と、2文目以降の段落の先頭に入る区切りのトークン数の合計）"""
+        return sum(unit[1] for unit in units) + separator_tokens * sum(1 for unit in units[1:] if unit[2])
+
+    def iter_chunks(self, text):
+        """テキストをチャンクに分割して逐次返す（段落の区切りもmax_tokensに含めて数える）"""
+        separator_tokens = self.count(PARAGRAPH_SEPARATOR)
+        current = []
+        current_tokens = 0
+        for unit in self._units(text):
+            tokens = unit[1] + (separator_tokens if unit[2] else 0)
+            if current and current_tokens + tokens > self.max_tokens:
+                yield self._join(current)
+                # 末尾の文をoverlap_tokens以内で次のチャンクに引き継ぐ
+                overlap = []
+                for prev in reversed(current):
+                    candidate = [prev] + overlap
+                    if (self._cost(candidate, separator_tokens) > self.overlap_tokens
+                            or self._cost(candidate + [unit], separator_tokens) > self.max_tokens):
+                        break
+                    overlap = candidate
+                current = overlap
+                current_tokens = self._cost(current, separator_tokens)
+                tokens = unit[1] + (separator_tokens if unit[2] and current else 0)
+            elif not current:
+                tokens = unit[1]
+            current.append(unit)
+            current_tokens += tokens
+        if current:
+            yield self._join(current)
+
+    def split(self, text):
+        """テキストをチャンクのリストに分割"""
+        return list(self.iter_chunks(text))
@@ -0,0 +1,59 @@
+import numpy as np
+
+from src.bm25_index import BM25Index, rank_fusion, tokenize
+
+
+def test_tokenize_splits_japanese_into_bigrams_and_keeps_words():
+    assert tokenize("住民票の写し ＡＢＣ-123") == ["住民", "民票", "票の", "の写", "写し", "abc-123"]
+    assert tokenize("窓") == ["窓"]
+
+
+def _index(path=None):
+    index = BM25Index(path)
+    index.add([0, 1, 2], ["住民票の写しを取得する", "戸籍謄本の請求方法", "住民票と印鑑登録証明書"])
+    return index
+
+
+def test_search_ranks_matching_documents():
+    index = _index()
+    rows, scores = index.search("住民票の写し", n_results=5)
+    assert rows.tolist() == [0, 2]
+    assert scores[0] > scores[1] > 0
+
+
+def test_search_respects_candidates_and_delete():
+    index = _index()
+    rows, _ = index.search("住民票", candidates=np.array([2]))
+    assert rows.tolist() == [2]
+
+    index.delete([0])
+    assert len(index) == 2
+    rows, _ = index.search("住民票")
+    assert rows.tolist() == [2]
+
+
+def test_index_is_reopened_from_disk(tmp_path):
+    path = str(tmp_path / "bm25.sqlite3")
+    _index(path).delete([1])
+    reopened = BM25Index(path)
+    assert len(reopened) == 2
+    assert reopened.max_row == 2
+    assert reopened.search("住民票")[0].tolist() == [0, 2]
+
+
+def test_sparse_vectors_have_sorted_indices():
+    index = _index()
+    for sparse in (index.encode_document("住民票の写しと住民票"), index.encode_query("住民票の写し")):
+        assert sparse["indices"] == sorted(sparse["indices"])
+        assert len(sparse["indices"]) == len(sparse["values"]) > 0
+    assert index.encode_query("!!") is None
+
+
+def test_rank_fusion_orders_by_reciprocal_rank():
+    keys, scores = rank_fusion([["a", "b", "c"], ["a", "c"]], n_results=2)
+    assert keys == ["a", "c"]
+    assert scores[0] == 1.0
+    assert scores[1] < 1.0
+
+    keys, _ = rank_fusion([np.array([3, 1])], n_results=5)
+    assert keys == [3, 1] and all(type(key) is int for key in keys)
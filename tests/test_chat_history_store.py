@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+from components.chat_history_store import PineconeChatHistoryBackend, SQLiteChatHistoryBackend
+
+
+def _messages(*contents):
+    return [{"role": "user", "content": content, "metadata": {}} for content in contents]
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SQLiteChatHistoryBackend(str(tmp_path / "chat_history.sqlite3"))
+
+
+def test_load_since_returns_messages_saved_after_the_time(backend, monkeypatch):
+    monkeypatch.setattr(time, "time", lambda: 1000.0)
+    backend.save(_messages("a", "b"), "s1")
+    monkeypatch.setattr(time, "time", lambda: 2000.0)
+    backend.save(_messages("a", "b", "c"), "s1")
+    backend.save(_messages("x"), "s2")
+
+    assert backend.load_since("s1", 1500.0) == _messages("c")
+    assert backend.load_since("s1", 0) == _messages("a", "b", "c")
+
+
+def test_session_time_index_is_kept_on_reopen(backend):
+    # 既存のデータベースを開き直しても (セッションID, 時刻) の索引は残る
+    reopened = SQLiteChatHistoryBackend(backend.path)
+    columns = [row[2] for row in reopened._conn.execute("PRAGMA index_info(idx_chat_messages_time)")]
+    assert columns == ["session_id", "created_at"]
+
+
+def test_backend_without_time_lookup_raises():
+    backend = PineconeChatHistoryBackend(client=type("Client", (), {"available": False})())
+    with pytest.raises(NotImplementedError):
+        backend.load_since("s1", 0)
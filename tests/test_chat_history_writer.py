@@ -0,0 +1,136 @@
+import threading
+
+import pytest
+
+from components.chat_history_store import SQLiteChatHistoryBackend
+from components.chat_history_writer import ChatHistoryWriter
+
+
+def _message(i):
+    return {"role": "user" if i % 2 == 0 else "assistant", "content": f"メッセージ{i}", "metadata": {}}
+
+
+class _Window:
+    """ChatHistory と同じように直近window件だけを保持し、追加のたびに保存を予約する会話"""
+
+    def __init__(self, writer, backend, session_id="s1", window=3):
+        self.writer = writer
+        self.backend = backend
+        self.session_id = session_id
+        self.window = window
+        self.history = []
+        self.offset = 0
+        self.total = 0
+
+    def add(self, count=1, save=None):
+        for _ in range(count):
+            self.history.append(_message(self.total))
+            self.total += 1
+            if len(self.history) > self.window:
+                self.history.pop(0)
+                self.offset += 1
+            self.writer.submit(self.session_id, self.history, save or self.backend.save, offset=self.offset)
+
+    def clear(self):
+        self.history = []
+        self.offset = 0
+        self.writer.submit(self.session_id, self.history, self.backend.save, offset=0, reset=True)
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SQLiteChatHistoryBackend(str(tmp_path / "chat_history.sqlite3"))
+
+
+@pytest.fixture
+def writer():
+    # 期限では保存させず、flush() で保存のタイミングを決める
+    writer = ChatHistoryWriter(debounce=60, max_delay=60)
+    yield writer
+    writer.close()
+
+
+def test_messages_evicted_between_flushes_are_saved(writer, backend):
+    chat = _Window(writer, backend)
+    chat.add(5)
+    assert writer.flush("s1", timeout=5)
+    assert backend.load("s1") == [_message(i) for i in range(5)]
+
+    # 前回の保存済みの位置より後ろのメッセージも、保存前に窓から溢れる
+    chat.add(4)
+    assert chat.offset > 5
+    assert writer.flush("s1", timeout=5)
+    assert backend.load("s1") == [_message(i) for i in range(9)]
+
+
+def test_reset_after_eviction_replaces_saved_messages(writer, backend):
+    chat = _Window(writer, backend)
+    chat.add(6)
+    assert writer.flush("s1", timeout=5)
+
+    chat.add(2)
+    chat.clear()
+    chat.add(4)
+    assert writer.flush("s1", timeout=5)
+    assert backend.load("s1") == [_message(i) for i in range(8, 12)]
+
+
+def test_failed_save_is_carried_into_newer_submit(writer, backend):
+    chat = _Window(writer, backend)
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing_save(*args, **kwargs):
+        started.set()
+        release.wait(5)
+        return None
+
+    chat.add(4, save=failing_save)
+    flushed = []
+    flusher = threading.Thread(target=lambda: flushed.append(writer.flush("s1", timeout=5)))
+    flusher.start()
+    assert started.wait(5)
+
+    # 保存に失敗する予約の保存中に、さらに窓から溢れた新しい予約を登録する
+    chat.add(3)
+    release.set()
+    flusher.join(5)
+    assert flushed == [False]
+
+    assert writer.flush("s1", timeout=5)
+    assert backend.load("s1") == [_message(i) for i in range(7)]
+
+
+def test_pending_messages_reads_unsaved_rows_without_waiting(writer, backend):
+    chat = _Window(writer, backend)
+    chat.add(3)
+    assert writer.flush("s1", timeout=5)
+    chat.add(4)
+
+    # 窓から溢れた3番目以降はまだ保存されていない
+    assert backend.count("s1") == 3
+    pending = writer.pending_messages("s1", 0, chat.offset)
+    assert max(pending) == chat.offset - 1
+    stored = backend.load_range("s1", 0, min(pending))
+    assert stored + [pending[i] for i in sorted(pending)] == [_message(i) for i in range(chat.offset)]
+
+
+def test_flush_reports_failed_in_flight_save(writer, backend):
+    chat = _Window(writer, backend)
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing_save(*args, **kwargs):
+        started.set()
+        release.wait(5)
+        return None
+
+    chat.add(2, save=failing_save)
+    writer.flush("s1", timeout=0)
+    assert started.wait(5)
+
+    # 保存中のみ（保存待ちなし）のセッションの失敗もFalseとして報告する
+    releaser = threading.Timer(0.1, release.set)
+    releaser.start()
+    assert writer.flush("s1", timeout=5) is False
+    releaser.join()
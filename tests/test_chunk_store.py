@@ -0,0 +1,50 @@
+import numpy as np
+
+from src.chunk_store import ChunkStore
+from src.offline_vector_index import OfflineVectorIndex
+
+
+def _store(tmp_path, cache_size=2):
+    return ChunkStore(str(tmp_path / "chunk_store.sqlite3"), cache_size=cache_size)
+
+
+def test_put_get_and_delete(tmp_path):
+    store = _store(tmp_path)
+    store.put_many([("c1", "住民票の写し" * 50, {"doc_id": "d"}), ("c2", "短い本文", {})])
+    assert store.get_many(["c1", "c2", "missing"]) == {"c1": ("住民票の写し" * 50, {"doc_id": "d"}), "c2": ("短い本文", {})}
+
+    store.delete(["c1"])
+    assert store.get_texts(["c1", "c2"]) == {"c2": "短い本文"}
+    assert _store(tmp_path).get_texts(["c1", "c2"]) == {"c2": "短い本文"}
+
+
+def test_cache_is_bounded_and_updated_on_put(tmp_path):
+    store = _store(tmp_path)
+    store.put_many([(f"c{i}", f"本文{i}", {"n": i}) for i in range(3)])
+    store.get_many(["c0", "c1", "c2"])
+    assert store.misses == 3 and len(store._cache) == 2
+
+    store.put_many([("c2", "更新", {"n": 9})])
+    assert store.get_many(["c2"]) == {"c2": ("更新", {"n": 9})}
+    assert store.hits == 1
+
+
+def test_returned_metadata_does_not_change_the_cache(tmp_path):
+    store = _store(tmp_path)
+    store.put_many([("c1", "本文", {"n": 1})])
+    store.get_many(["c1"])["c1"][1]["n"] = 2
+    assert store.get_many(["c1"])["c1"][1] == {"n": 1}
+
+
+def test_offline_index_reads_text_from_the_store(tmp_path):
+    store = _store(tmp_path)
+    index = OfflineVectorIndex(path=str(tmp_path / "offline"))
+    index.add(["old"], np.eye(2)[:1], [{"text": "自分で保持する本文"}])
+
+    index.set_text_source(store.get_texts)
+    store.put_many([("new", "ストアの本文", {})])
+    index.add(["new"], np.eye(2)[1:], [{"text": "ストアの本文"}])
+
+    assert (tmp_path / "offline" / "texts.bin").read_bytes() == "自分で保持する本文".encode("utf-8")
+    assert index.get_text(index.row_of("old")) == "自分で保持する本文"
+    assert index.get_metadata(index.row_of("new"))["text"] == "ストアの本文"
@@ -0,0 +1,79 @@
+import sqlite3
+
+from src.document_manifest import (
+    DocumentManifest, chunk_id, content_fingerprint, document_id, metadata_fingerprint,
+)
+
+
+def _manifest(tmp_path, scope="idx/ns"):
+    return DocumentManifest(str(tmp_path / "manifest.sqlite3"), scope=scope)
+
+
+def test_ids_are_stable_and_keyed_by_file_name():
+    metadata = {"municipality": "A市", "file_name": "guide.txt"}
+    assert document_id("本文1", metadata) == document_id("本文2", metadata)
+    assert document_id("本文1", {}) != document_id("本文2", {})
+
+    metadata_hash = metadata_fingerprint(metadata)
+    assert chunk_id("doc_1", "チャンク", metadata_hash) == chunk_id("doc_1", "チャンク", metadata_hash)
+    assert chunk_id("doc_1", "チャンク", metadata_hash) != chunk_id("doc_1", "チャンク", metadata_fingerprint({}))
+    assert content_fingerprint("本文", metadata_hash) != content_fingerprint("本文2", metadata_hash)
+
+
+def test_metadata_fingerprint_ignores_registration_date_and_none():
+    base = {"municipality": "A市", "major_category": "届出"}
+    assert metadata_fingerprint(base) == metadata_fingerprint(
+        {**base, "registration_date": "2024-01-01", "file_name": None}
+    )
+    assert metadata_fingerprint(base) != metadata_fingerprint({**base, "major_category": "税"})
+
+
+def test_record_replaces_chunks_and_keeps_namespaces(tmp_path):
+    manifest = _manifest(tmp_path)
+    manifest.record("doc_1", "guide.txt", "fp1", {"municipality": "A市"}, ["c1", "c2"], {"c1": "ns-a", "c2": "ns-b"})
+    manifest.record("doc_1", "guide.txt", "fp2", {"municipality": "A市"}, ["c2", "c3"], {"c3": "ns-a"})
+
+    assert manifest.chunk_ids("doc_1") == {"c2", "c3"}
+    assert manifest.chunk_namespaces(["c1", "c2", "c3"]) == {"c2": "ns-b", "c3": "ns-a"}
+    assert manifest.namespaces() == ["ns-a", "ns-b"]
+    document = manifest.get_document("doc_1")
+    assert document["fingerprint"] == "fp2" and document["chunk_count"] == 2
+
+
+def test_remove_chunks_drops_empty_documents(tmp_path):
+    manifest = _manifest(tmp_path)
+    manifest.record("doc_1", "a.txt", "fp", {}, ["c1", "c2"])
+    manifest.record("doc_2", "b.txt", "fp", {}, ["c3"])
+
+    manifest.remove_chunks(["c1", "c3"])
+    assert manifest.get_document("doc_1")["chunk_count"] == 1
+    assert manifest.get_document("doc_2") is None
+    assert manifest.count_documents() == 1
+
+
+def test_scopes_and_list_filters_are_separate(tmp_path):
+    manifest = _manifest(tmp_path)
+    manifest.record("doc_1", "a.txt", "fp", {"municipality": "A市", "major_category": "届出"}, ["c1"])
+    manifest.record("doc_2", "b.txt", "fp", {"municipality": "B町", "medium_category": "届出書類"}, ["c2"])
+    assert [d["doc_id"] for d in manifest.list_documents(municipality="A")] == ["doc_1"]
+    assert manifest.count_documents(category="届出") == 2
+
+    other = _manifest(tmp_path, scope="idx/other")
+    assert other.count_documents() == 0
+    assert other.chunk_ids("doc_1") == set()
+
+
+def test_old_manifest_gets_namespace_column(tmp_path):
+    path = str(tmp_path / "manifest.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE chunks (scope TEXT NOT NULL, chunk_id TEXT NOT NULL, doc_id TEXT NOT NULL, "
+                 "PRIMARY KEY (scope, chunk_id))")
+    conn.execute("INSERT INTO chunks VALUES ('s', 'c1', 'doc_1')")
+    conn.commit()
+    conn.close()
+
+    manifest = DocumentManifest(path, scope="s")
+    assert manifest.chunk_ids("doc_1") == {"c1"}
+    # 登録先が不明な既存のチャンクは名前空間の一覧に含めない
+    assert manifest.chunk_namespaces(["c1"]) == {}
+    assert manifest.namespaces() == []
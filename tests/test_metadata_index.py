@@ -0,0 +1,40 @@
+from src.metadata_index import MetadataIndex
+
+
+def _index():
+    index = MetadataIndex()
+    index.add(0, {"municipality": "A市", "major_category": "届出"})
+    index.add(1, {"municipality": "A市", "major_category": "税"})
+    index.add(2, {"municipality": "B町", "major_category": "届出"})
+    # 市区町村を持たない行は、どの市区町村の条件にも一致する
+    index.add(3, {"major_category": "届出", "municipality": ""})
+    return index
+
+
+def test_candidates_intersect_conditions_and_include_missing_fields():
+    rows, remaining = _index().candidates({"municipality": "A市", "major_category": "届出", "file_name": "x.txt"})
+    assert rows == {0, 3}
+    assert remaining == {"file_name": "x.txt"}
+
+
+def test_candidates_without_indexed_conditions():
+    rows, remaining = _index().candidates({"file_name": "x.txt"})
+    assert rows is None
+    assert remaining == {"file_name": "x.txt"}
+
+    rows, _ = _index().candidates({"municipality": "C村"})
+    assert rows == {3}
+
+
+def test_remove_drops_rows_and_empty_values():
+    index = _index()
+    index.remove(2, {"municipality": "B町", "major_category": "届出"})
+    index.remove(3, {"major_category": "届出"})
+    assert index.values("municipality") == {"A市": 2}
+    assert index.values("major_category") == {"届出": 1, "税": 1}
+    assert index.candidates({"municipality": "B町"})[0] == set()
+
+
+def test_to_array_is_sorted():
+    assert MetadataIndex.to_array({5, 1, 3}).tolist() == [1, 3, 5]
+    assert MetadataIndex.to_array(set()).tolist() == []
@@ -0,0 +1,46 @@
+import numpy as np
+
+from src.mmr import maximal_marginal_relevance
+
+
+def _reference(query, embeddings, k, lambda_mult):
+    """選択済みの候補との類似度を毎回計算し直す素朴な実装"""
+    def cos(a, b):
+        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+    selected = []
+    while len(selected) < min(k, len(embeddings)):
+        best, best_score = None, -np.inf
+        for i, vector in enumerate(embeddings):
+            if i in selected:
+                continue
+            redundancy = max((cos(vector, embeddings[j]) for j in selected), default=0.0)
+            score = lambda_mult * cos(vector, query) - (1.0 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        selected.append(best)
+    return selected
+
+
+def test_duplicates_are_pushed_down():
+    query = [1.0, 0.0]
+    embeddings = [[1.0, 0.0], [1.0, 0.01], [0.6, 0.8]]
+    assert maximal_marginal_relevance(query, embeddings, k=2, lambda_mult=0.3) == [0, 2]
+    assert maximal_marginal_relevance(query, embeddings, k=2, lambda_mult=1.0) == [0, 1]
+
+
+def test_matches_the_reference_selection():
+    rnd = np.random.default_rng(0)
+    for _ in range(50):
+        embeddings = rnd.normal(size=(20, 8))
+        query = rnd.normal(size=8)
+        lambda_mult = float(rnd.uniform(0.1, 0.9))
+        assert maximal_marginal_relevance(query, embeddings, k=6, lambda_mult=lambda_mult) == _reference(
+            query, embeddings, 6, lambda_mult
+        )
+
+
+def test_edge_cases():
+    assert maximal_marginal_relevance([1.0, 0.0], [], k=3) == []
+    assert maximal_marginal_relevance([1.0, 0.0], [[1.0, 0.0]], k=0) == []
+    assert maximal_marginal_relevance([1.0, 0.0], [[0.0, 0.0], [1.0, 0.0]], k=5) == [1, 0]
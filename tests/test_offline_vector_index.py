@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+
+import src.offline_vector_index as offline_vector_index
+from src.offline_vector_index import OfflineVectorIndex, open_offline_index
+
+
+@pytest.fixture(autouse=True)
+def exact_search(monkeypatch):
+    # 近似最近傍検索を使わず、全件走査の結果を確認する
+    monkeypatch.setenv("OFFLINE_ANN", "off")
+
+
+def _rows(rnd, n, dim=8, start=0):
+    ids = [f"doc#{i}" for i in range(start, start + n)]
+    vectors = rnd.normal(size=(n, dim)).astype(np.float32)
+    metadatas = [
+        {"text": f"本文{i}", "municipality": "A市" if i % 2 else "B町", "file_name": f"f{i % 3}.txt"}
+        for i in range(start, start + n)
+    ]
+    return ids, vectors, metadatas
+
+
+def _expected(vectors, query, rows, k):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized[rows] @ (query / np.linalg.norm(query))
+    return [rows[i] for i in np.argsort(-scores)[:k]]
+
+
+def test_search_matches_brute_force():
+    rnd = np.random.default_rng(0)
+    ids, vectors, metadatas = _rows(rnd, 300)
+    index = OfflineVectorIndex(initial_capacity=16)
+    index.add(ids[:100], vectors[:100], metadatas[:100])
+    index.add(ids[100:], vectors[100:], metadatas[100:])
+
+    query = rnd.normal(size=8)
+    rows, scores = index.search(query, n_results=10)
+    assert rows.tolist() == _expected(vectors, query, list(range(300)), 10)
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_filters_combine_indexed_and_other_fields():
+    rnd = np.random.default_rng(1)
+    ids, vectors, metadatas = _rows(rnd, 60)
+    index = OfflineVectorIndex()
+    index.add(ids, vectors, metadatas)
+
+    query = rnd.normal(size=8)
+    rows, _ = index.search(query, n_results=5, filter_conditions={"municipality": "A市", "file_name": "f0.txt"})
+    allowed = [i for i in range(60) if i % 2 and i % 3 == 0]
+    assert rows.tolist() == _expected(vectors, query, allowed, 5)
+    assert index.get_metadata(int(rows[0]))["text"] == f"本文{rows[0]}"
+
+
+def test_deleted_and_replaced_rows_are_not_returned():
+    rnd = np.random.default_rng(2)
+    ids, vectors, metadatas = _rows(rnd, 20)
+    index = OfflineVectorIndex()
+    index.add(ids, vectors, metadatas)
+
+    assert index.delete(["doc#0", "doc#1", "missing"]) == 2
+    index.add(["doc#2"], vectors[:1], [{"text": "差し替え"}])
+    assert len(index) == 18
+
+    rows, _ = index.search(vectors[0], n_results=20)
+    assert len(rows) == 18
+    assert not {0, 1, 2} & set(rows.tolist())
+    assert index.row_of("doc#2") == 20
+    assert index.get_text(index.row_of("doc#2")) == "差し替え"
+
+
+def test_dimension_mismatch_is_rejected():
+    index = OfflineVectorIndex()
+    index.add(["a"], [[1.0, 0.0]], [{}])
+    with pytest.raises(ValueError):
+        index.add(["b"], [[1.0, 0.0, 0.0]], [{}])
+
+
+def test_hybrid_search_uses_keywords():
+    index = OfflineVectorIndex()
+    index.add(
+        ["a", "b", "c"],
+        [[1.0, 0.0], [0.9, 0.1], [0.0, 1.0]],
+        [{"text": "住民票の写し"}, {"text": "戸籍謄本"}, {"text": "印鑑登録"}],
+    )
+    rows, _ = index.lexical_search("住民票")
+    assert rows.tolist() == [0]
+    rows, scores = index.hybrid_search("住民票", [1.0, 0.0], n_results=2)
+    assert rows.tolist() == [0, 1]
+    assert scores[0] == pytest.approx(1.0)
+
+
+def test_index_is_reopened_from_disk(tmp_path):
+    rnd = np.random.default_rng(3)
+    ids, vectors, metadatas = _rows(rnd, 30)
+    index = OfflineVectorIndex(path=str(tmp_path))
+    index.add(ids[:10], vectors[:10], metadatas[:10])
+    index.add(ids[10:], vectors[10:], metadatas[10:])
+    index.delete(["doc#5"])
+
+    reopened = OfflineVectorIndex(path=str(tmp_path))
+    assert len(reopened) == 29
+    assert isinstance(reopened._matrix, np.memmap)
+    assert reopened.row_of("doc#5") is None
+    assert reopened.get_metadata(7) == metadatas[7]
+    query = rnd.normal(size=8)
+    assert reopened.search(query, n_results=5)[0].tolist() == index.search(query, n_results=5)[0].tolist()
+    assert reopened.lexical_search("本文7")[0].tolist()[0] == 7
+
+
+def test_data_written_after_the_header_is_discarded(tmp_path):
+    rnd = np.random.default_rng(4)
+    ids, vectors, metadatas = _rows(rnd, 12)
+    index = OfflineVectorIndex(path=str(tmp_path))
+    index.add(ids[:8], vectors[:8], metadatas[:8])
+
+    # ヘッダーを書き換える前に終了した追記を再現する
+    index._append_files(ids[8:], vectors[8:], metadatas[8:])
+
+    reopened = OfflineVectorIndex(path=str(tmp_path))
+    assert len(reopened) == 8
+    assert reopened.row_of("doc#9") is None
+    assert (tmp_path / "vectors.f32").stat().st_size == 8 * 8 * 4
+
+    # 切り捨てた後の追記は正しい行として読める
+    reopened.add(ids[8:], vectors[8:], metadatas[8:])
+    again = OfflineVectorIndex(path=str(tmp_path))
+    assert len(again) == 12
+    assert again.get_metadata(again.row_of("doc#9")) == metadatas[9]
+
+
+def test_truncated_files_are_reported(tmp_path, monkeypatch):
+    rnd = np.random.default_rng(5)
+    ids, vectors, metadatas = _rows(rnd, 4)
+    OfflineVectorIndex(path=str(tmp_path)).add(ids, vectors, metadatas)
+
+    ids_file = tmp_path / "ids.txt"
+    ids_file.write_text("".join(f"{id_}\n" for id_ in ids[:2]), encoding="utf-8")
+    with pytest.raises(ValueError):
+        OfflineVectorIndex(path=str(tmp_path))
+
+    # 共有インデックスを開く場合はメモリ内のみのインデックスで継続する
+    monkeypatch.setattr(offline_vector_index, "_shared_indexes", {})
+    index = open_offline_index(str(tmp_path))
+    assert index.path is None and len(index) == 0
@@ -0,0 +1,55 @@
+import json
+import zlib
+
+import pytest
+
+import components.payload_codec as payload_codec
+from components.payload_codec import (
+    FORMAT_RAW, FORMAT_ZLIB, TEXT_PREFIX, decode_bytes, decode_text, dumps_json, encode_bytes, encode_text,
+)
+
+MESSAGES = [{"role": "user", "content": "住民票の写しはどこで取得できますか？" * 20, "metadata": {"n": 1}}]
+
+
+def test_dumps_json_keeps_japanese_and_drops_spaces():
+    assert dumps_json({"a": "日本語", "b": [1, 2]}) == '{"a":"日本語","b":[1,2]}'.encode("utf-8")
+
+
+def test_small_payload_is_stored_raw():
+    data = encode_bytes({"a": 1})
+    assert data[0] == FORMAT_RAW
+    assert decode_bytes(data) == {"a": 1}
+
+
+@pytest.mark.parametrize("zstd", [True, False])
+def test_bytes_round_trip_and_compress(monkeypatch, zstd):
+    if zstd and not payload_codec.ZSTD_AVAILABLE:
+        pytest.skip("zstandardがインストールされていません")
+    monkeypatch.setattr(payload_codec, "ZSTD_AVAILABLE", zstd)
+    data = encode_bytes(MESSAGES)
+    assert len(data) < len(dumps_json(MESSAGES))
+    assert decode_bytes(data) == MESSAGES
+
+
+def test_zlib_payload_decodes_without_zstd(monkeypatch):
+    monkeypatch.setattr(payload_codec, "ZSTD_AVAILABLE", False)
+    data = encode_bytes(MESSAGES)
+    assert data[0] == FORMAT_ZLIB
+    assert decode_bytes(memoryview(data)) == MESSAGES
+
+
+def test_legacy_untagged_zlib_stream_is_decoded():
+    legacy = zlib.compress(json.dumps(MESSAGES, ensure_ascii=False).encode("utf-8"))
+    assert decode_bytes(legacy) == MESSAGES
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        decode_bytes(b"\x7f{}")
+
+
+def test_text_round_trip_and_legacy_json():
+    text = encode_text(MESSAGES)
+    assert text.startswith(TEXT_PREFIX) and text.isascii()
+    assert decode_text(text) == MESSAGES
+    assert decode_text(json.dumps(MESSAGES, ensure_ascii=False)) == MESSAGES
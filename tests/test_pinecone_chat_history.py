@@ -0,0 +1,102 @@
+import pytest
+
+pytest.importorskip("streamlit")
+
+from components.pinecone_client import INDEX_DIMENSION, PineconeClient
+
+
+class _Records:
+    """PineconeClientのレコード操作をメモリ上で置き換える"""
+
+    def __init__(self):
+        self.records = {}
+        self.upserted = []
+
+    def fetch(self, ids):
+        return {id_: self.records[id_] for id_ in ids if id_ in self.records}
+
+    def upsert(self, records):
+        self.upserted.append([id_ for id_, _ in records])
+        self.records.update(records)
+        return True
+
+    def delete(self, ids):
+        for id_ in ids:
+            self.records.pop(id_, None)
+        return True
+
+
+def _client(records, page_size=3):
+    client = PineconeClient.__new__(PineconeClient)
+    client.available = True
+    client.chat_page_size = page_size
+    client._chat_saved_counts = {}
+    client._chat_page_sizes = {}
+    client._default_chat_session_id = None
+    client._index_dimension = None
+    client._fetch_records = records.fetch
+    client._upsert_records = records.upsert
+    client._delete_records = records.delete
+    return client
+
+
+def _messages(n, start=0):
+    return [{"role": "user", "content": f"m{i}"} for i in range(start, start + n)]
+
+
+def _pages(records, session_id="s"):
+    return sorted(id_ for id_ in records.records if id_.startswith(f"chat_{session_id}_p"))
+
+
+def test_append_writes_only_the_last_page_and_manifest():
+    records = _Records()
+    client = _client(records)
+    client.save_chat_history(_messages(7), "s")
+    client.save_chat_history(_messages(8), "s")
+    assert records.upserted[-1] == ["chat_s_p000002", "chat_s_manifest"]
+    assert client.load_chat_history("s") == _messages(8)
+
+
+def test_reset_deletes_pages_past_the_new_page_count():
+    records = _Records()
+    client = _client(records)
+    client.save_chat_history(_messages(8), "s")
+    # 別のプロセス（保存済みの件数を知らない）からクリアする
+    other = _client(records)
+    other.save_chat_history(_messages(2, start=100), "s", reset=True)
+    assert _pages(records) == ["chat_s_p000000"]
+    assert other.load_chat_history("s") == _messages(2, start=100)
+
+
+def test_page_size_change_with_offset_keeps_the_saved_layout():
+    records = _Records()
+    _client(records, page_size=3).save_chat_history(_messages(7), "s")
+
+    client = _client(records, page_size=5)
+    history = _messages(10)
+    assert client.save_chat_history(history[4:9], "s", offset=4)
+    assert client.save_chat_history(history[5:10], "s", offset=5)
+    assert records.records["chat_s_manifest"]["page_size"] == 3
+    assert client.load_chat_history("s") == history
+
+
+def test_page_size_change_rewrites_from_the_start_when_history_is_in_memory():
+    records = _Records()
+    _client(records, page_size=3).save_chat_history(_messages(7), "s")
+
+    client = _client(records, page_size=5)
+    assert client.save_chat_history(_messages(8), "s")
+    assert records.records["chat_s_manifest"]["page_size"] == 5
+    assert _pages(records) == ["chat_s_p000000", "chat_s_p000001"]
+    assert _client(records, page_size=5).load_chat_history("s") == _messages(8)
+
+
+def test_record_vector_matches_the_index_dimension():
+    client = _client(_Records())
+    client.index_dimension = lambda: None
+    vector = client._record_vector()
+    assert len(vector) == INDEX_DIMENSION and any(vector)
+
+    client = _client(_Records())
+    client.index_dimension = lambda: 8
+    assert client._record_vector() == [1.0] + [0.0] * 7
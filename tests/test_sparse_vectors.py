@@ -0,0 +1,68 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("streamlit")
+pytest.importorskip("langchain_openai")
+
+import components.async_pinecone_client as async_pinecone_client
+from components.async_pinecone_client import AsyncPineconeClient
+from src.bm25_index import BM25Index
+from src.pinecone_vector_store import PineconeVectorStore
+
+
+class _RecordingClient:
+    """送信した本文を記録するHTTPクライアント"""
+
+    def __init__(self):
+        self.bodies = []
+
+    async def request(self, method, url, content=None, **kwargs):
+        self.bodies.append(json.loads(content))
+        return httpx.Response(200, json={"upsertedCount": 1, "matches": []})
+
+
+@pytest.fixture
+def recording_client(monkeypatch):
+    client = _RecordingClient()
+    transport = SimpleNamespace(async_client=lambda: client)
+    monkeypatch.setattr(async_pinecone_client, "get_transport", lambda: transport)
+    return client
+
+
+def _store():
+    store = PineconeVectorStore.__new__(PineconeVectorStore)
+    store.sparse_enabled = True
+    store.offline_index = SimpleNamespace(lexical=BM25Index())
+    return store
+
+
+def test_upsert_payload_uses_rest_sparse_field(recording_client):
+    vectors = _store()._build_vectors(
+        [("doc#1", "住民票の写しはコンビニで取得できます", {"doc_id": "doc"})], [[0.1, 0.2, 0.3]]
+    )
+    result = asyncio.run(AsyncPineconeClient("key", "idx").upsert_batch(vectors, namespace="ns"))
+    assert result["ok"]
+
+    sent = recording_client.bodies[0]["vectors"][0]
+    assert "sparse_values" not in sent
+    sparse = sent["sparseValues"]
+    assert sparse["indices"] == sorted(sparse["indices"])
+    assert len(sparse["indices"]) == len(sparse["values"]) > 0
+    assert all(isinstance(i, int) for i in sparse["indices"])
+
+
+def test_vectors_without_sparse_mode_have_no_sparse_field():
+    store = _store()
+    store.sparse_enabled = False
+    vectors = store._build_vectors([("doc#1", "住民票", {})], [[0.1]])
+    assert "sparseValues" not in vectors[0]
+
+
+def test_query_payload_uses_rest_sparse_field(recording_client):
+    sparse = BM25Index().encode_query("住民票")
+    asyncio.run(AsyncPineconeClient("key", "idx").query([0.1, 0.2, 0.3], sparse_vector=sparse))
+    assert recording_client.bodies[0]["sparseVector"] == sparse
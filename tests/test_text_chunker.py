@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+import src.text_chunker as text_chunker
+from src.text_chunker import TextChunker, split_sentences
+
+
+@pytest.fixture(autouse=True)
+def char_fallback(monkeypatch):
+    # tiktokenの有無によらず、文字数で計測するモードで確認する
+    monkeypatch.setattr(text_chunker, "_get_encoding", lambda name: None)
+    text_chunker.count_tokens.cache_clear()
+    yield
+    text_chunker.count_tokens.cache_clear()
+
+
+def _paragraphs(rnd):
+    return "\n\n".join(
+        "".join("あ" * rnd.randint(1, 15) + "。" for _ in range(rnd.randint(1, 5)))
+        for _ in range(rnd.randint(1, 8))
+    )
+
+
+def test_split_sentences_keeps_closing_brackets_with_the_sentence():
+    assert split_sentences("「はい。」と答えた。次の文！\n\n段落2。") == [["「はい。」", "と答えた。", "次の文！"], ["段落2。"]]
+
+
+def test_paragraph_separator_counts_against_the_budget():
+    chunker = TextChunker(max_tokens=30, overlap_tokens=0)
+    chunks = chunker.split("あ" * 14 + "。\n\n" + "い" * 14 + "。")
+    assert chunks == ["あ" * 14 + "。", "い" * 14 + "。"]
+
+
+def test_chunks_never_exceed_max_tokens():
+    rnd = random.Random(0)
+    for _ in range(500):
+        max_tokens = rnd.randint(10, 60)
+        chunker = TextChunker(max_tokens=max_tokens, overlap_tokens=rnd.randint(0, 20))
+        for chunk in chunker.iter_chunks(_paragraphs(rnd)):
+            assert len(chunk) <= max_tokens
+
+
+def test_overlap_repeats_the_previous_sentences():
+    chunker = TextChunker(max_tokens=12, overlap_tokens=4)
+    chunks = chunker.split("一二三。四五六。七八九。十一二。")
+    assert chunks == ["一二三。四五六。七八九。", "七八九。十一二。"]
+
+
+def test_long_sentence_is_split_evenly():
+    chunker = TextChunker(max_tokens=10, overlap_tokens=0)
+    chunks = chunker.split("長" * 25)
+    assert all(len(chunk) <= 10 for chunk in chunks)
+    assert "".join(chunks) == "長" * 25